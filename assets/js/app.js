@@ -2,38 +2,156 @@ document.addEventListener('DOMContentLoaded', function () {
   const table = document.getElementById('task-table');
   if (!table) return;
 
-  const checkboxes = table.querySelectorAll('.task-completed-checkbox');
-  checkboxes.forEach(checkbox => {
-    checkbox.addEventListener('change', function() {
-      const taskId = this.dataset.taskId;
-      const isChecked = this.checked;
-
-      // We need a CSRF token for Django POST requests
-      const csrftoken = document.querySelector('[name=csrfmiddlewaretoken]').value;
-
-      fetch('/tasks/update-status/', {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-          'X-CSRFToken': csrftoken,
-        },
-        body: JSON.stringify({
+  // Checkbox changes are collected for a short while and then sent as one
+  // batched request, so ticking a bunch of tasks doesn't fire off a request
+  // for every single click.
+  const FLUSH_DELAY_MS = 300;
+  const pending = new Map();
+  let flushTimer = null;
+
+  function flush() {
+    flushTimer = null;
+    if (pending.size === 0) return;
+
+    const batch = new Map(pending);
+    pending.clear();
+
+    // We need a CSRF token for Django POST requests
+    const csrftoken = document.querySelector('[name=csrfmiddlewaretoken]').value;
+
+    fetch('/tasks/update-status/', {
+      method: 'POST',
+      keepalive: true,
+      headers: {
+        'Content-Type': 'application/json',
+        'X-CSRFToken': csrftoken,
+      },
+      body: JSON.stringify({
+        updates: Array.from(batch.entries(), ([taskId, { completed }]) => ({
           task_id: taskId,
-          completed: isChecked,
-        }),
-      })
-      .then(response => {
-        if (!response.ok) {
-          // Revert checkbox state if the update fails
-          this.checked = !isChecked;
-          // Optionally, show an error message to the user
-          console.error('Failed to update task status.');
-        }
-      })
-      .catch(error => {
-        console.error('Error:', error);
-        this.checked = !isChecked;
+          completed: completed,
+        })),
+      }),
+    })
+    .then(response => {
+      if (!response.ok) throw new Error('Failed to update task status.');
+      return response.json();
+    })
+    .then(data => {
+      data.results.forEach(result => {
+        if (result.success) return;
+
+        // Revert the checkbox state of every update that failed
+        const update = batch.get(result.task_id);
+        if (update) update.checkbox.checked = !update.completed;
+        console.error(`Failed to update task ${result.task_id}: ${result.error}`);
+      });
+    })
+    .catch(error => {
+      console.error('Error:', error);
+      batch.forEach(update => {
+        update.checkbox.checked = !update.completed;
       });
     });
+  }
+
+  // Listening on the table rather than on every checkbox also covers rows
+  // that are added later on by live updates.
+  table.addEventListener('change', function(event) {
+    const checkbox = event.target;
+    if (!checkbox.matches('.task-completed-checkbox')) return;
+
+    // A later change to the same task replaces the earlier one
+    pending.set(checkbox.dataset.taskId, {
+      checkbox: checkbox,
+      completed: checkbox.checked,
+    });
+
+    clearTimeout(flushTimer);
+    flushTimer = setTimeout(flush, FLUSH_DELAY_MS);
   });
+
+  // Don't lose changes that are still waiting when the page is left
+  window.addEventListener('pagehide', flush);
+
+  // Live updates: rows are patched in place as tasks finish or change,
+  // rather than reloading the whole table.
+  const CELL_CLASS = 'px-6 py-4 whitespace-nowrap border-b border-gray-200';
+  const tbody = table.querySelector('tbody');
+
+  function findRow(taskId) {
+    return tbody.querySelector(`tr[data-task-id="${CSS.escape(taskId)}"]`);
+  }
+
+  function displayValue(value) {
+    if (value === null || value === undefined) return 'None';
+    return typeof value === 'string' ? value : JSON.stringify(value);
+  }
+
+  function patchRow(row, task) {
+    const checkbox = row.querySelector('.task-completed-checkbox');
+    // Changes made on this page that haven't been sent yet win
+    if ('completed' in task && !pending.has(task.task_id)) {
+      checkbox.checked = Boolean(task.completed);
+    }
+
+    ['status', 'result', 'date_done'].forEach(field => {
+      const cell = row.querySelector(`[data-field="${field}"]`);
+      if (field in task && cell) cell.textContent = displayValue(task[field]);
+    });
+  }
+
+  function createRow(task) {
+    const row = document.createElement('tr');
+    row.dataset.taskId = task.task_id;
+
+    const checkbox = document.createElement('input');
+    checkbox.type = 'checkbox';
+    checkbox.className = 'task-completed-checkbox';
+    checkbox.dataset.taskId = task.task_id;
+
+    const cells = [checkbox, task.task_id, 'status', 'result', 'date_done'];
+    cells.forEach((content, i) => {
+      const cell = document.createElement('td');
+      cell.className = CELL_CLASS;
+      if (i === 0) {
+        cell.appendChild(content);
+      } else if (i === 1) {
+        cell.textContent = content;
+      } else {
+        cell.dataset.field = content;
+      }
+      row.appendChild(cell);
+    });
+
+    patchRow(row, task);
+    return row;
+  }
+
+  function handleEvent(event) {
+    const data = JSON.parse(event.data);
+
+    if (data.type === 'finished') {
+      const row = findRow(data.task.task_id);
+      if (row) {
+        patchRow(row, data.task);
+      } else if (table.dataset.liveInsert === 'true') {
+        tbody.prepend(createRow(data.task));
+      }
+    } else if (data.type === 'updated') {
+      data.tasks.forEach(task => {
+        const row = findRow(task.task_id);
+        if (row) patchRow(row, task);
+      });
+    } else if (data.type === 'reset') {
+      // Some events got dropped so the table can't be trusted anymore
+      window.location.reload();
+    }
+  }
+
+  if (window.EventSource && table.dataset.eventsUrl) {
+    const events = new EventSource(table.dataset.eventsUrl);
+    events.addEventListener('message', handleEvent);
+    window.addEventListener('pagehide', () => events.close());
+  }
 });
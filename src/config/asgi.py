@@ -11,6 +11,17 @@ import os
 
 from django.core.asgi import get_asgi_application
 
+from config.warmup import lifespan
+
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+
+async def application(scope, receive, send):
+    # Django only speaks HTTP, lifespan messages from the server get
+    # handled here.
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+    else:
+        await django_application(scope, receive, send)
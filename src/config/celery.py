@@ -2,8 +2,12 @@ import os
 
 from celery import Celery
 
+from config.serializers import register_serializers
+
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
 
+register_serializers()
+
 app: Celery = Celery(os.getenv("COMPOSE_PROJECT_NAME", "hello"))
 app.config_from_object("django.conf:settings", namespace="CELERY")
 app.autodiscover_tasks()
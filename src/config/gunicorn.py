@@ -1,19 +1,200 @@
 # -*- coding: utf-8 -*-
 
+import math
 import multiprocessing
 import os
+import random
+import signal
+import threading
+import time
 
 from distutils.util import strtobool
 
+# cgroup v2 first, then v1. Docker's --cpus and --memory limits end up here.
+CGROUP_CPU_MAX = "/sys/fs/cgroup/cpu.max"
+CGROUP_CPU_QUOTA = "/sys/fs/cgroup/cpu/cpu.cfs_quota_us"
+CGROUP_CPU_PERIOD = "/sys/fs/cgroup/cpu/cpu.cfs_period_us"
+CGROUP_MEMORY_MAX = "/sys/fs/cgroup/memory.max"
+CGROUP_MEMORY_LIMIT = "/sys/fs/cgroup/memory/memory.limit_in_bytes"
+
+MB = 1024 * 1024
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def cpu_limit():
+    """
+    Return how many CPUs this container may use, which is less than the
+    host's CPU count when it has a CPU quota or is pinned to some of them.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = multiprocessing.cpu_count()
+
+    quota = period = None
+    if cpu_max := _read(CGROUP_CPU_MAX):
+        quota, _, period = cpu_max.partition(" ")
+    else:
+        quota, period = _read(CGROUP_CPU_QUOTA), _read(CGROUP_CPU_PERIOD)
+
+    # There's no quota when it's "max" (v2) or -1 (v1).
+    try:
+        if int(quota) > 0 and int(period) > 0:
+            cpus = min(cpus, int(quota) / int(period))
+    except (TypeError, ValueError):
+        pass
+
+    return cpus
+
+
+def memory_limit():
+    """Return the container's memory limit in bytes, or None without one."""
+    limit = _read(CGROUP_MEMORY_MAX) or _read(CGROUP_MEMORY_LIMIT)
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        return None
+
+    # cgroup v1 reports no limit as a huge number rather than "max".
+    return limit if limit < 2**60 else None
+
+
 bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
 accesslog = "-"
 access_log_format = (
     "%(h)s %(l)s %(u)s %(t)s '%(r)s' %(s)s %(b)s '%(f)s' '%(a)s' in %(D)sµs"  # noqa: E501
 )
 
-workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2))
-threads = int(os.getenv("PYTHON_MAX_THREADS", 1))
+# Two workers per CPU the container may use, but no more than fit in its
+# memory limit going by WEB_WORKER_MEMORY (in MB) each. Sync workers make up
+# for the workers that don't fit with threads, which take far less memory.
+_cpus = cpu_limit()
+_memory = memory_limit()
+_worker_memory = int(os.getenv("WEB_WORKER_MEMORY", 256)) * MB
+
+_cpu_workers = max(math.ceil(_cpus * 2), 1)
+_memory_workers = (
+    max(_memory // _worker_memory, 1) if _memory else _cpu_workers
+)
+
+workers = int(os.getenv("WEB_CONCURRENCY", min(_cpu_workers, _memory_workers)))
+threads = int(os.getenv("PYTHON_MAX_THREADS", max(_cpu_workers // workers, 1)))
 
+# Loading the app once before forking lets workers share its memory copy on
+# write, but code reloading needs every worker to load the app itself.
 reload = bool(strtobool(os.getenv("WEB_RELOAD", "false")))
+preload_app = bool(strtobool(os.getenv("WEB_PRELOAD", "false"))) and not reload
+
+# Workers are restarted after this many requests, give or take the jitter so
+# they don't all restart at once. 0 turns it off.
+max_requests = int(os.getenv("WEB_MAX_REQUESTS", 1000))
+max_requests_jitter = int(os.getenv("WEB_MAX_REQUESTS_JITTER", 100))
+
+# Workers are also restarted once their memory goes over this many MB, which
+# defaults to their share of the container's memory limit. 0 turns it off.
+_default_max_memory = _memory // workers // MB * 9 // 10 if _memory else 0
+max_worker_memory = int(os.getenv("WEB_MAX_MEMORY", _default_max_memory)) * MB
+max_worker_memory_jitter = int(os.getenv("WEB_MAX_MEMORY_JITTER", 10)) * MB
+worker_memory_check_interval = float(
+    os.getenv("WEB_MEMORY_CHECK_INTERVAL", 10)
+)
 
 timeout = int(os.getenv("WEB_TIMEOUT", 120))
+
+# The Redis facing views are async, so by default each worker runs the ASGI
+# app on an event loop and serves many requests at once while they wait on
+# I/O. Set WEB_ASGI=false to go back to sync workers and threads.
+asgi = bool(strtobool(os.getenv("WEB_ASGI", "true")))
+if asgi:
+    worker_class = "uvicorn_worker.UvicornWorker"
+    wsgi_app = "config.asgi:application"
+else:
+    wsgi_app = "config.wsgi:application"
+
+
+def on_starting(server):
+    from config.metrics import reset_multiprocess_dir
+
+    reset_multiprocess_dir()
+
+
+def post_fork(server, worker):
+    if max_worker_memory:
+        _watch_worker_memory(server, worker)
+
+
+def _watch_worker_memory(server, worker):
+    limit = max_worker_memory - random.randint(0, max_worker_memory_jitter)
+
+    def watch():
+        while True:
+            time.sleep(worker_memory_check_interval)
+
+            memory = worker_memory()
+            if memory is not None and memory > limit:
+                server.log.info(
+                    "Worker %s is using %s MB, restarting it",
+                    worker.pid,
+                    memory // MB,
+                )
+                # Workers finish the requests they're serving on SIGTERM.
+                os.kill(worker.pid, signal.SIGTERM)
+                return
+
+    threading.Thread(target=watch, daemon=True).start()
+
+
+def worker_memory():
+    """
+    Return the memory only this process uses, in bytes. Pages shared copy
+    on write with the master (see WEB_PRELOAD) count towards its RSS but
+    don't go away when it restarts, so they're left out where possible.
+    """
+    rollup = _read("/proc/self/smaps_rollup")
+    if rollup is not None:
+        return sum(
+            int(line.split()[1]) * 1024
+            for line in rollup.splitlines()
+            if line.startswith(("Private_Clean:", "Private_Dirty:"))
+        )
+
+    statm = _read("/proc/self/statm")
+    if statm is not None:
+        return int(statm.split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+    return None
+
+
+def post_worker_init(worker):
+    # The warm-up runs once the worker has loaded the app, which happens
+    # after post_fork unless it was preloaded.
+    from config.warmup import warm_up
+
+    timings = warm_up()
+    worker.log.info(
+        "Worker %s warmed up in %s",
+        worker.pid,
+        ", ".join(
+            f"{step} {seconds * 1000:.0f}ms"
+            for step, seconds in timings.items()
+        ),
+    )
+
+
+def worker_exit(server, worker):
+    from pages.batching import name_batcher
+
+    name_batcher.drain()
+
+
+def child_exit(server, worker):
+    from config.metrics import mark_process_dead
+
+    mark_process_dead(worker.pid)
@@ -0,0 +1,253 @@
+"""
+Prometheus metrics for the web app and the Celery worker.
+
+Gunicorn and Celery both fork worker processes. When PROMETHEUS_MULTIPROC_DIR
+is set (it is in the Docker image) every process writes its samples to that
+directory and they're added up whenever the metrics get scraped.
+"""
+
+import os
+import time
+
+from asgiref.sync import iscoroutinefunction
+from celery import current_app
+from celery.signals import (
+    task_postrun,
+    task_prerun,
+    worker_init,
+    worker_process_shutdown,
+    worker_ready,
+)
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.utils.decorators import sync_and_async_middleware
+from prometheus_client import (
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+    start_http_server,
+)
+from prometheus_client.core import GaugeMetricFamily
+from redis.exceptions import RedisError
+
+from config.redis import add_command_observer, add_pool_observer, get_redis
+
+VIEW_LATENCY = Histogram(
+    "django_view_duration_seconds",
+    "Time spent handling a request, up until the response starts.",
+    ["route", "method", "status"],
+)
+REDIS_COMMANDS = Counter(
+    "redis_commands", "Redis commands sent, by command.", ["command"]
+)
+REDIS_LATENCY = Histogram(
+    "redis_round_trip_duration_seconds",
+    "Time spent waiting on Redis, per command or per pipeline.",
+    ["command"],
+)
+DB_QUERY_LATENCY = Histogram(
+    "django_db_query_duration_seconds",
+    "Time spent running database queries.",
+    ["alias", "statement"],
+)
+CELERY_TASK_RUNTIME = Histogram(
+    "celery_task_duration_seconds",
+    "Time spent running Celery tasks.",
+    ["task", "state"],
+)
+REDIS_POOL_CONNECTIONS = Gauge(
+    "redis_pool_connections",
+    "Connections opened by the Redis connection pools, and how many of "
+    "those are in use, by sync or async pool.",
+    ["pool", "state"],
+    multiprocess_mode="livesum",
+)
+REDIS_POOL_WAITS = Gauge(
+    "redis_pool_waits",
+    "Times a connection had to be waited for since the pools were created, "
+    "by sync or async pool.",
+    ["pool"],
+    multiprocess_mode="livesum",
+)
+TASK_CACHE_LOOKUPS = Counter(
+    "task_cache_lookups",
+    "Tasks looked up in the in-process task cache, by hit or miss.",
+    ["result"],
+)
+TASK_CACHE_INVALIDATIONS = Counter(
+    "task_cache_invalidations",
+    "Task result keys Redis reported as changed to the task cache.",
+)
+TASKS_TRIMMED = Counter(
+    "celery_tasks_trimmed",
+    "Task results deleted from Redis by pages.tasks.trim_tasks, by reason.",
+    ["reason"],
+)
+
+MULTIPROCESS = "PROMETHEUS_MULTIPROC_DIR" in os.environ
+
+
+def get_registry():
+    """Return a registry with every metric of every process in it."""
+    registry = CollectorRegistry()
+    if MULTIPROCESS:
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry.register(REGISTRY)
+    registry.register(CeleryQueueCollector())
+
+    return registry
+
+
+def render_metrics():
+    return generate_latest(get_registry())
+
+
+def reset_multiprocess_dir():
+    """Throw out samples left behind by processes of a previous run."""
+    if not MULTIPROCESS:
+        return
+
+    path = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    os.makedirs(path, exist_ok=True)
+    for name in os.listdir(path):
+        os.remove(os.path.join(path, name))
+
+
+def mark_process_dead(pid):
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(pid)
+
+
+@sync_and_async_middleware
+def metrics_middleware(get_response):
+    if iscoroutinefunction(get_response):
+
+        async def middleware(request):
+            started = time.perf_counter()
+            response = await get_response(request)
+            _observe_view(request, response, started)
+            return response
+
+    else:
+
+        def middleware(request):
+            started = time.perf_counter()
+            response = get_response(request)
+            _observe_view(request, response, started)
+            return response
+
+    return middleware
+
+
+def _observe_view(request, response, started):
+    # The route rather than the path keeps the number of series bounded.
+    match = request.resolver_match
+    VIEW_LATENCY.labels(
+        f"/{match.route}" if match else "unresolved",
+        request.method,
+        response.status_code,
+    ).observe(time.perf_counter() - started)
+
+
+def _observe_redis(commands, duration):
+    for command in commands:
+        REDIS_COMMANDS.labels(command).inc()
+
+    REDIS_LATENCY.labels(
+        commands[0] if len(commands) == 1 else "PIPELINE"
+    ).observe(duration)
+
+
+add_command_observer(_observe_redis)
+
+
+def _observe_pool(pool, stats):
+    REDIS_POOL_CONNECTIONS.labels(pool, "created").set(stats["created"])
+    REDIS_POOL_CONNECTIONS.labels(pool, "in_use").set(stats["in_use"])
+    REDIS_POOL_WAITS.labels(pool).set(stats["waited_for"])
+
+
+add_pool_observer(_observe_pool)
+
+
+STATEMENTS = {"SELECT", "INSERT", "UPDATE", "DELETE"}
+
+
+def _time_query(execute, sql, params, many, context):
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        statement = sql.lstrip()[:6].upper()
+        DB_QUERY_LATENCY.labels(
+            context["connection"].alias,
+            statement if statement in STATEMENTS else "OTHER",
+        ).observe(time.perf_counter() - started)
+
+
+@receiver(connection_created)
+def _time_queries(sender, connection, **kwargs):
+    if _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_time_query)
+
+
+class CeleryQueueCollector:
+    """Reads how many messages are waiting in Celery's queue when scraped."""
+
+    def collect(self):
+        queue = current_app.conf.task_default_queue
+        gauge = GaugeMetricFamily(
+            "celery_queue_length",
+            "Messages waiting to be picked up by a Celery worker.",
+            labels=["queue"],
+        )
+
+        try:
+            gauge.add_metric([queue], get_redis().llen(queue))
+        except RedisError:
+            # Metrics should still be scrapable while Redis is down.
+            return
+
+        yield gauge
+
+
+_task_started = {}
+
+
+@task_prerun.connect
+def _start_task_timer(task_id=None, **kwargs):
+    _task_started[task_id] = time.perf_counter()
+
+
+@task_postrun.connect
+def _observe_task(task_id=None, task=None, state=None, **kwargs):
+    started = _task_started.pop(task_id, None)
+    if started is not None:
+        CELERY_TASK_RUNTIME.labels(task.name, state or "UNKNOWN").observe(
+            time.perf_counter() - started
+        )
+
+
+@worker_init.connect
+def _reset_worker_metrics(**kwargs):
+    reset_multiprocess_dir()
+
+
+@worker_ready.connect
+def _serve_worker_metrics(**kwargs):
+    # The worker has no web server of its own, so its metrics get one.
+    if MULTIPROCESS and settings.WORKER_METRICS_PORT:
+        start_http_server(
+            settings.WORKER_METRICS_PORT, registry=get_registry()
+        )
+
+
+@worker_process_shutdown.connect
+def _forget_worker_process(pid=None, **kwargs):
+    mark_process_dead(pid or os.getpid())
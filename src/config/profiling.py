@@ -0,0 +1,217 @@
+"""
+Profile a sample of requests, or those with a PROFILING_TOKEN in their
+X-Profile header, writing to PROFILING_DIR for each of them:
+
+- <name>.prof, the call stacks as collected by cProfile. Browse them as a
+  flame graph with `snakeviz <name>.prof` or print them with
+  `python -m pstats <name>.prof`.
+- <name>.json, the request's duration, every Redis command and SQL query it
+  ran along with how long they took, and the slowest functions.
+
+The name is in the X-Profile-Id header of the response. This middleware is
+only installed when profiling is turned on, and even then the requests that
+aren't sampled only pay for a random number and a header lookup.
+
+cProfile only sees the thread it was enabled on. For async views that's the
+event loop, so the time spent in sync code run by sync_to_async shows up as
+waiting, and other requests served by the loop meanwhile get mixed in. The
+Redis and SQL timings are per request either way.
+"""
+
+import cProfile
+import hmac
+import json
+import pstats
+import random
+import re
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.utils.decorators import sync_and_async_middleware
+
+from config.redis import add_command_observer
+
+_profile = ContextVar("profile", default=None)
+
+# Only one profiler can be enabled per thread, so requests that get sampled
+# while another one is being profiled are served as usual.
+_profiling = threading.Lock()
+
+
+class RequestProfile:
+    def __init__(self, request):
+        self.request = request
+        self.profiler = cProfile.Profile()
+        self.redis = []
+        self.sql = []
+        self.started = time.time()
+        self.timer = time.perf_counter()
+        self.duration = None
+
+    def save(self, response):
+        """Write the profile to PROFILING_DIR, returning its name."""
+        directory = Path(settings.PROFILING_DIR)
+        directory.mkdir(parents=True, exist_ok=True)
+
+        path = re.sub(r"[^\w-]+", "-", self.request.path).strip("-")
+        name = "-".join(
+            (
+                # Down to the microsecond so names sort by when they started.
+                time.strftime("%Y%m%d%H%M%S", time.gmtime(self.started))
+                + f"{int(self.started * 1e6) % 10**6:06d}",
+                self.request.method,
+                path[:50] or "root",
+                uuid.uuid4().hex[:8],
+            )
+        )
+
+        self.profiler.dump_stats(directory / f"{name}.prof")
+        with open(directory / f"{name}.json", "w") as f:
+            json.dump(self.report(response), f, indent=2, default=str)
+
+        _prune(directory)
+        return name
+
+    def report(self, response):
+        return {
+            "method": self.request.method,
+            "path": self.request.get_full_path(),
+            "status": response.status_code if response else None,
+            # The content of a streaming response is produced after the
+            # profile ends.
+            "streaming": bool(response and response.streaming),
+            "started": self.started,
+            "duration_ms": self.duration * 1000,
+            "redis_ms": sum(command["ms"] for command in self.redis),
+            "sql_ms": sum(query["ms"] for query in self.sql),
+            "redis": self.redis,
+            "sql": self.sql,
+            "slowest": _slowest(self.profiler, settings.PROFILING_TOP),
+        }
+
+
+@sync_and_async_middleware
+def profiling_middleware(get_response):
+    if iscoroutinefunction(get_response):
+
+        async def middleware(request):
+            profile = _start(request)
+            if profile is None:
+                return await get_response(request)
+
+            response = None
+            try:
+                response = await get_response(request)
+                return response
+            finally:
+                _finish(profile, response)
+
+    else:
+
+        def middleware(request):
+            profile = _start(request)
+            if profile is None:
+                return get_response(request)
+
+            response = None
+            try:
+                response = get_response(request)
+                return response
+            finally:
+                _finish(profile, response)
+
+    return middleware
+
+
+def _sampled(request):
+    token = settings.PROFILING_TOKEN
+    if token:
+        header = request.headers.get("X-Profile")
+        if header and hmac.compare_digest(header, token):
+            return True
+
+    return random.random() < settings.PROFILING_SAMPLE_RATE
+
+
+def _start(request):
+    if not _sampled(request) or not _profiling.acquire(blocking=False):
+        return None
+
+    profile = RequestProfile(request)
+    profile.token = _profile.set(profile)
+    profile.profiler.enable()
+    return profile
+
+
+def _finish(profile, response):
+    profile.profiler.disable()
+    profile.duration = time.perf_counter() - profile.timer
+    _profile.reset(profile.token)
+    _profiling.release()
+
+    name = profile.save(response)
+    if response is not None:
+        response["X-Profile-Id"] = name
+
+
+def _slowest(profiler, count):
+    stats = pstats.Stats(profiler).stats
+    slowest = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)
+    return [
+        {
+            "function": pstats.func_std_string(func),
+            "calls": calls,
+            "own_ms": own * 1000,
+            "cumulative_ms": cumulative * 1000,
+        }
+        for func, (_, calls, own, cumulative, _) in slowest[:count]
+    ]
+
+
+def _prune(directory):
+    """Keep the newest PROFILING_KEEP profiles."""
+    reports = sorted(directory.glob("*.json"), reverse=True)
+    for report in reports[settings.PROFILING_KEEP :]:
+        report.unlink(missing_ok=True)
+        report.with_suffix(".prof").unlink(missing_ok=True)
+
+
+def _observe_redis(commands, duration):
+    profile = _profile.get()
+    if profile is not None:
+        profile.redis.append({"commands": commands, "ms": duration * 1000})
+
+
+add_command_observer(_observe_redis)
+
+
+def _time_query(execute, sql, params, many, context):
+    profile = _profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.sql.append(
+            {
+                "alias": context["connection"].alias,
+                "sql": sql,
+                "many": many,
+                "ms": (time.perf_counter() - started) * 1000,
+            }
+        )
+
+
+@receiver(connection_created)
+def _time_queries(sender, connection, **kwargs):
+    if _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_time_query)
@@ -0,0 +1,314 @@
+import asyncio
+import os
+import threading
+import time
+import weakref
+
+from django.conf import settings
+from redis import BlockingConnectionPool, Redis
+from redis import asyncio as aioredis
+from redis.asyncio.client import Pipeline as AsyncPipeline
+from redis.client import Pipeline
+from redis.exceptions import NoScriptError
+
+# Called with the names of the commands sent in a round trip to Redis and how
+# many seconds it took, see add_command_observer().
+_command_observers = []
+
+
+def add_command_observer(observer):
+    _command_observers.append(observer)
+
+
+def _notify(commands, started):
+    duration = time.perf_counter() - started
+    for observer in _command_observers:
+        observer(commands, duration)
+
+
+# Called with the kind of pool ("sync" or "async") and its stats whenever a
+# connection gets checked out of it or handed back, see add_pool_observer().
+_pool_observers = []
+
+
+def add_pool_observer(observer):
+    _pool_observers.append(observer)
+
+
+def _notify_pool(kind, stats):
+    for observer in _pool_observers:
+        observer(kind, stats)
+
+
+class TimedRedis(Redis):
+    """A client that reports every command it sends to the observers."""
+
+    def execute_command(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            return super().execute_command(*args, **options)
+        finally:
+            _notify([args[0]], started)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return TimedPipeline(
+            self.connection_pool,
+            self.response_callbacks,
+            transaction,
+            shard_hint,
+        )
+
+
+# The shas of the scripts this process has loaded into Redis. Pipelines only
+# check that their scripts are there (with SCRIPT EXISTS, a round trip of its
+# own) until they've all been loaded once.
+_loaded_scripts = set()
+
+
+def _scripts_loaded(scripts):
+    return all(script.sha in _loaded_scripts for script in scripts)
+
+
+def _lost_scripts(stack, scripts, response):
+    """
+    Yield the position, script, keys and args of every script call that
+    failed because Redis no longer has the script, which happens when it
+    restarts or its scripts get flushed.
+    """
+    for i, reply in enumerate(response):
+        if isinstance(reply, NoScriptError):
+            _loaded_scripts.clear()
+            _, sha, numkeys, *rest = stack[i][0]
+            yield i, scripts[sha], rest[:numkeys], rest[numkeys:]
+
+
+class TimedPipeline(Pipeline):
+    def load_scripts(self):
+        if not _scripts_loaded(self.scripts):
+            super().load_scripts()
+            _loaded_scripts.update(script.sha for script in self.scripts)
+
+    def execute(self, raise_on_error=True):
+        stack = list(self.command_stack)
+        scripts = {script.sha: script for script in self.scripts}
+        commands = [args[0] for args, _ in stack]
+        started = time.perf_counter()
+        try:
+            response = super().execute(raise_on_error=False)
+
+            # Those calls alone get run again, which loads their script.
+            lost = list(_lost_scripts(stack, scripts, response))
+            client = TimedRedis(connection_pool=self.connection_pool)
+            for i, script, keys, args in lost:
+                response[i] = script(keys=keys, args=args, client=client)
+
+            if raise_on_error:
+                self.raise_first_error(stack, response)
+            return response
+        finally:
+            if commands:
+                _notify(commands, started)
+
+
+class AsyncTimedRedis(aioredis.Redis):
+    async def execute_command(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            _notify([args[0]], started)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return AsyncTimedPipeline(
+            self.connection_pool,
+            self.response_callbacks,
+            transaction,
+            shard_hint,
+        )
+
+
+class AsyncTimedPipeline(AsyncPipeline):
+    async def load_scripts(self):
+        if not _scripts_loaded(self.scripts):
+            await super().load_scripts()
+            _loaded_scripts.update(script.sha for script in self.scripts)
+
+    async def execute(self, raise_on_error=True):
+        stack = list(self.command_stack)
+        scripts = {script.sha: script for script in self.scripts}
+        commands = [args[0] for args, _ in stack]
+        started = time.perf_counter()
+        try:
+            response = await super().execute(raise_on_error=False)
+
+            lost = list(_lost_scripts(stack, scripts, response))
+            client = AsyncTimedRedis(connection_pool=self.connection_pool)
+            for i, script, keys, args in lost:
+                response[i] = await script(keys=keys, args=args, client=client)
+
+            if raise_on_error:
+                self.raise_first_error(stack, response)
+            return response
+        finally:
+            if commands:
+                _notify(commands, started)
+
+
+class ConnectionPool(BlockingConnectionPool):
+    """A blocking connection pool that keeps track of how busy it is."""
+
+    def reset(self):
+        super().reset()
+        self.waited_for = 0
+
+    def get_connection(self, *args, **kwargs):
+        self._checkpid()
+
+        # Every connection is checked out so this call is going to block
+        # until another thread hands one back.
+        if self.pool.empty():
+            self.waited_for += 1
+
+        try:
+            return super().get_connection(*args, **kwargs)
+        finally:
+            _notify_pool("sync", self.stats())
+
+    def release(self, connection):
+        super().release(connection)
+        _notify_pool("sync", self.stats())
+
+    def stats(self):
+        created = len(self._connections)
+        idle = sum(1 for conn in list(self.pool.queue) if conn is not None)
+
+        return {
+            "max_connections": self.max_connections,
+            "created": created,
+            "in_use": created - idle,
+            "waited_for": self.waited_for,
+        }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool.from_url(
+                    settings.REDIS_URL, **_pool_options()
+                )
+
+    return _pool
+
+
+def _pool_options():
+    return {
+        "max_connections": settings.REDIS_MAX_CONNECTIONS,
+        "timeout": settings.REDIS_POOL_TIMEOUT,
+        "socket_timeout": settings.REDIS_SOCKET_TIMEOUT,
+        "socket_connect_timeout": settings.REDIS_SOCKET_CONNECT_TIMEOUT,
+        "health_check_interval": settings.REDIS_HEALTH_CHECK_INTERVAL,
+    }
+
+
+def get_redis():
+    return TimedRedis(connection_pool=get_pool())
+
+
+def pool_stats():
+    return get_pool().stats()
+
+
+class AsyncConnectionPool(aioredis.BlockingConnectionPool):
+    """The asyncio version of ConnectionPool."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.waited_for = 0
+
+    async def get_connection(self, *args, **kwargs):
+        if not self.can_get_connection():
+            self.waited_for += 1
+
+        try:
+            return await super().get_connection(*args, **kwargs)
+        finally:
+            _notify_pool("async", async_pool_stats())
+
+    async def release(self, connection):
+        await super().release(connection)
+        _notify_pool("async", async_pool_stats())
+
+    def stats(self):
+        in_use = len(self._in_use_connections)
+
+        return {
+            "max_connections": self.max_connections,
+            "created": in_use + len(self._available_connections),
+            "in_use": in_use,
+            "waited_for": self.waited_for,
+        }
+
+
+# asyncio connections belong to the event loop they were opened on, so every
+# loop gets a pool of its own. Under an ASGI worker that's one per process.
+_async_pools = weakref.WeakKeyDictionary()
+
+
+def get_async_pool():
+    loop = asyncio.get_running_loop()
+
+    pool = _async_pools.get(loop)
+    if pool is None:
+        pool = _async_pools[loop] = AsyncConnectionPool.from_url(
+            settings.REDIS_URL, **_pool_options()
+        )
+
+    return pool
+
+
+async def close_async_pool():
+    """Disconnect the running event loop's pool, if it has one."""
+    pool = _async_pools.pop(asyncio.get_running_loop(), None)
+    if pool is not None:
+        await pool.disconnect()
+        _notify_pool("async", async_pool_stats())
+
+
+def async_pool_stats():
+    """Add up the stats of every event loop's pool in this process."""
+    totals = {
+        "max_connections": 0,
+        "created": 0,
+        "in_use": 0,
+        "waited_for": 0,
+    }
+    for pool in list(_async_pools.values()):
+        for stat, value in pool.stats().items():
+            totals[stat] += value
+
+    return totals
+
+
+def get_async_redis():
+    return AsyncTimedRedis(connection_pool=get_async_pool())
+
+
+def _forget_pool():
+    global _pool, _pool_lock
+
+    # A forked gunicorn worker must never share sockets with its parent, so
+    # it starts over with its own pool (and its own lock, which might have
+    # been held by another thread at the time of the fork).
+    _pool = None
+    _pool_lock = threading.Lock()
+    _async_pools.clear()
+
+
+os.register_at_fork(after_in_child=_forget_pool)
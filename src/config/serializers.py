@@ -0,0 +1,72 @@
+"""
+Serializers for Celery's task results, along with helpers that read and write
+a stored result in whichever of them it was written with.
+"""
+
+import json
+import zlib
+
+import msgpack
+from kombu.serialization import register
+
+MSGPACK_ZLIB = "msgpack-zlib"
+
+# The formats results can be stored in. JSON stays first so results stored
+# before switching serializers keep working.
+RESULT_SERIALIZERS = ["json", "msgpack", MSGPACK_ZLIB]
+
+
+def _pack(data):
+    return msgpack.packb(data, use_bin_type=True)
+
+
+def _unpack(data):
+    return msgpack.unpackb(data, raw=False)
+
+
+def dumps_msgpack_zlib(data):
+    return zlib.compress(_pack(data))
+
+
+def loads_msgpack_zlib(data):
+    return _unpack(zlib.decompress(data))
+
+
+def register_serializers():
+    register(
+        MSGPACK_ZLIB,
+        dumps_msgpack_zlib,
+        loads_msgpack_zlib,
+        content_type="application/x-msgpack-zlib",
+        content_encoding="binary",
+    )
+
+
+def result_format(payload):
+    """Tell which of RESULT_SERIALIZERS a stored result was written with."""
+    first = payload[:1]
+
+    # Results are always objects, so JSON starts with a brace and msgpack
+    # with a map type. A zlib header never looks like either.
+    if first == b"{":
+        return "json"
+    if first == b"\x78" and int.from_bytes(payload[:2]) % 31 == 0:
+        return MSGPACK_ZLIB
+    return "msgpack"
+
+
+def decode_result(payload):
+    serializer = result_format(payload)
+    if serializer == "json":
+        return json.loads(payload)
+    if serializer == MSGPACK_ZLIB:
+        return loads_msgpack_zlib(payload)
+    return _unpack(payload)
+
+
+def encode_result(data, serializer):
+    if serializer == "json":
+        return json.dumps(data).encode()
+    if serializer == MSGPACK_ZLIB:
+        return dumps_msgpack_zlib(data)
+    return _pack(data)
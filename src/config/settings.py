@@ -28,6 +28,15 @@ DEBUG = bool(strtobool(os.getenv("DEBUG", "false")))
 
 TESTING = "test" in sys.argv
 
+# Is gunicorn serving the ASGI app? See config.gunicorn. Views that hold a
+# request open for a long time are only available then, since a sync worker
+# would give up a whole thread to each of them.
+WEB_ASGI = bool(strtobool(os.getenv("WEB_ASGI", "true")))
+
+# Dev only apps are left out everywhere else so production workers never
+# import them or run their middleware.
+DEBUG_TOOLBAR = DEBUG and not TESTING
+
 # https://docs.djangoproject.com/en/5.2/ref/settings/#std:setting-ALLOWED_HOSTS
 allowed_hosts = os.getenv("ALLOWED_HOSTS", ".localhost,127.0.0.1,[::1]")
 ALLOWED_HOSTS = list(map(str.strip, allowed_hosts.split(",")))
@@ -45,8 +54,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "config.metrics.metrics_middleware",
     "django.middleware.security.SecurityMiddleware",
-    "whitenoise.middleware.WhiteNoiseMiddleware",
+    # WhiteNoise is sync only, so Django would have to switch threads for it
+    # on every request to an ASGI worker. ServeStatic is its async fork.
+    "servestatic.middleware.ServeStaticMiddleware"
+    if WEB_ASGI
+    else "whitenoise.middleware.WhiteNoiseMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -55,7 +69,7 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
-if not TESTING:
+if DEBUG_TOOLBAR:
     INSTALLED_APPS = [*INSTALLED_APPS, "debug_toolbar"]
     MIDDLEWARE = [
         "debug_toolbar.middleware.DebugToolbarMiddleware",
@@ -101,9 +115,21 @@ DATABASES = {
         "PASSWORD": os.getenv("POSTGRES_PASSWORD", "password"),
         "HOST": os.getenv("POSTGRES_HOST", "postgres"),
         "PORT": os.getenv("POSTGRES_PORT", "5432"),
+        "OPTIONS": {
+            "connect_timeout": int(os.getenv("POSTGRES_CONNECT_TIMEOUT", 5)),
+        },
     }
 }
 
+# Each process keeps a pool of open connections rather than connecting on
+# every request.
+# https://docs.djangoproject.com/en/5.2/ref/databases/#connection-pool
+if bool(strtobool(os.getenv("POSTGRES_POOL", "false"))):
+    DATABASES["default"]["OPTIONS"]["pool"] = {
+        "min_size": int(os.getenv("POSTGRES_POOL_MIN_SIZE", 2)),
+        "max_size": int(os.getenv("POSTGRES_POOL_MAX_SIZE", 4)),
+    }
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
@@ -131,6 +157,13 @@ SESSION_ENGINE = "django.contrib.sessions.backends.signed_cookies"
 
 # Redis
 REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", 50))
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", 5))
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", 5))
+REDIS_SOCKET_CONNECT_TIMEOUT = float(
+    os.getenv("REDIS_SOCKET_CONNECT_TIMEOUT", 5)
+)
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", 30))
 
 # Caching
 # https://docs.djangoproject.com/en/5.2/topics/cache/
@@ -145,6 +178,74 @@ CACHES = {
 # https://docs.celeryproject.org/en/stable/userguide/configuration.html
 CELERY_BROKER_URL = REDIS_URL
 CELERY_RESULT_BACKEND = REDIS_URL
+CELERY_RESULT_SERIALIZER = os.getenv("CELERY_RESULT_SERIALIZER", "json")
+CELERY_RESULT_ACCEPT_CONTENT = ["json", "msgpack", "msgpack-zlib"]
+
+# Task list
+TASKS_PAGE_SIZE = int(os.getenv("TASKS_PAGE_SIZE", 50))
+TASKS_MAX_PAGE_SIZE = int(os.getenv("TASKS_MAX_PAGE_SIZE", 500))
+TASKS_FETCH_CHUNK_SIZE = int(os.getenv("TASKS_FETCH_CHUNK_SIZE", 500))
+TASKS_CACHE_TIMEOUT = int(os.getenv("TASKS_CACHE_TIMEOUT", 300))
+TASK_LIST_SOURCE = os.getenv("TASK_LIST_SOURCE", "redis")
+TASKS_ARCHIVE_INTERVAL = float(os.getenv("TASKS_ARCHIVE_INTERVAL", 10))
+TASKS_ARCHIVE_BATCH_SIZE = int(os.getenv("TASKS_ARCHIVE_BATCH_SIZE", 1000))
+TASKS_MAX_AGE = int(os.getenv("TASKS_MAX_AGE", 60 * 60 * 24))
+TASKS_MAX_COUNT = int(os.getenv("TASKS_MAX_COUNT", 100000))
+TASKS_TRIM_INTERVAL = float(os.getenv("TASKS_TRIM_INTERVAL", 300))
+TASKS_TRIM_BATCH_SIZE = int(os.getenv("TASKS_TRIM_BATCH_SIZE", 1000))
+TASKS_EXPIRE_INTERVAL = float(os.getenv("TASKS_EXPIRE_INTERVAL", 10))
+TASK_EVENTS_KEEPALIVE = float(os.getenv("TASK_EVENTS_KEEPALIVE", 15))
+TASK_EVENTS_QUEUE_SIZE = int(os.getenv("TASK_EVENTS_QUEUE_SIZE", 1000))
+TASK_EVENTS_RETRY = int(os.getenv("TASK_EVENTS_RETRY", 3000))
+# Tests read tasks from a Redis of their own, see pages.task_cache.
+TASK_CACHE_SIZE = int(os.getenv("TASK_CACHE_SIZE", 0 if TESTING else 10000))
+
+CELERY_BEAT_SCHEDULE = {
+    "archive-tasks": {
+        "task": "pages.tasks.archive_tasks",
+        "schedule": TASKS_ARCHIVE_INTERVAL,
+        "kwargs": {"batch_size": TASKS_ARCHIVE_BATCH_SIZE},
+    },
+    "trim-tasks": {
+        "task": "pages.tasks.trim_tasks",
+        "schedule": TASKS_TRIM_INTERVAL,
+        "kwargs": {
+            "max_age": TASKS_MAX_AGE,
+            "max_count": TASKS_MAX_COUNT,
+            "batch_size": TASKS_TRIM_BATCH_SIZE,
+        },
+    },
+    "unindex-expired-tasks": {
+        "task": "pages.tasks.unindex_expired_tasks",
+        "schedule": TASKS_EXPIRE_INTERVAL,
+        "kwargs": {"batch_size": TASKS_TRIM_BATCH_SIZE},
+    },
+}
+
+# Name queue
+NAMES_BATCH_SIZE = int(os.getenv("NAMES_BATCH_SIZE", 100))
+NAMES_BATCH_MAX_DELAY = float(os.getenv("NAMES_BATCH_MAX_DELAY", 0.5))
+
+# Health checks
+UP_REDIS_TIMEOUT = float(os.getenv("UP_REDIS_TIMEOUT", 1))
+UP_POSTGRES_TIMEOUT = float(os.getenv("UP_POSTGRES_TIMEOUT", 2))
+UP_CACHE_TIMEOUT = float(os.getenv("UP_CACHE_TIMEOUT", 5))
+
+# Warm-up, see config.warmup
+WARMUP_REDIS_CONNECTIONS = int(os.getenv("WARMUP_REDIS_CONNECTIONS", 1))
+
+# Metrics
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", 9540))
+
+# Profiling, see config.profiling
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", 0))
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN", "")
+PROFILING_DIR = os.getenv("PROFILING_DIR", "/tmp/profiles")
+PROFILING_KEEP = int(os.getenv("PROFILING_KEEP", 100))
+PROFILING_TOP = int(os.getenv("PROFILING_TOP", 30))
+
+if PROFILING_SAMPLE_RATE > 0 or PROFILING_TOKEN:
+    MIDDLEWARE = ["config.profiling.profiling_middleware", *MIDDLEWARE]
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.2/topics/i18n/
@@ -163,7 +264,7 @@ STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
 
 # Django Debug Toolbar
 # https://django-debug-toolbar.readthedocs.io/
-if DEBUG:
+if DEBUG_TOOLBAR:
     # We need to configure an IP address to allow connections from, but in
     # Docker we can't use 127.0.0.1 since this runs in a container but we want
     # to access the toolbar from our browser outside of the container.
@@ -0,0 +1,87 @@
+"""
+Measure how long it takes to start the app, from importing the settings to
+a warmed up worker, printing the timings in seconds as JSON. It has to run
+in an interpreter of its own since nothing can have been imported yet, see
+the startup_timing command:
+
+    python -X importtime -m config.startup
+"""
+
+import json
+import os
+import time
+
+
+def measure():
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+    timings = {}
+
+    started = time.perf_counter()
+    from django.conf import settings
+
+    settings.INSTALLED_APPS
+    timings["settings"] = time.perf_counter() - started
+
+    apps = timings["apps"] = {}
+    _time_apps(apps)
+
+    import django
+
+    started = time.perf_counter()
+    django.setup()
+    timings["setup"] = time.perf_counter() - started
+
+    from django.core.handlers.asgi import ASGIHandler
+    from django.urls import get_resolver
+
+    started = time.perf_counter()
+    ASGIHandler()
+    timings["middleware"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    get_resolver().url_patterns
+    timings["urls"] = time.perf_counter() - started
+
+    from config.warmup import warm_up
+
+    timings["warm_up"] = warm_up()
+    return timings
+
+
+def _time_apps(timings):
+    """Time how long importing each app and its models and readying it take."""
+    from django.apps import AppConfig
+
+    create = AppConfig.create.__func__
+
+    def timed_create(cls, entry):
+        started = time.perf_counter()
+        app_config = create(cls, entry)
+        timing = timings[app_config.label] = {
+            "import": time.perf_counter() - started
+        }
+
+        for step in ("import_models", "ready"):
+            timing[step] = 0
+            setattr(
+                app_config,
+                step,
+                _timed(getattr(app_config, step), timing, step),
+            )
+
+        return app_config
+
+    AppConfig.create = classmethod(timed_create)
+
+
+def _timed(method, timing, step):
+    def timed():
+        started = time.perf_counter()
+        method()
+        timing[step] = time.perf_counter() - started
+
+    return timed
+
+
+if __name__ == "__main__":
+    print(json.dumps(measure()))
@@ -1,8 +1,17 @@
+import asyncio
+import json
 import os
+import signal
+import tempfile
+import threading
 from importlib import reload
-from unittest.mock import patch
+from pathlib import Path
+from unittest.mock import MagicMock, mock_open, patch
 
-from django.test import TestCase
+from django.conf import settings
+from django.http import HttpResponse
+from django.template import engines
+from django.test import TestCase, override_settings
 
 
 class SettingsTests(TestCase):
@@ -20,6 +29,51 @@ class SettingsTests(TestCase):
         reload(settings)
         self.assertFalse(settings.DEBUG)
 
+    @patch.dict(os.environ, {"DEBUG": "true"})
+    @patch("sys.argv", ["manage.py", "runserver"])
+    def test_debug_toolbar_in_debug(self):
+        from config import settings
+
+        reload(settings)
+        self.assertIn("debug_toolbar", settings.INSTALLED_APPS)
+        self.assertIn(
+            "debug_toolbar.middleware.DebugToolbarMiddleware",
+            settings.MIDDLEWARE,
+        )
+
+    @patch.dict(os.environ, {"DEBUG": "false"})
+    @patch("sys.argv", ["manage.py", "runserver"])
+    def test_no_debug_toolbar_in_production(self):
+        from config import settings
+
+        reload(settings)
+        self.assertNotIn("debug_toolbar", settings.INSTALLED_APPS)
+        self.assertNotIn(
+            "debug_toolbar.middleware.DebugToolbarMiddleware",
+            settings.MIDDLEWARE,
+        )
+
+    def test_static_files_middleware(self):
+        from config import settings
+
+        for web_asgi, middleware in (
+            ("true", "servestatic.middleware.ServeStaticMiddleware"),
+            ("false", "whitenoise.middleware.WhiteNoiseMiddleware"),
+        ):
+            with patch.dict(os.environ, {"WEB_ASGI": web_asgi}):
+                reload(settings)
+                self.assertIn(middleware, settings.MIDDLEWARE)
+
+    @patch.dict(os.environ, {"POSTGRES_POOL": "true"})
+    def test_postgres_pool(self):
+        from config import settings
+
+        reload(settings)
+        self.assertEqual(
+            settings.DATABASES["default"]["OPTIONS"],
+            {"connect_timeout": 5, "pool": {"min_size": 2, "max_size": 4}},
+        )
+
     @patch.dict(os.environ, {"ALLOWED_HOSTS": "test.com,example.com"})
     def test_allowed_hosts(self):
         from config import settings
@@ -49,6 +103,82 @@ class UrlsTests(TestCase):
         )
 
 
+class WarmUpTests(TestCase):
+    @override_settings(DEBUG=False)
+    def test_compile_templates(self):
+        from config.warmup import compile_templates
+
+        self.assertGreater(compile_templates(), 0)
+
+        # They come out of the cached loader from now on.
+        loader = engines["django"].engine.template_loaders[0]
+        self.assertIn("pages/tasks.html", loader.get_template_cache)
+
+    @override_settings(DEBUG=True)
+    def test_compile_templates_debug(self):
+        from config.warmup import compile_templates
+
+        self.assertEqual(compile_templates(), 0)
+
+    @override_settings(WARMUP_REDIS_CONNECTIONS=3)
+    @patch("config.warmup.get_pool")
+    def test_open_redis_connections(self, mock_get_pool):
+        from config.warmup import open_redis_connections
+
+        pool = mock_get_pool.return_value
+        self.assertEqual(open_redis_connections(), 3)
+        self.assertEqual(pool.get_connection.call_count, 3)
+        self.assertEqual(pool.release.call_count, 3)
+
+    @override_settings(WARMUP_REDIS_CONNECTIONS=2)
+    def test_lifespan(self):
+        import fakeredis
+
+        from config import redis
+        from config.asgi import application
+
+        fake = fakeredis.FakeAsyncRedis().connection_pool
+        self.addCleanup(redis._forget_pool)
+
+        async def run():
+            pool = redis._async_pools[asyncio.get_running_loop()] = (
+                redis.AsyncConnectionPool(
+                    connection_class=fake.connection_class,
+                    **fake.connection_kwargs,
+                )
+            )
+            messages = asyncio.Queue()
+            sent = []
+
+            async def send(message):
+                sent.append(message["type"])
+                if message["type"] == "lifespan.startup.complete":
+                    self.assertEqual(pool.stats()["created"], 2)
+                    self.assertEqual(pool.stats()["in_use"], 0)
+                    await messages.put({"type": "lifespan.shutdown"})
+
+            await messages.put({"type": "lifespan.startup"})
+            await application({"type": "lifespan"}, messages.get, send)
+            return sent, asyncio.get_running_loop() in redis._async_pools
+
+        sent, still_pooled = asyncio.run(run())
+        self.assertEqual(
+            sent, ["lifespan.startup.complete", "lifespan.shutdown.complete"]
+        )
+        self.assertFalse(still_pooled)
+
+    @patch("config.warmup.open_redis_connections", side_effect=OSError)
+    @patch("config.warmup.compile_templates")
+    def test_warm_up_carries_on(self, mock_compile, mock_open_redis):
+        from config.warmup import warm_up
+
+        with self.assertLogs("config.warmup", "WARNING"):
+            timings = warm_up()
+
+        self.assertEqual(list(timings), ["templates", "redis", "postgres"])
+        mock_compile.assert_called_once()
+
+
 class WsgiAsgiTests(TestCase):
     def test_wsgi(self):
         from config import wsgi  # noqa
@@ -57,10 +187,417 @@ class WsgiAsgiTests(TestCase):
         from config import asgi  # noqa
 
 
+class RedisTests(TestCase):
+    def setUp(self):
+        from config import redis
+
+        redis._forget_pool()
+        self.addCleanup(redis._forget_pool)
+
+    def test_get_redis_shares_one_pool(self):
+        from config.redis import get_redis
+
+        self.assertIs(get_redis().connection_pool, get_redis().connection_pool)
+
+    def test_pool_settings(self):
+        from config.redis import get_pool
+
+        pool = get_pool()
+        self.assertEqual(pool.max_connections, settings.REDIS_MAX_CONNECTIONS)
+        self.assertEqual(
+            pool.connection_kwargs["health_check_interval"],
+            settings.REDIS_HEALTH_CHECK_INTERVAL,
+        )
+
+    def test_async_pool_per_event_loop(self):
+        from config.redis import get_async_redis
+
+        async def get_pools():
+            return (
+                get_async_redis().connection_pool,
+                get_async_redis().connection_pool,
+            )
+
+        first, same = asyncio.run(get_pools())
+        self.assertIs(first, same)
+        self.assertEqual(first.max_connections, settings.REDIS_MAX_CONNECTIONS)
+
+        other, _ = asyncio.run(get_pools())
+        self.assertIsNot(other, first)
+
+    def test_new_pool_after_fork(self):
+        from config import redis
+
+        pool = redis.get_pool()
+        redis._forget_pool()
+        self.assertIsNot(redis.get_pool(), pool)
+
+    def test_pool_stats(self):
+        from config.redis import get_pool, pool_stats
+
+        pool = get_pool()
+        conn = pool.make_connection()
+        pool.pool.get_nowait()
+        self.assertEqual(
+            pool_stats(),
+            {
+                "max_connections": settings.REDIS_MAX_CONNECTIONS,
+                "created": 1,
+                "in_use": 1,
+                "waited_for": 0,
+            },
+        )
+
+        pool.release(conn)
+        self.assertEqual(pool_stats()["in_use"], 0)
+
+    def test_pipelines_load_scripts_once(self):
+        import fakeredis
+        from redis.client import Pipeline
+
+        from config import redis
+
+        redis._loaded_scripts.clear()
+        self.addCleanup(redis._loaded_scripts.clear)
+        r = redis.TimedRedis(
+            connection_pool=fakeredis.FakeRedis().connection_pool
+        )
+        echo = r.register_script("return ARGV[1]")
+
+        with patch.object(
+            Pipeline,
+            "load_scripts",
+            autospec=True,
+            side_effect=Pipeline.load_scripts,
+        ) as mock_load:
+            for value in (b"a", b"b"):
+                pipe = r.pipeline(transaction=False)
+                echo(args=[value], client=pipe)
+                self.assertEqual(pipe.execute(), [value])
+        mock_load.assert_called_once()
+
+        # Calls to a script Redis lost, say by restarting, are run again.
+        r.script_flush()
+        pipe = r.pipeline()
+        echo(args=["c"], client=pipe)
+        pipe.get("d")
+        self.assertEqual(pipe.execute(), [b"c", None])
+
+    def test_async_pipelines_load_scripts_once(self):
+        import fakeredis
+        from redis.asyncio.client import Pipeline
+
+        from config import redis
+
+        redis._loaded_scripts.clear()
+        self.addCleanup(redis._loaded_scripts.clear)
+
+        async def run():
+            r = redis.AsyncTimedRedis(
+                connection_pool=fakeredis.FakeAsyncRedis().connection_pool
+            )
+            echo = r.register_script("return ARGV[1]")
+            replies = []
+            for value in (b"a", b"b"):
+                pipe = r.pipeline(transaction=False)
+                await echo(args=[value], client=pipe)
+                replies += await pipe.execute()
+
+            await r.script_flush()
+            pipe = r.pipeline()
+            await echo(args=["c"], client=pipe)
+            replies += await pipe.execute()
+            return replies
+
+        with patch.object(
+            Pipeline,
+            "load_scripts",
+            autospec=True,
+            side_effect=Pipeline.load_scripts,
+        ) as mock_load:
+            self.assertEqual(asyncio.run(run()), [b"a", b"b", b"c"])
+        mock_load.assert_called_once()
+
+
+class MetricsTests(TestCase):
+    def sample(self, name, labels):
+        from prometheus_client import REGISTRY
+
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_redis_pool_observed(self):
+        import fakeredis
+
+        from config.redis import ConnectionPool, TimedRedis
+
+        fake = fakeredis.FakeRedis().connection_pool
+        pool = ConnectionPool(
+            connection_class=fake.connection_class,
+            max_connections=2,
+            **fake.connection_kwargs,
+        )
+        r = TimedRedis(connection_pool=pool)
+
+        def connections(state):
+            return self.sample(
+                "redis_pool_connections", {"pool": "sync", "state": state}
+            )
+
+        with r.pipeline() as pipe:
+            pipe.get("a")
+            conn = pool.get_connection()
+            self.assertEqual(connections("in_use"), 1)
+            pipe.execute()
+            self.assertEqual(connections("created"), 2)
+            self.assertEqual(connections("in_use"), 1)
+            pool.release(conn)
+
+        self.assertEqual(connections("in_use"), 0)
+
+    def test_async_redis_pool_observed(self):
+        import fakeredis
+
+        from config import redis
+
+        fake = fakeredis.FakeAsyncRedis().connection_pool
+        self.addCleanup(redis._forget_pool)
+
+        def connections(state):
+            return self.sample(
+                "redis_pool_connections", {"pool": "async", "state": state}
+            )
+
+        async def run():
+            pool = redis._async_pools[asyncio.get_running_loop()] = (
+                redis.AsyncConnectionPool(
+                    connection_class=fake.connection_class,
+                    **fake.connection_kwargs,
+                )
+            )
+            await redis.get_async_redis().set("a", 1)
+            conn = await pool.get_connection()
+            return connections("in_use"), conn
+
+        redis._forget_pool()
+        in_use, _ = asyncio.run(run())
+        self.assertEqual(in_use, 1)
+        self.assertEqual(connections("created"), 1)
+
+    def test_redis_commands_observed(self):
+        import fakeredis
+
+        from config.redis import TimedRedis
+
+        r = TimedRedis(connection_pool=fakeredis.FakeRedis().connection_pool)
+        gets = self.sample("redis_commands_total", {"command": "GET"})
+        pipelines = self.sample(
+            "redis_round_trip_duration_seconds_count", {"command": "PIPELINE"}
+        )
+
+        r.get("a")
+        r.pipeline().get("a").get("b").set("c", 1).execute()
+
+        self.assertEqual(
+            self.sample("redis_commands_total", {"command": "GET"}), gets + 3
+        )
+        self.assertEqual(
+            self.sample(
+                "redis_round_trip_duration_seconds_count",
+                {"command": "PIPELINE"},
+            ),
+            pipelines + 1,
+        )
+
+    def test_async_redis_commands_observed(self):
+        import fakeredis
+
+        from config.redis import AsyncTimedRedis
+
+        sets = self.sample("redis_commands_total", {"command": "SET"})
+
+        async def run():
+            pool = fakeredis.FakeAsyncRedis().connection_pool
+            r = AsyncTimedRedis(connection_pool=pool)
+            await r.set("a", 1)
+            await r.pipeline().set("b", 1).execute()
+
+        asyncio.run(run())
+        self.assertEqual(
+            self.sample("redis_commands_total", {"command": "SET"}), sets + 2
+        )
+
+    def test_view_latency_observed(self):
+        labels = {"route": "/up/", "method": "GET", "status": "200"}
+        count = self.sample("django_view_duration_seconds_count", labels)
+
+        self.client.get("/up/")
+        self.assertEqual(
+            self.sample("django_view_duration_seconds_count", labels),
+            count + 1,
+        )
+
+    def test_db_queries_observed(self):
+        from django.contrib.auth.models import User
+
+        labels = {"alias": "default", "statement": "SELECT"}
+        count = self.sample("django_db_query_duration_seconds_count", labels)
+
+        User.objects.count()
+        self.assertEqual(
+            self.sample("django_db_query_duration_seconds_count", labels),
+            count + 1,
+        )
+
+
+PROFILED_MIDDLEWARE = [
+    "config.profiling.profiling_middleware",
+    *settings.MIDDLEWARE,
+]
+
+
+@override_settings(
+    MIDDLEWARE=PROFILED_MIDDLEWARE,
+    PROFILING_SAMPLE_RATE=0,
+    PROFILING_TOKEN="secret",
+    PROFILING_KEEP=100,
+)
+class ProfilingTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+
+        profiling_dir = override_settings(PROFILING_DIR=directory.name)
+        profiling_dir.enable()
+        self.addCleanup(profiling_dir.disable)
+
+    def report(self, response):
+        name = response["X-Profile-Id"]
+        self.assertTrue((self.directory / f"{name}.prof").exists())
+        return json.loads((self.directory / f"{name}.json").read_text())
+
+    def test_not_sampled(self):
+        response = self.client.get("/up/")
+
+        self.assertNotIn("X-Profile-Id", response)
+        self.assertEqual(list(self.directory.iterdir()), [])
+
+    def test_wrong_token(self):
+        response = self.client.get("/up/", headers={"X-Profile": "nope"})
+
+        self.assertNotIn("X-Profile-Id", response)
+
+    def test_token(self):
+        response = self.client.get("/up/", headers={"X-Profile": "secret"})
+
+        report = self.report(response)
+        self.assertEqual(report["method"], "GET")
+        self.assertEqual(report["path"], "/up/")
+        self.assertEqual(report["status"], 200)
+        self.assertGreater(report["duration_ms"], 0)
+        self.assertTrue(report["slowest"])
+        self.assertIn("-GET-up-", response["X-Profile-Id"])
+
+    @override_settings(PROFILING_SAMPLE_RATE=1)
+    def test_sampled(self):
+        response = self.client.get("/up/")
+
+        self.assertEqual(self.report(response)["status"], 200)
+
+    @override_settings(PROFILING_SAMPLE_RATE=1)
+    def test_async_sampled(self):
+        response = asyncio.run(self.async_client.get("/up/"))
+
+        self.assertEqual(self.report(response)["status"], 200)
+
+    @override_settings(PROFILING_SAMPLE_RATE=1, PROFILING_KEEP=2)
+    def test_keeps_newest(self):
+        names = [self.client.get("/up/")["X-Profile-Id"] for _ in range(3)]
+
+        kept = {path.stem for path in self.directory.iterdir()}
+        self.assertEqual(len(kept), 2)
+        self.assertIn(names[-1], kept)
+
+    def test_redis_and_sql_timed(self):
+        import fakeredis
+        from django.contrib.auth.models import User
+        from django.db import connection
+        from django.test import RequestFactory
+
+        from config import profiling
+        from config.redis import TimedRedis
+
+        profiling._time_queries(None, connection)
+        r = TimedRedis(connection_pool=fakeredis.FakeRedis().connection_pool)
+
+        def view(request):
+            r.get("a")
+            User.objects.count()
+            return HttpResponse()
+
+        request = RequestFactory().get("/", headers={"X-Profile": "secret"})
+        response = profiling.profiling_middleware(view)(request)
+
+        # Nothing is collected outside of a profiled request.
+        r.get("b")
+        User.objects.count()
+
+        report = self.report(response)
+        self.assertEqual(
+            [command["commands"] for command in report["redis"]], [["GET"]]
+        )
+        self.assertEqual(len(report["sql"]), 1)
+        self.assertIn("COUNT", report["sql"][0]["sql"])
+
+    @patch.dict(os.environ, {"PROFILING_SAMPLE_RATE": "0.01"})
+    def test_installed_when_enabled(self):
+        from config import settings as config_settings
+
+        reload(config_settings)
+        self.assertEqual(
+            config_settings.MIDDLEWARE[0],
+            "config.profiling.profiling_middleware",
+        )
+
+    def test_not_installed_by_default(self):
+        from config import settings as config_settings
+
+        reload(config_settings)
+        self.assertNotIn(
+            "config.profiling.profiling_middleware",
+            config_settings.MIDDLEWARE,
+        )
+
+
 class CeleryTests(TestCase):
     def test_celery(self):
         from config import celery  # noqa
 
+    def test_result_serializers(self):
+        from kombu.serialization import dumps, loads
+
+        from config.serializers import (
+            RESULT_SERIALIZERS,
+            decode_result,
+            encode_result,
+            result_format,
+        )
+
+        meta = {"status": "SUCCESS", "result": [1, "a"], "children": []}
+        for serializer in RESULT_SERIALIZERS:
+            content_type, encoding, payload = dumps(meta, serializer)
+            self.assertEqual(
+                loads(payload, content_type, encoding, accept=[content_type]),
+                meta,
+            )
+
+            # Redis hands back bytes, even for results stored as text
+            if isinstance(payload, str):
+                payload = payload.encode()
+            self.assertEqual(result_format(payload), serializer)
+            self.assertEqual(decode_result(payload), meta)
+            self.assertEqual(encode_result(meta, serializer)[:1], payload[:1])
+
 
 class GunicornTests(TestCase):
     @patch.dict(os.environ, {"PORT": "8080"})
@@ -70,9 +607,124 @@ class GunicornTests(TestCase):
         reload(gunicorn)
         self.assertEqual(gunicorn.bind, "0.0.0.0:8080")
 
-    @patch("multiprocessing.cpu_count", return_value=2)
-    def test_gunicorn_workers(self, mock_cpu_count):
+    def cgroup(self, files, cpus=2):
+        """Load the gunicorn config as if in a container with these files."""
+        real_open = open
+
+        def fake_open(path, *args, **kwargs):
+            if str(path).startswith("/sys/fs/cgroup/"):
+                if path not in files:
+                    raise FileNotFoundError(path)
+                return mock_open(read_data=files[path])()
+            return real_open(path, *args, **kwargs)
+
         from config import gunicorn
 
-        reload(gunicorn)
+        with (
+            patch("builtins.open", fake_open),
+            patch("os.sched_getaffinity", return_value=set(range(cpus))),
+        ):
+            reload(gunicorn)
+        return gunicorn
+
+    def test_gunicorn_workers(self):
+        gunicorn = self.cgroup({})
         self.assertEqual(gunicorn.workers, 4)
+        self.assertEqual(gunicorn.threads, 1)
+        self.assertEqual(gunicorn.max_worker_memory, 0)
+
+    @patch.dict(os.environ, {"WEB_WORKER_MEMORY": "256"})
+    def test_gunicorn_workers_cgroup_v2(self):
+        gunicorn = self.cgroup(
+            {
+                "/sys/fs/cgroup/cpu.max": "150000 100000",
+                "/sys/fs/cgroup/memory.max": str(512 * 1024 * 1024),
+            },
+            cpus=16,
+        )
+        # 1.5 CPUs make for 3 workers, but only 2 fit in the memory limit.
+        self.assertEqual(gunicorn.workers, 2)
+        self.assertEqual(gunicorn.threads, 1)
+        self.assertEqual(gunicorn.max_worker_memory, 230 * 1024 * 1024)
+
+    def test_gunicorn_workers_cgroup_v1(self):
+        gunicorn = self.cgroup(
+            {
+                "/sys/fs/cgroup/cpu/cpu.cfs_quota_us": "100000",
+                "/sys/fs/cgroup/cpu/cpu.cfs_period_us": "100000",
+                "/sys/fs/cgroup/memory/memory.limit_in_bytes": str(2**63),
+            },
+            cpus=16,
+        )
+        self.assertEqual(gunicorn.workers, 2)
+        self.assertEqual(gunicorn.max_worker_memory, 0)
+
+    @patch.dict(os.environ, {"WEB_WORKER_MEMORY": "512"})
+    def test_gunicorn_threads_make_up_for_memory(self):
+        gunicorn = self.cgroup(
+            {
+                "/sys/fs/cgroup/cpu.max": "max 100000",
+                "/sys/fs/cgroup/memory.max": str(512 * 1024 * 1024),
+            },
+        )
+        self.assertEqual(gunicorn.workers, 1)
+        self.assertEqual(gunicorn.threads, 4)
+
+    @patch.dict(os.environ, {"WEB_PRELOAD": "true", "WEB_RELOAD": "true"})
+    def test_gunicorn_no_preload_with_reload(self):
+        gunicorn = self.cgroup({})
+        self.assertFalse(gunicorn.preload_app)
+
+    @patch.dict(os.environ, {"WEB_PRELOAD": "true", "WEB_RELOAD": "false"})
+    def test_gunicorn_preload(self):
+        gunicorn = self.cgroup({})
+        self.assertTrue(gunicorn.preload_app)
+
+    @patch.dict(
+        os.environ,
+        {
+            "WEB_MAX_MEMORY": "1",
+            "WEB_MAX_MEMORY_JITTER": "0",
+            "WEB_MEMORY_CHECK_INTERVAL": "0.01",
+        },
+    )
+    def test_gunicorn_restarts_worker_over_memory(self):
+        gunicorn = self.cgroup({})
+        killed = threading.Event()
+        server, worker = MagicMock(), MagicMock(pid=1234)
+
+        with patch(
+            "os.kill", side_effect=lambda pid, sig: killed.set()
+        ) as mock_kill:
+            gunicorn.post_fork(server, worker)
+            self.assertTrue(killed.wait(5))
+
+        mock_kill.assert_called_once_with(1234, signal.SIGTERM)
+        self.assertGreater(gunicorn.worker_memory(), 1024 * 1024)
+
+    @patch("config.warmup.warm_up", return_value={"templates": 0.01})
+    def test_gunicorn_post_worker_init(self, mock_warm_up):
+        from config import gunicorn
+
+        worker = MagicMock(pid=1234)
+        gunicorn.post_worker_init(worker)
+
+        mock_warm_up.assert_called_once()
+        worker.log.info.assert_called_once_with(
+            "Worker %s warmed up in %s", 1234, "templates 10ms"
+        )
+
+    @patch.dict(os.environ, {"WEB_ASGI": "true"})
+    def test_gunicorn_asgi(self):
+        from config import gunicorn
+
+        reload(gunicorn)
+        self.assertEqual(gunicorn.worker_class, "uvicorn_worker.UvicornWorker")
+        self.assertEqual(gunicorn.wsgi_app, "config.asgi:application")
+
+    @patch.dict(os.environ, {"WEB_ASGI": "false"})
+    def test_gunicorn_wsgi(self):
+        from config import gunicorn
+
+        reload(gunicorn)
+        self.assertEqual(gunicorn.wsgi_app, "config.wsgi:application")
@@ -24,7 +24,7 @@ urlpatterns = [
     path("", include("pages.urls")),
     path("admin/", admin.site.urls),
 ]
-if not settings.TESTING:
+if settings.DEBUG_TOOLBAR:
     urlpatterns = [
         *urlpatterns,
         path("__debug__/", include("debug_toolbar.urls")),
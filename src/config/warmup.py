@@ -0,0 +1,135 @@
+import logging
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.template import engines
+from django.template.autoreload import get_template_directories
+
+from config.redis import close_async_pool, get_async_pool, get_pool
+
+logger = logging.getLogger(__name__)
+
+
+def warm_up():
+    """
+    Do the work the first requests a new worker serves would otherwise pay
+    for, returning how many seconds each step took. A step that fails is
+    logged and skipped since the worker can still serve requests without it.
+    """
+    timings = {}
+
+    for name, step in (
+        ("templates", compile_templates),
+        ("redis", open_redis_connections),
+        ("postgres", open_postgres_pools),
+    ):
+        started = time.perf_counter()
+        try:
+            step()
+        except Exception:
+            logger.warning("Warming up %s failed", name, exc_info=True)
+        timings[name] = time.perf_counter() - started
+
+    return timings
+
+
+def compile_templates():
+    """
+    Compile the project's own templates into the cached template loader.
+    Those of installed packages (such as the admin's) are left to be
+    compiled when they're first used.
+    """
+    if settings.DEBUG:
+        # Templates aren't cached while debugging, see TEMPLATES.
+        return 0
+
+    compiled = 0
+    for directory in get_template_directories():
+        if not directory.is_relative_to(settings.BASE_DIR):
+            continue
+
+        for path in directory.rglob("*.html"):
+            name = path.relative_to(directory).as_posix()
+            for engine in engines.all():
+                engine.get_template(name)
+            compiled += 1
+
+    return compiled
+
+
+def open_redis_connections():
+    """
+    Open WARMUP_REDIS_CONNECTIONS connections in the sync Redis pool, which
+    serves WSGI workers. ASGI workers read through the pool of their event
+    loop instead, which lifespan() warms up once that loop is running.
+    """
+    pool = get_pool()
+
+    # Every connection has to be checked out at once, or the pool would
+    # keep handing back the same one.
+    opened = [pool.get_connection() for _ in range(_redis_connections())]
+    for connection in opened:
+        pool.release(connection)
+
+    return len(opened)
+
+
+async def aopen_redis_connections():
+    """Async version of open_redis_connections, for the running loop."""
+    pool = get_async_pool()
+
+    opened = [await pool.get_connection() for _ in range(_redis_connections())]
+    for connection in opened:
+        await pool.release(connection)
+
+    return len(opened)
+
+
+def _redis_connections():
+    return min(
+        settings.WARMUP_REDIS_CONNECTIONS, settings.REDIS_MAX_CONNECTIONS
+    )
+
+
+async def lifespan(receive, send):
+    """
+    Handle the lifespan messages an ASGI server sends on a worker's event
+    loop, see config.asgi. The loop's Redis pool is warmed up at startup,
+    like warm_up() does for the sync one, and closed at shutdown.
+    """
+    while True:
+        message = await receive()
+
+        if message["type"] == "lifespan.startup":
+            started = time.perf_counter()
+            try:
+                await aopen_redis_connections()
+            except Exception:
+                logger.warning("Warming up async redis failed", exc_info=True)
+            else:
+                logger.info(
+                    "Warmed up async redis in %.0fms",
+                    (time.perf_counter() - started) * 1000,
+                )
+            await send({"type": "lifespan.startup.complete"})
+
+        elif message["type"] == "lifespan.shutdown":
+            try:
+                await close_async_pool()
+            except Exception:
+                logger.warning("Closing async redis failed", exc_info=True)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+def open_postgres_pools():
+    """Open and fill the connection pool of every database that has one."""
+    opened = 0
+    for connection in connections.all(initialized_only=False):
+        pool = getattr(connection, "pool", None)
+        if pool is not None:
+            pool.open(wait=True, timeout=settings.UP_POSTGRES_TIMEOUT)
+            opened += 1
+
+    return opened
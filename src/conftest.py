@@ -0,0 +1,9 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def _no_task_cache(settings):
+    # TESTING only covers manage.py test. Tests that run against a real
+    # Redis would otherwise get tasks from a cache that's kept fresh by a
+    # listener thread they don't control.
+    settings.TASK_CACHE_SIZE = 0
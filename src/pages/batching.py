@@ -0,0 +1,113 @@
+import atexit
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+
+from pages.tasks import add_names_to_queue
+
+logger = logging.getLogger(__name__)
+
+
+class NameBatcher:
+    """
+    Collects names and queues them as one add_names_to_queue task.
+
+    A batch goes out as soon as it has max_size names in it or max_delay
+    seconds after its first name came in, whichever happens first.
+    """
+
+    def __init__(self, max_size, max_delay):
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self._reset()
+
+    def _reset(self):
+        self._names = []
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def add(self, name):
+        with self._lock:
+            self._names.append(name)
+            full = len(self._names) >= self.max_size
+
+            if not full:
+                self._schedule()
+
+        if full:
+            self.flush()
+
+    def _schedule(self):
+        # Called with the lock held.
+        if self._timer is None:
+            self._timer = threading.Timer(self.max_delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """
+        Queue the names collected so far, returning whether that worked.
+        Names that couldn't be queued are kept and tried again after
+        max_delay, or sooner if the batch fills up.
+        """
+        return self._send(retry_later=True)
+
+    def drain(self, attempts=3, delay=1):
+        """
+        Queue the names collected so far on the way out of the process,
+        trying up to attempts times delay seconds apart. Names still left
+        after that are logged and dropped.
+        """
+        for attempt in range(attempts):
+            if attempt:
+                time.sleep(delay)
+            if self._send(retry_later=False):
+                return True
+
+        with self._lock:
+            names, self._names = self._names, []
+        logger.error("Dropped %s name(s) that couldn't be queued", len(names))
+        return False
+
+    def _send(self, retry_later):
+        with self._lock:
+            names, self._names = self._names, []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+        if not names:
+            return True
+
+        try:
+            add_names_to_queue.delay(names)
+        except Exception:
+            # Whoever added the last name has had their request answered
+            # already, so this is only logged.
+            logger.warning(
+                "Couldn't queue %s name(s), keeping them to try again",
+                len(names),
+                exc_info=True,
+            )
+            with self._lock:
+                self._names[:0] = names
+                if retry_later:
+                    self._schedule()
+            return False
+
+        return True
+
+
+name_batcher = NameBatcher(
+    settings.NAMES_BATCH_SIZE, settings.NAMES_BATCH_MAX_DELAY
+)
+
+# Names still waiting when the process exits get sent on the way out. The
+# gunicorn config also drains the batch when a worker exits.
+atexit.register(name_batcher.drain)
+
+# A forked worker starts with an empty batch of its own.
+os.register_at_fork(after_in_child=name_batcher._reset)
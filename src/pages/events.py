@@ -0,0 +1,126 @@
+import asyncio
+import contextlib
+import logging
+import weakref
+
+from django.conf import settings
+from redis import asyncio as aioredis
+
+from pages.tasks import TASK_EVENTS_CHANNEL
+
+logger = logging.getLogger(__name__)
+
+# Put in a subscriber's queue when it fell too far behind and missed events,
+# so the page has to be reloaded to catch up.
+RESET = b'{"type":"reset"}'
+
+
+class TaskEvents:
+    """
+    Fans out the task events published to Redis to every open event stream of
+    an event loop, over a single subscription. Each stream only costs a queue
+    rather than a Redis connection of its own.
+    """
+
+    def __init__(self):
+        self.queues = set()
+        self.listener = None
+
+    @contextlib.asynccontextmanager
+    async def subscribe(self):
+        """
+        Yield a queue of events as published. Should the subscription to
+        Redis drop, RESET is queued once it's back since events were missed
+        in the meantime.
+        """
+        queue = asyncio.Queue(maxsize=settings.TASK_EVENTS_QUEUE_SIZE)
+        self.queues.add(queue)
+        if self.listener is None:
+            self.listener = asyncio.create_task(self._listen())
+
+        try:
+            yield queue
+        finally:
+            self.queues.discard(queue)
+            # Nobody is listening anymore so the connection can go back.
+            if not self.queues and self.listener is not None:
+                self.listener.cancel()
+                self.listener = None
+
+    async def _listen(self):
+        delay = 1
+        missed = False
+        while True:
+            client = connect()
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(TASK_EVENTS_CHANNEL)
+                delay = 1
+                if missed:
+                    for queue in list(self.queues):
+                        self._put(queue, RESET)
+                    missed = False
+
+                while True:
+                    # Waking up now and then lets the connection be health
+                    # checked, see connect().
+                    message = await pubsub.get_message(
+                        ignore_subscribe_messages=True,
+                        timeout=settings.TASK_EVENTS_KEEPALIVE,
+                    )
+                    if message is not None:
+                        for queue in list(self.queues):
+                            self._put(queue, message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(
+                    "Task events lost their Redis subscription, retrying in "
+                    "%ss: %s",
+                    delay,
+                    e,
+                )
+                missed = True
+            finally:
+                await pubsub.aclose()
+                await client.aclose()
+
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30)
+
+    def _put(self, queue, event):
+        if queue.full():
+            # Whatever is still waiting is useless without the events that
+            # get dropped here.
+            while not queue.empty():
+                queue.get_nowait()
+            event = RESET
+
+        queue.put_nowait(event)
+
+
+def connect():
+    """
+    Open a client of its own for the subscription. The pool's socket timeout
+    would cut off a quiet subscription, so it waits as long as it takes while
+    idle connections get pinged to find out about dead ones.
+    """
+    return aioredis.Redis.from_url(
+        settings.REDIS_URL,
+        socket_timeout=None,
+        socket_connect_timeout=settings.REDIS_SOCKET_CONNECT_TIMEOUT,
+        health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL,
+    )
+
+
+_task_events = weakref.WeakKeyDictionary()
+
+
+def subscribe_task_events():
+    loop = asyncio.get_running_loop()
+
+    events = _task_events.get(loop)
+    if events is None:
+        events = _task_events[loop] = TaskEvents()
+
+    return events.subscribe()
@@ -0,0 +1,90 @@
+import csv
+
+import orjson
+
+from pages.models import result_text
+
+EXPORT_FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+# The CSV columns. NDJSON has every field of every task instead.
+EXPORT_FIELDS = [
+    "task_id",
+    "status",
+    "result",
+    "date_done",
+    "completed",
+    "traceback",
+]
+
+
+class _Echo:
+    """Hands back what the csv module writes rather than buffering it."""
+
+    def write(self, value):
+        return value
+
+
+def export_tasks(tasks, export_format, chunk_size):
+    """
+    Yield tasks encoded as CSV or NDJSON, chunk_size rows per string, so only
+    a single chunk is ever held in memory.
+    """
+    header, encode = _encoder(export_format)
+    if header:
+        yield header
+
+    rows = []
+    for task in tasks:
+        rows.append(encode(task))
+        if len(rows) == chunk_size:
+            yield "".join(rows)
+            rows = []
+
+    if rows:
+        yield "".join(rows)
+
+
+async def aexport_tasks(tasks, export_format, chunk_size):
+    """Async version of export_tasks, for an async iterator of tasks."""
+    header, encode = _encoder(export_format)
+    if header:
+        yield header
+
+    rows = []
+    async for task in tasks:
+        rows.append(encode(task))
+        if len(rows) == chunk_size:
+            yield "".join(rows)
+            rows = []
+
+    if rows:
+        yield "".join(rows)
+
+
+def _encoder(export_format):
+    if export_format == "ndjson":
+        return None, _encode_json
+
+    writer = csv.writer(_Echo())
+
+    def encode_csv(task):
+        return writer.writerow(_csv_row(task))
+
+    return writer.writerow(EXPORT_FIELDS), encode_csv
+
+
+def _encode_json(task):
+    return orjson.dumps(task, default=str).decode() + "\n"
+
+
+def _csv_row(task):
+    completed = task.get("completed")
+    return [
+        task.get("task_id"),
+        task.get("status"),
+        # The same text the result index sorts by.
+        result_text(task.get("result")),
+        task.get("date_done"),
+        "" if completed is None else str(completed).lower(),
+        task.get("traceback"),
+    ]
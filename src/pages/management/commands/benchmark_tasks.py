@@ -0,0 +1,329 @@
+import asyncio
+import json
+import platform
+import random
+import resource
+import statistics
+import sys
+import time
+import tracemalloc
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+import fakeredis
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, override_settings
+from redis import Redis
+from redis import asyncio as aioredis
+from redis.exceptions import ResponseError
+
+from pages.task_cache import TaskCache
+from pages.tasks import (
+    SORT_INDEX_KEYS,
+    SORT_VALUES_KEY,
+    TASK_INDEX_KEY,
+    TASK_KEY_PREFIX,
+    TASK_STATUS_KEY_PREFIX,
+    bump_task_set_version,
+    read_tasks_from_db,
+    update_task_in_db,
+    update_tasks_in_db,
+)
+
+STATUSES = ["SUCCESS"] * 8 + ["FAILURE", "PENDING"]
+
+# The same order as the INDEX_TASK script gives them.
+COMPLETED_SCORES = {None: 0, False: 1, True: 2}
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed Redis with task results and measure how reading, listing and "
+        "updating tasks scale, printing the results as JSON"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            default="1000,10000,100000,1000000",
+            help="Comma separated numbers of tasks to seed, one run each",
+        )
+        parser.add_argument(
+            "--redis-url",
+            help=(
+                "Benchmark against this Redis rather than fakeredis. Its "
+                "database has to be empty and is flushed after every run."
+            ),
+        )
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument("--updates", type=int, default=1000)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", help="Write the JSON here instead")
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options["sizes"].split(",")]
+        except ValueError:
+            raise CommandError("--sizes must be a list of numbers")
+        if options["repeat"] < 1:
+            raise CommandError("--repeat must be at least 1")
+
+        results = []
+        for size in sizes:
+            r, ar = self.connect(options["redis_url"])
+            try:
+                results.append(self.run(r, ar, size, options))
+            finally:
+                r.flushdb()
+
+        report = {
+            "redis": "redis" if options["redis_url"] else "fakeredis",
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "page_size": settings.TASKS_PAGE_SIZE,
+            "repeat": options["repeat"],
+            "results": results,
+            "max_rss_bytes": _max_rss(),
+        }
+
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output + "\n")
+        else:
+            self.stdout.write(output)
+
+    def connect(self, redis_url):
+        if redis_url is None:
+            server = fakeredis.FakeServer()
+            return (
+                fakeredis.FakeRedis(server=server),
+                lambda: fakeredis.FakeAsyncRedis(server=server),
+            )
+
+        r = Redis.from_url(redis_url)
+        if r.dbsize():
+            raise CommandError(
+                f"{redis_url} isn't empty, point --redis-url at an unused "
+                "database since it gets flushed"
+            )
+        return r, lambda: aioredis.Redis.from_url(redis_url)
+
+    def run(self, r, ar, size, options):
+        self.stderr.write(f"Benchmarking {size} task(s)")
+
+        started = time.perf_counter()
+        task_ids = seed_tasks(r, size, random.Random(options["seed"]))
+        result = {
+            "tasks": size,
+            "seed_seconds": time.perf_counter() - started,
+            "redis_memory_bytes": _redis_memory(r),
+        }
+
+        with (
+            patch("pages.tasks.get_redis", lambda: r),
+            patch("pages.tasks.get_async_redis", ar),
+            # Measure reading tasks from Redis, which is what the cache has
+            # to fall back on, rather than repeat reads of the same pages.
+            patch(
+                "pages.tasks.get_task_cache",
+                lambda key_prefixes: TaskCache(0, key_prefixes),
+            ),
+            # Every page is read from Redis rather than the page cache.
+            override_settings(
+                CACHES={
+                    "default": {
+                        "BACKEND": (
+                            "django.core.cache.backends.dummy.DummyCache"
+                        )
+                    }
+                },
+                ALLOWED_HOSTS=["testserver"],
+                TASK_LIST_SOURCE="redis",
+            ),
+        ):
+            result["read_tasks_from_db"] = self.read_tasks(
+                size, options["repeat"]
+            )
+            result["task_list"] = asyncio.run(
+                self.task_list(options["repeat"])
+            )
+            result["update_task_in_db"] = self.update_tasks(
+                task_ids, options["updates"]
+            )
+
+        return result
+
+    def read_tasks(self, size, repeat):
+        page_size = settings.TASKS_PAGE_SIZE + 1
+        results = {}
+
+        for sort_by in SORT_INDEX_KEYS:
+            results[sort_by] = {}
+            for page, cursor in (
+                ("first_page", 0),
+                ("middle_page", size // 2),
+            ):
+                results[sort_by][page] = _timings(
+                    lambda: read_tasks_from_db(
+                        settings,
+                        sort_by=sort_by,
+                        page_size=page_size,
+                        cursor=cursor,
+                    ),
+                    repeat,
+                )
+
+        return results
+
+    async def task_list(self, repeat):
+        client = AsyncClient()
+        results = {}
+
+        for sort_by in SORT_INDEX_KEYS:
+            url = f"/tasks/?sort_by={sort_by}"
+
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                response = await client.get(url)
+                timings.append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    raise CommandError(
+                        f"{url} returned {response.status_code}"
+                    )
+
+            # Memory is traced in a run of its own since tracing slows
+            # everything down.
+            tracemalloc.start()
+            try:
+                await client.get(url)
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+
+            results[sort_by] = {**_stats(timings), "peak_memory_bytes": peak}
+
+        return results
+
+    def update_tasks(self, task_ids, count):
+        updates = [
+            (task_id, {"completed": i % 2 == 0})
+            for i, task_id in enumerate(task_ids[:count])
+        ]
+        if not updates:
+            return {}
+
+        started = time.perf_counter()
+        for task_id, data_to_update in updates:
+            update_task_in_db(settings, task_id, data_to_update)
+        single = time.perf_counter() - started
+
+        # The same as ticking a whole page of checkboxes at once.
+        batch_size = settings.TASKS_MAX_PAGE_SIZE
+        started = time.perf_counter()
+        for i in range(0, len(updates), batch_size):
+            update_tasks_in_db(settings, updates[i : i + batch_size])
+        batched = time.perf_counter() - started
+
+        return {
+            "updates": len(updates),
+            "single_per_second": len(updates) / single,
+            "batched_per_second": len(updates) / batched,
+            "batch_size": batch_size,
+        }
+
+
+def seed_tasks(r, count, rng, batch_size=10000):
+    """
+    Store count JSON task results and index them the way the INDEX_TASK
+    script would, in bulk, since running the script once per task takes
+    far too long in fakeredis. Returns the ids of the tasks.
+    """
+    started = datetime(2024, 1, 1, tzinfo=timezone.utc).timestamp()
+    task_ids = []
+
+    for start in range(0, count, batch_size):
+        payloads = {}
+        index = {key: {} for key in SORT_INDEX_KEYS.values()}
+        values = {}
+        statuses = defaultdict(list)
+
+        for i in range(start, min(start + batch_size, count)):
+            task_id = str(uuid.UUID(int=rng.getrandbits(128)))
+            done_at = started + i
+            task = {
+                "status": rng.choice(STATUSES),
+                "result": f"name-{rng.randrange(count):07d}",
+                "traceback": None,
+                "children": [],
+                "date_done": datetime.fromtimestamp(
+                    done_at, tz=timezone.utc
+                ).isoformat(),
+                "task_id": task_id,
+                "completed": rng.choice([None, False, True]),
+            }
+            task_ids.append(task_id)
+            payloads[f"{TASK_KEY_PREFIX}{task_id}"] = json.dumps(task)
+
+            status, result = task["status"], task["result"]
+            index[TASK_INDEX_KEY][task_id] = done_at
+            index[SORT_INDEX_KEYS["completed"]][task_id] = COMPLETED_SCORES[
+                task["completed"]
+            ]
+            index[SORT_INDEX_KEYS["task_id"]][task_id] = 0
+            index[SORT_INDEX_KEYS["status"]][f"{status}\0{task_id}"] = 0
+            index[SORT_INDEX_KEYS["result"]][f"{result}\0{task_id}"] = 0
+            values[task_id] = json.dumps(
+                [status, result], separators=(",", ":")
+            )
+            statuses[f"{TASK_STATUS_KEY_PREFIX}{status}"].append(task_id)
+
+        pipe = r.pipeline(transaction=False)
+        pipe.mset(payloads)
+        for key, members in index.items():
+            pipe.zadd(key, members)
+        pipe.hset(SORT_VALUES_KEY, mapping=values)
+        for key, members in statuses.items():
+            pipe.sadd(key, *members)
+        pipe.execute()
+
+    bump_task_set_version(r)
+    return task_ids
+
+
+def _timings(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+
+    return _stats(timings)
+
+
+def _stats(timings):
+    timings = sorted(timing * 1000 for timing in timings)
+    return {
+        "min_ms": timings[0],
+        "median_ms": statistics.median(timings),
+        "p95_ms": timings[max(round(len(timings) * 0.95) - 1, 0)],
+        "max_ms": timings[-1],
+    }
+
+
+def _redis_memory(r):
+    try:
+        return r.info("memory").get("used_memory")
+    except ResponseError:
+        # fakeredis has no INFO command
+        return None
+
+
+def _max_rss():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return rss if sys.platform == "darwin" else rss * 1024
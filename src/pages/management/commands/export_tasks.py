@@ -0,0 +1,57 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from pages.export import EXPORT_FORMATS, export_tasks
+from pages.tasks import iter_tasks_from_archive, scan_tasks
+
+
+class Command(BaseCommand):
+    help = (
+        "Write every task as CSV or NDJSON, reading and writing them one "
+        "chunk at a time"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--format", choices=list(EXPORT_FORMATS), default="csv"
+        )
+        parser.add_argument(
+            "--source",
+            choices=["redis", "postgres"],
+            default=settings.TASK_LIST_SOURCE,
+            help=(
+                "Read every task result left in Redis, in no particular "
+                "order, or the archived tasks in Postgres by completion time"
+            ),
+        )
+        parser.add_argument(
+            "--chunk-size", type=int, default=settings.TASKS_FETCH_CHUNK_SIZE
+        )
+        parser.add_argument("--output", help="Write to this file instead")
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        if options["source"] == "postgres":
+            tasks = iter_tasks_from_archive(settings, chunk_size=chunk_size)
+        else:
+            tasks = scan_tasks(settings, chunk_size=chunk_size)
+
+        self.exported = 0
+        chunks = export_tasks(
+            self.counted(tasks), options["format"], chunk_size
+        )
+        if options["output"]:
+            with open(options["output"], "w", newline="") as f:
+                f.writelines(chunks)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending="")
+            self.stdout.flush()
+
+        # Stdout may be the export itself.
+        self.stderr.write(f"Exported {self.exported} task(s)")
+
+    def counted(self, tasks):
+        for task in tasks:
+            self.exported += 1
+            yield task
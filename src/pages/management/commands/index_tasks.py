@@ -0,0 +1,42 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+
+from config.redis import get_redis
+from config.serializers import decode_result
+from pages.tasks import TASK_KEY_PREFIX, bump_task_set_version, index_task
+
+
+class Command(BaseCommand):
+    help = "Add task results that are missing from the task index"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        r = get_redis()
+        indexed = 0
+
+        # SCAN walks the keyspace in small steps so Redis stays responsive,
+        # unlike the KEYS command which blocks until it has seen every key.
+        for key in r.scan_iter(
+            match=f"{TASK_KEY_PREFIX}*", count=options["batch_size"]
+        ):
+            task_data = r.get(key)
+            if not task_data:
+                continue
+
+            task = decode_result(task_data)
+            try:
+                done_at = datetime.fromisoformat(task["date_done"]).timestamp()
+            except (KeyError, TypeError, ValueError):
+                done_at = 0
+
+            task_id = key.decode().removeprefix(TASK_KEY_PREFIX)
+            index_task(r, task_id, done_at, task)
+            indexed += 1
+
+        if indexed:
+            bump_task_set_version(r)
+
+        self.stdout.write(f"Indexed {indexed} task(s)")
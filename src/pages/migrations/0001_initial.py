@@ -0,0 +1,46 @@
+# Generated by Django 5.2.6 on 2026-10-18 11:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    initial = True
+
+    dependencies = []
+
+    operations = [
+        migrations.CreateModel(
+            name="TaskRecord",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("task_id", models.CharField(max_length=255, unique=True)),
+                ("status", models.CharField(blank=True, max_length=50)),
+                ("result", models.JSONField(null=True)),
+                ("date_done", models.DateTimeField(null=True)),
+                ("completed", models.BooleanField(null=True)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["date_done"],
+                        name="pages_taskr_date_do_024579_idx",
+                    ),
+                    models.Index(
+                        fields=["status"], name="pages_taskr_status_d80ae7_idx"
+                    ),
+                    models.Index(
+                        fields=["completed"],
+                        name="pages_taskr_complet_2b7ea8_idx",
+                    ),
+                ],
+            },
+        ),
+    ]
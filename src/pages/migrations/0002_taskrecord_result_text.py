@@ -0,0 +1,53 @@
+# Generated by Django 5.2.6 on 2026-10-18 11:16
+
+import json
+
+from django.db import migrations, models
+
+
+# A copy of pages.models.result_text as it was when this migration was
+# written, so later changes to it don't change what this migration does.
+def result_text(result):
+    if result is None:
+        return ""
+    if isinstance(result, str):
+        return result
+
+    return json.dumps(result, separators=(",", ":"))
+
+
+def fill_result_text(apps, schema_editor):
+    TaskRecord = apps.get_model("pages", "TaskRecord")
+
+    records = TaskRecord.objects.exclude(result=None).only("result")
+    batch = []
+    for record in records.iterator(chunk_size=1000):
+        record.result_text = result_text(record.result)
+        batch.append(record)
+        if len(batch) == 1000:
+            TaskRecord.objects.bulk_update(batch, ["result_text"])
+            batch = []
+    TaskRecord.objects.bulk_update(batch, ["result_text"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("pages", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="taskrecord",
+            name="result_text",
+            field=models.TextField(blank=True, default=""),
+        ),
+        migrations.AddIndex(
+            model_name="taskrecord",
+            index=models.Index(
+                fields=["result_text"],
+                name="pages_taskr_result_text_idx",
+                opclasses=["text_pattern_ops"],
+            ),
+        ),
+        migrations.RunPython(fill_result_text, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.6 on 2026-10-18 15:02
+
+from django.db import migrations, models
+from django.db.models.functions import Substr
+
+
+def fill_result_prefix(apps, schema_editor):
+    TaskRecord = apps.get_model("pages", "TaskRecord")
+
+    TaskRecord.objects.exclude(result_text="").update(
+        result_prefix=Substr("result_text", 1, 200)
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("pages", "0002_taskrecord_result_text"),
+    ]
+
+    operations = [
+        # Results over about 2.7kB couldn't be archived with the whole text
+        # in a b-tree index.
+        migrations.RemoveIndex(
+            model_name="taskrecord",
+            name="pages_taskr_result_text_idx",
+        ),
+        migrations.AddField(
+            model_name="taskrecord",
+            name="result_prefix",
+            field=models.CharField(blank=True, default="", max_length=200),
+        ),
+        migrations.RunPython(fill_result_prefix, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="taskrecord",
+            index=models.Index(
+                fields=["result_prefix"],
+                name="pages_taskr_result_prefix_idx",
+                opclasses=["text_pattern_ops"],
+            ),
+        ),
+    ]
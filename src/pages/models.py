@@ -0,0 +1,85 @@
+import json
+from datetime import datetime, timezone
+
+from django.db import models
+
+# How much of a result's text is indexed for prefix lookups. A b-tree entry
+# can't be over 2704 bytes in Postgres, which this many characters stay under
+# even at 4 bytes each.
+RESULT_PREFIX_LENGTH = 200
+
+
+class TaskRecord(models.Model):
+    """A finished Celery task, archived from Redis by pages.tasks."""
+
+    task_id = models.CharField(max_length=255, unique=True)
+    status = models.CharField(max_length=50, blank=True)
+    result = models.JSONField(null=True)
+    # The result as text, the way the Redis result index sorts it, so the
+    # task list can sort by it and look results up by prefix. Lookups go
+    # through the start of it, which unlike the whole text always fits in an
+    # index.
+    result_text = models.TextField(blank=True, default="")
+    result_prefix = models.CharField(
+        max_length=RESULT_PREFIX_LENGTH, blank=True, default=""
+    )
+    date_done = models.DateTimeField(null=True)
+    completed = models.BooleanField(null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["date_done"]),
+            models.Index(fields=["status"]),
+            models.Index(fields=["completed"]),
+            # Lets LIKE 'prefix%' use the index whatever the collation.
+            models.Index(
+                fields=["result_prefix"],
+                name="pages_taskr_result_prefix_idx",
+                opclasses=["text_pattern_ops"],
+            ),
+        ]
+
+    def __str__(self):
+        return self.task_id
+
+    @classmethod
+    def from_task(cls, task):
+        text = result_text(task.get("result"))
+        return cls(
+            task_id=task["task_id"],
+            status=task.get("status") or "",
+            result=task.get("result"),
+            result_text=text,
+            result_prefix=text[:RESULT_PREFIX_LENGTH],
+            date_done=_parse_date(task.get("date_done")),
+            completed=task.get("completed"),
+        )
+
+    def as_task(self):
+        """Return the record in the same shape as tasks read from Redis."""
+        return {
+            "task_id": self.task_id,
+            "status": self.status,
+            "result": self.result,
+            "date_done": self.date_done and self.date_done.isoformat(),
+            "completed": self.completed,
+        }
+
+
+def result_text(result):
+    if result is None:
+        return ""
+    if isinstance(result, str):
+        return result
+
+    return json.dumps(result, separators=(",", ":"))
+
+
+def _parse_date(value):
+    try:
+        date = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+    # Celery's dates are in UTC, with or without saying so.
+    return date if date.tzinfo else date.replace(tzinfo=timezone.utc)
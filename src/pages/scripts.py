@@ -0,0 +1,224 @@
+# Lua scripts that keep the task indexes in pages.tasks up to date. Running
+# them inside Redis means a task and its index entries always change together
+# in a single round trip.
+#
+# Every script gets the index keys first, in the order of
+# pages.tasks.TASK_INDEX_KEYS, followed by its own keys.
+
+# Normalizing sort values happens in here and nowhere else so a task sorts the
+# same no matter which script (re)indexed it. status and result are sorted by
+# their text with the task id tacked on to keep members unique, which also
+# needs the last indexed text of each task so its old members can be removed.
+# The ids of the tasks with each status are also kept in a set of their own
+# for filtering by it, named after the status index and the status (see
+# pages.tasks.TASK_STATUS_KEY_PREFIX), so they're the one kind of key the
+# scripts work out for themselves.
+_INDEXING = """
+local INDEX, COMPLETED, TASK_ID, STATUS, RESULT, SORT_VALUES =
+  KEYS[1], KEYS[2], KEYS[3], KEYS[4], KEYS[5], KEYS[6]
+
+local function sort_value(value)
+  if value == nil or value == cjson.null then
+    return ""
+  elseif type(value) == "table" then
+    return cjson.encode(value)
+  end
+  return tostring(value)
+end
+
+local function status_key(status)
+  return STATUS .. ":" .. status
+end
+
+local function remove_text_members(task_id)
+  local values = redis.call("HGET", SORT_VALUES, task_id)
+  if values then
+    values = cjson.decode(values)
+    redis.call("ZREM", STATUS, values[1] .. "\\0" .. task_id)
+    redis.call("ZREM", RESULT, values[2] .. "\\0" .. task_id)
+    redis.call("SREM", status_key(values[1]), task_id)
+  end
+end
+
+local function index_task(task_id, task, done_at)
+  remove_text_members(task_id)
+
+  -- Same order as sorting the text "", "False" and "True"
+  local completed = 0
+  if task.completed == false then
+    completed = 1
+  elseif task.completed == true then
+    completed = 2
+  end
+
+  local status = sort_value(task.status)
+  local result = sort_value(task.result)
+
+  if done_at then
+    redis.call("ZADD", INDEX, done_at, task_id)
+  end
+  redis.call("ZADD", COMPLETED, completed, task_id)
+  redis.call("ZADD", TASK_ID, 0, task_id)
+  redis.call("ZADD", STATUS, 0, status .. "\\0" .. task_id)
+  redis.call("ZADD", RESULT, 0, result .. "\\0" .. task_id)
+  redis.call("SADD", status_key(status), task_id)
+  redis.call("HSET", SORT_VALUES, task_id, cjson.encode({status, result}))
+end
+
+-- Only JSON results can be read in here, msgpack ones have to be decoded by
+-- the caller.
+local function is_json(payload)
+  return string.sub(payload, 1, 1) == "{"
+end
+
+-- Lays the fields changed since a task finished (see
+-- pages.tasks.TASK_CHANGES_PREFIX) over it.
+local function apply_changes(task, changes_key)
+  local changes = redis.call("HGETALL", changes_key)
+  for i = 1, #changes, 2 do
+    task[changes[i]] = cjson.decode(changes[i + 1])
+  end
+  return task
+end
+
+local function unindex_task(task_id)
+  remove_text_members(task_id)
+  redis.call("ZREM", INDEX, task_id)
+  redis.call("ZREM", COMPLETED, task_id)
+  redis.call("ZREM", TASK_ID, task_id)
+  redis.call("HDEL", SORT_VALUES, task_id)
+end
+"""
+
+# KEYS[7] is the task's result key and KEYS[8] its changes. ARGV is the task
+# id, completion time and optionally the task's sort fields as JSON, for
+# results the script can't decode by itself. Without them such a result isn't
+# indexed and -1 is returned.
+INDEX_TASK = (
+    _INDEXING
+    + """
+local payload = redis.call("GET", KEYS[7])
+if not payload then
+  return 0
+end
+
+local task
+if ARGV[3] then
+  task = cjson.decode(ARGV[3])
+elseif is_json(payload) then
+  task = cjson.decode(payload)
+else
+  return -1
+end
+
+index_task(ARGV[1], apply_changes(task, KEYS[8]), ARGV[2])
+return 1
+"""
+)
+
+# ARGV is the ids of the tasks to drop from every index.
+UNINDEX_TASKS = (
+    _INDEXING
+    + """
+for _, task_id in ipairs(ARGV) do
+  unindex_task(task_id)
+end
+return #ARGV
+"""
+)
+
+# Records changes to tasks next to their results, reindexing the indexed ones
+# from what they were last indexed with, and queues them for archiving.
+# KEYS[7] is the task set version, KEYS[8] the archive queue and then come
+# the result key and changes key of every task. ARGV is the events channel,
+# the time, then for every task its id, "1" if it was found in the archive,
+# its event as JSON, how many fields changed and those fields, each followed
+# by its new value as JSON. Tasks that were found, in Redis or the archive,
+# bump the version and go out in a single event, and reindexed ones bump the
+# filters generation too (see pages.tasks.filter_task_ids). Returns whether
+# each one was found as 1 or 0.
+UPDATE_TASKS = (
+    _INDEXING
+    + """
+local VERSION, ARCHIVE = KEYS[7], KEYS[8]
+local channel, now = ARGV[1], ARGV[2]
+local SORT_FIELDS = {status = true, result = true, completed = true}
+
+local reindexed = false
+local function reindex(task_id, fields)
+  if not redis.call("ZSCORE", INDEX, task_id) then
+    return
+  end
+
+  local task = {}
+  local values = redis.call("HGET", SORT_VALUES, task_id)
+  if values then
+    values = cjson.decode(values)
+    task.status, task.result = values[1], values[2]
+  end
+  local completed = tonumber(redis.call("ZSCORE", COMPLETED, task_id))
+  if completed == 1 then
+    task.completed = false
+  elseif completed == 2 then
+    task.completed = true
+  end
+
+  local changed = false
+  for i = 1, #fields, 2 do
+    if SORT_FIELDS[fields[i]] then
+      task[fields[i]] = cjson.decode(fields[i + 1])
+      changed = true
+    end
+  end
+  if changed then
+    index_task(task_id, task, nil)
+    reindexed = true
+  end
+end
+
+local found, events = {}, {}
+local arg = 3
+for i = 1, (#KEYS - 8) / 2 do
+  local result_key, changes_key = KEYS[7 + 2 * i], KEYS[8 + 2 * i]
+  local task_id, archived, event = ARGV[arg], ARGV[arg + 1], ARGV[arg + 2]
+  local count = tonumber(ARGV[arg + 3])
+  local fields = {}
+  for j = arg + 4, arg + 3 + 2 * count do
+    table.insert(fields, ARGV[j])
+  end
+  arg = arg + 4 + 2 * count
+
+  -- -2 means there's no result, -1 that it never expires.
+  local ttl = redis.call("PTTL", result_key)
+  if ttl ~= -2 then
+    if count > 0 then
+      redis.call("HSET", changes_key, unpack(fields))
+      if ttl > 0 then
+        redis.call("PEXPIRE", changes_key, ttl)
+      end
+      reindex(task_id, fields)
+    end
+    redis.call("SADD", ARCHIVE, task_id)
+  end
+
+  found[i] = (ttl ~= -2 or archived == "1") and 1 or 0
+  if found[i] == 1 then
+    table.insert(events, event)
+  end
+end
+
+if reindexed then
+  redis.call("HINCRBY", VERSION, "filters", 1)
+end
+if #events > 0 then
+  redis.call("HINCRBY", VERSION, "version", 1)
+  redis.call("HSET", VERSION, "modified", now)
+  redis.call(
+    "PUBLISH",
+    channel,
+    '{"type": "updated", "tasks": [' .. table.concat(events, ", ") .. "]}"
+  )
+end
+return found
+"""
+)
@@ -0,0 +1,207 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from redis import Redis
+from redis.exceptions import RedisError
+
+from config.metrics import TASK_CACHE_INVALIDATIONS, TASK_CACHE_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+# Redis publishes the keys it invalidates on this channel for connections
+# that redirect their key tracking to a subscriber, see
+# https://redis.io/docs/latest/develop/reference/client-side-caching/
+INVALIDATE_CHANNEL = "__redis__:invalidate"
+
+
+class TaskCache:
+    """
+    Keeps up to max_size decoded tasks by id in memory, evicting the least
+    recently used ones. Redis tells a background thread whenever a key of a
+    task under any of key_prefixes changes, expires or gets deleted (by
+    anyone, Celery included) and the task is dropped right away.
+
+    Nothing is cached unless that thread is subscribed, since a change could
+    go unnoticed otherwise. When the subscription is lost everything cached
+    is thrown out and tasks are read from Redis until it's back.
+    """
+
+    def __init__(self, max_size, key_prefixes):
+        self.max_size = max_size
+        self.key_prefixes = tuple(key_prefixes)
+        self.tasks = OrderedDict()
+        self.lock = threading.Lock()
+        # Goes up with every invalidation so tasks read from Redis while one
+        # came in don't get cached, as they might be older than it.
+        self.generation = 0
+        self.listening = False
+        self.listener = None
+
+    def get_many(self, task_ids):
+        """
+        Return the cached tasks of task_ids by id, along with the generation
+        to pass to set_many() along with the ones read from Redis.
+        """
+        if not self.max_size:
+            return {}, None
+
+        if self.listener is None:
+            self._start()
+
+        found = {}
+        with self.lock:
+            generation = self.generation
+            if self.listening:
+                for task_id in task_ids:
+                    task = self.tasks.get(task_id)
+                    if task is not None:
+                        self.tasks.move_to_end(task_id)
+                        # Callers get a copy of their own to change.
+                        found[task_id] = dict(task)
+
+        TASK_CACHE_LOOKUPS.labels("hit").inc(len(found))
+        TASK_CACHE_LOOKUPS.labels("miss").inc(len(task_ids) - len(found))
+        return found, generation
+
+    def set_many(self, tasks, generation):
+        """Cache tasks by id unless anything got invalidated since get_many."""
+        with self.lock:
+            if not self.listening or generation != self.generation:
+                return
+
+            for task_id, task in tasks.items():
+                self.tasks[task_id] = dict(task)
+                self.tasks.move_to_end(task_id)
+
+            while len(self.tasks) > self.max_size:
+                self.tasks.popitem(last=False)
+
+    def invalidate(self, keys):
+        """Drop the tasks of keys, or every task if keys is None."""
+        with self.lock:
+            self.generation += 1
+            if keys is None:
+                self.tasks.clear()
+                return
+
+            for key in keys:
+                if isinstance(key, bytes):
+                    key = key.decode()
+                for key_prefix in self.key_prefixes:
+                    if key.startswith(key_prefix):
+                        self.tasks.pop(key.removeprefix(key_prefix), None)
+
+        TASK_CACHE_INVALIDATIONS.inc(len(keys))
+
+    def stats(self):
+        with self.lock:
+            return {
+                "size": len(self.tasks),
+                "max_size": self.max_size,
+                "listening": self.listening,
+            }
+
+    def _start(self):
+        with self.lock:
+            if self.listener is None:
+                self.listener = threading.Thread(
+                    target=self._listen, name="task-cache", daemon=True
+                )
+                self.listener.start()
+
+    def _listen(self):
+        delay = 1
+        while True:
+            client = None
+            try:
+                client = self._connect()
+                self._subscribe(client)
+                delay = 1
+                self._receive(client.connection)
+            except (RedisError, OSError) as e:
+                logger.warning(
+                    "Task cache lost its Redis subscription, retrying in "
+                    "%ss: %s",
+                    delay,
+                    e,
+                )
+            finally:
+                self._stop_listening()
+                if client is not None:
+                    client.close()
+
+            time.sleep(delay)
+            delay = min(delay * 2, 30)
+
+    def _connect(self):
+        return Redis.from_url(
+            settings.REDIS_URL,
+            single_connection_client=True,
+            socket_connect_timeout=settings.REDIS_SOCKET_CONNECT_TIMEOUT,
+            socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+        )
+
+    def _subscribe(self, client):
+        # Invalidations get pushed to this same connection, which is all RESP2
+        # allows for since it has to be subscribed to receive them. Tracking
+        # by prefix (BCAST) covers every key of a task, read by us or not.
+        client_id = client.client_id()
+        client.client_tracking_on(
+            clientid=client_id, prefix=list(self.key_prefixes), bcast=True
+        )
+
+        connection = client.connection
+        connection.send_command("SUBSCRIBE", INVALIDATE_CHANNEL)
+        connection.read_response()
+
+        with self.lock:
+            self.listening = True
+
+    def _receive(self, connection):
+        while True:
+            if connection.can_read(
+                timeout=settings.REDIS_HEALTH_CHECK_INTERVAL
+            ):
+                self._handle(connection.read_response())
+            else:
+                # Finds out about a dead connection, the reply is ignored.
+                connection.send_command("PING")
+
+    def _handle(self, message):
+        kind, channel, data = message[0], message[1], message[-1]
+        if kind == b"message" and channel == INVALIDATE_CHANNEL.encode():
+            # No keys means the whole database was flushed.
+            self.invalidate(data)
+
+    def _stop_listening(self):
+        with self.lock:
+            self.listening = False
+            self.generation += 1
+            self.tasks.clear()
+
+
+task_cache = None
+
+
+def get_task_cache(key_prefixes):
+    global task_cache
+
+    if task_cache is None:
+        task_cache = TaskCache(settings.TASK_CACHE_SIZE, key_prefixes)
+
+    return task_cache
+
+
+def _forget_task_cache():
+    global task_cache
+
+    # The listener thread doesn't survive a fork, and neither should what it
+    # was keeping fresh.
+    task_cache = None
+
+
+os.register_at_fork(after_in_child=_forget_task_cache)
@@ -1,8 +1,96 @@
+import hashlib
+import heapq
 import json
-from datetime import datetime
+import logging
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone
 
-import redis
-from celery import shared_task
+from asgiref.sync import sync_to_async
+from celery import shared_task, states
+from celery.signals import task_postrun
+from django.db import DatabaseError, transaction
+from django.db.models import F
+from redis import asyncio as aioredis
+
+from config.metrics import TASKS_TRIMMED
+from config.redis import get_async_redis, get_redis
+from config.serializers import decode_result, result_format
+from pages import scripts
+from pages.models import RESULT_PREFIX_LENGTH, TaskRecord, result_text
+from pages.task_cache import get_task_cache
+
+logger = logging.getLogger(__name__)
+
+TASK_KEY_PREFIX = "celery-task-meta-"
+
+# Hash of the fields of a task changed by update_tasks_in_db, each with its
+# new value as JSON. Changes sit next to the result rather than in it, so
+# making one never means reading, decoding and writing back the whole result,
+# and whatever reads a result lays them over it. They expire along with it.
+TASK_CHANGES_PREFIX = "celery-task-changes-"
+
+# Every key of a task, which the task cache watches.
+TASK_KEY_PREFIXES = (TASK_KEY_PREFIX, TASK_CHANGES_PREFIX)
+
+# Sorted set of task ids scored by their completion time. It's kept up to date
+# by the task_postrun signal below so the task list never has to scan Redis.
+TASK_INDEX_KEY = "celery-task-index"
+
+# Every field the task list can be sorted by has its own sorted set, filled in
+# as tasks get indexed, so any page in any order is a single range read.
+SORT_INDEX_KEYS = {
+    "date_done": TASK_INDEX_KEY,
+    "completed": f"{TASK_INDEX_KEY}:completed",
+    "task_id": f"{TASK_INDEX_KEY}:task_id",
+    "status": f"{TASK_INDEX_KEY}:status",
+    "result": f"{TASK_INDEX_KEY}:result",
+}
+
+# The status and result each task was last indexed with.
+SORT_VALUES_KEY = f"{TASK_INDEX_KEY}:values"
+
+# Sets of the ids of the indexed tasks with each status, named after it.
+TASK_STATUS_KEY_PREFIX = f"{SORT_INDEX_KEYS['status']}:"
+
+# The keys every script in pages.scripts expects first, in this order.
+TASK_INDEX_KEYS = [*SORT_INDEX_KEYS.values(), SORT_VALUES_KEY]
+
+# Hash with a counter that goes up whenever the set of tasks or any task in it
+# changes, along with the time of that change. A second counter, filters,
+# only goes up when indexed tasks change, see filter_task_ids().
+TASK_VERSION_KEY = "celery-task-version"
+
+# Set of ids of tasks that finished or changed since they were last copied to
+# the TaskRecord table by archive_tasks.
+TASK_ARCHIVE_KEY = "celery-task-archive"
+
+# Set of ids of tasks that couldn't be archived even on their own, so
+# archive_tasks gave up on them rather than trying them forever. SMOVE them
+# back to TASK_ARCHIVE_KEY to try again before trim_tasks gets to them, as
+# it doesn't wait for these.
+TASK_ARCHIVE_FAILED_KEY = f"{TASK_ARCHIVE_KEY}:failed"
+
+# Pub/sub channel that gets a JSON event whenever a task finishes or changes,
+# for the live task list, see pages.events.
+TASK_EVENTS_CHANNEL = "celery-task-events"
+
+# Sorted sets of the tasks that match some filters, in the order of a sort
+# index, kept this many seconds so the pages after the first are a range
+# read, see filter_task_ids(). They're built this many tasks at a time.
+TASK_FILTER_KEY = f"{TASK_INDEX_KEY}:filter"
+TASK_FILTER_TIMEOUT = 60
+TASK_FILTER_CHUNK_SIZE = 1000
+
+# The fields of a task that can be changed once it's been archived.
+ARCHIVED_FIELDS = {"status", "result", "completed"}
+
+# The task list can be narrowed down to tasks with a status, completed or not,
+# done from (inclusive) or until (exclusive) a datetime, or with a result
+# starting with some text. Each one is read from an index, see
+# filter_task_ids() and _task_records().
+TASK_FILTERS = ("status", "completed", "date_from", "date_to", "prefix")
 
 
 @shared_task
@@ -13,21 +101,410 @@ def add_name_to_queue(name):
     return f"{name}"
 
 
+@shared_task(bind=True, ignore_result=True)
+def add_names_to_queue(self, names):
+    """
+    Handle a whole batch of names in a single task, see pages.batching. Each
+    name gets a result of its own, as if add_name_to_queue had run for it,
+    so the task list has a row for every name. Returns their task ids.
+    """
+    backend = self.backend
+    done_at = time.time()
+    date_done = datetime.fromtimestamp(done_at, tz=timezone.utc).isoformat()
+
+    pipe = get_redis().pipeline(transaction=False)
+    task_ids = []
+    for name in names:
+        task_id = str(uuid.uuid4())
+        # The same fields Celery stores for a result of its own.
+        task = {
+            "status": states.SUCCESS,
+            "result": add_name_to_queue(name),
+            "traceback": None,
+            "children": [],
+            "date_done": date_done,
+            "task_id": task_id,
+        }
+        pipe.set(
+            backend.get_key_for_task(task_id),
+            backend.encode(task),
+            ex=backend.expires,
+        )
+        _index_finished_task(pipe, task_id, done_at, task)
+        task_ids.append(task_id)
+
+    bump_task_set_version(pipe)
+    pipe.execute()
+    return task_ids
+
+
+# The tasks whose results make up the task list. Everything else, such as
+# the batches of names (whose names are listed instead) and the housekeeping
+# tasks run by beat, is left out of it.
+LISTED_TASKS = {add_name_to_queue.name}
+
+
+@task_postrun.connect
+def index_finished_task(
+    sender=None, task_id=None, retval=None, state=None, **kwargs
+):
+    if sender is None or sender.name not in LISTED_TASKS:
+        return
+
+    r = get_redis()
+    done_at = time.time()
+
+    pipe = r.pipeline(transaction=False)
+    _index_finished_task(
+        pipe,
+        task_id,
+        done_at,
+        {
+            "status": state,
+            "result": retval,
+            "date_done": datetime.fromtimestamp(
+                done_at, tz=timezone.utc
+            ).isoformat(),
+        },
+        decoded=False,
+    )
+    bump_task_set_version(pipe)
+    if pipe.execute()[0] != -1:
+        return
+
+    # The script can't read msgpack results, so this one gets decoded here.
+    payload = r.get(f"{TASK_KEY_PREFIX}{task_id}")
+    if payload is not None:
+        pipe = r.pipeline(transaction=False)
+        index_task(pipe, task_id, done_at, decode_result(payload))
+        bump_task_set_version(pipe)
+        pipe.execute()
+
+
+def _index_finished_task(pipe, task_id, done_at, task, decoded=True):
+    """
+    Index a task that just finished, queue it for archiving and tell the
+    live task list about it. Unless decoded, the script reads the task
+    itself and only the fields for the event are needed.
+    """
+    index_task(pipe, task_id, done_at, task if decoded else None)
+    pipe.sadd(TASK_ARCHIVE_KEY, task_id)
+    publish_task_event(
+        pipe,
+        "finished",
+        task={
+            "task_id": task_id,
+            "status": task["status"],
+            "result": task["result"],
+            "date_done": task["date_done"],
+            "completed": None,
+        },
+    )
+
+
+def index_task(r, task_id, done_at, task=None):
+    """
+    Add a task to the index. Results the script can't decode by itself need
+    their decoded task passed in, otherwise the script returns -1.
+    """
+    args = [task_id, done_at]
+    if task is not None:
+        args.append(_sort_fields(task))
+
+    index = r.register_script(scripts.INDEX_TASK)
+    return index(
+        keys=[
+            *TASK_INDEX_KEYS,
+            f"{TASK_KEY_PREFIX}{task_id}",
+            f"{TASK_CHANGES_PREFIX}{task_id}",
+        ],
+        args=args,
+        client=r,
+    )
+
+
+def _sort_fields(task):
+    return json.dumps(
+        {
+            field: task.get(field)
+            for field in ("status", "result", "completed")
+        },
+        default=str,
+    )
+
+
+@shared_task(ignore_result=True)
+def archive_tasks(batch_size=1000):
+    """
+    Copy the tasks that finished or changed since the last run from Redis to
+    the TaskRecord table, up to batch_size of them per query. A batch the
+    database turns down is split up until the tasks it won't take on their
+    own are found, which are logged and set aside in TASK_ARCHIVE_FAILED_KEY.
+    """
+    r = get_redis()
+    archived = 0
+
+    while task_ids := r.spop(TASK_ARCHIVE_KEY, batch_size):
+        task_ids = [task_id.decode() for task_id in task_ids]
+        try:
+            results = _mget_tasks(r, task_ids, batch_size).execute()
+            payloads, changes = _split_fetched(task_ids, results)
+            records = _task_records_to_archive(r, task_ids, payloads, changes)
+            archived += _archive_records(r, records)
+        except Exception:
+            # They'll be picked up again by the next run.
+            r.sadd(TASK_ARCHIVE_KEY, *task_ids)
+            raise
+
+    if archived:
+        bump_task_set_version(r)
+
+    return archived
+
+
+def _task_records_to_archive(r, task_ids, payloads, changes):
+    records = []
+    for task_id, payload, task_changes in zip(task_ids, payloads, changes):
+        if payload is None:
+            continue
+
+        try:
+            task = _apply_changes(decode_result(payload), task_changes)
+            records.append(TaskRecord.from_task(task))
+        except Exception:
+            logger.exception("Couldn't read task %s to archive it", task_id)
+            r.sadd(TASK_ARCHIVE_FAILED_KEY, task_id)
+
+    return records
+
+
+def _archive_records(r, records):
+    """Save records, returning how many of them were."""
+    try:
+        TaskRecord.objects.bulk_create(
+            records,
+            update_conflicts=True,
+            unique_fields=["task_id"],
+            update_fields=[
+                "status",
+                "result",
+                "result_text",
+                "result_prefix",
+                "date_done",
+                "completed",
+            ],
+        )
+    except DatabaseError:
+        # Splitting the batch up is no use when the database is down.
+        if not _database_is_up():
+            raise
+
+        if len(records) == 1:
+            logger.exception("Couldn't archive task %s", records[0].task_id)
+            r.sadd(TASK_ARCHIVE_FAILED_KEY, records[0].task_id)
+            return 0
+
+        half = len(records) // 2
+        return _archive_records(r, records[:half]) + _archive_records(
+            r, records[half:]
+        )
+
+    return len(records)
+
+
+def _database_is_up():
+    try:
+        TaskRecord.objects.exists()
+    except DatabaseError:
+        return False
+
+    return True
+
+
+@shared_task(ignore_result=True)
+def trim_tasks(max_age=None, max_count=None, batch_size=1000):
+    """
+    Delete the oldest tasks from Redis along with their index entries,
+    batch_size at a time so Redis never blocks on one big command. The index
+    entries of expired results go first, then any task done more than
+    max_age seconds ago and then the oldest ones over max_count. Tasks that
+    haven't been archived yet are left for the next run.
+
+    Returns how many tasks were trimmed for each of those reasons, and how
+    many bytes of results that freed.
+    """
+    r = get_redis()
+    trimmed = {"expired": 0, "max_age": 0, "max_count": 0, "bytes": 0}
+    _unindex_expired_tasks(r, trimmed, batch_size)
+
+    # Skipped tasks stay at the start of the index, so the reads move past
+    # them. They still count towards max_count, which newer tasks make up
+    # for by going instead.
+    skipped = 0
+    if max_age:
+        cutoff = time.time() - max_age
+        while task_ids := r.zrangebyscore(
+            TASK_INDEX_KEY, "-inf", f"({cutoff}", start=skipped, num=batch_size
+        ):
+            skipped += _trim_tasks(r, task_ids, trimmed, "max_age")
+
+    if max_count:
+        while (excess := r.zcard(TASK_INDEX_KEY) - max_count) > 0 and (
+            task_ids := r.zrange(
+                TASK_INDEX_KEY, skipped, skipped + min(excess, batch_size) - 1
+            )
+        ):
+            skipped += _trim_tasks(r, task_ids, trimmed, "max_count")
+
+    if trimmed["expired"] or trimmed["max_age"] or trimmed["max_count"]:
+        bump_task_set_version(r)
+
+    return trimmed
+
+
+@shared_task(ignore_result=True)
+def unindex_expired_tasks(batch_size=1000):
+    """
+    Drop the index entries of results that expired since the last run, and
+    bump the task set version if there were any so cached pages and ETags of
+    the task list stop showing them. Returns how many there were.
+    """
+    r = get_redis()
+    trimmed = {"expired": 0}
+    _unindex_expired_tasks(r, trimmed, batch_size)
+
+    if trimmed["expired"]:
+        bump_task_set_version(r)
+
+    return trimmed["expired"]
+
+
+def _unindex_expired_tasks(r, trimmed, batch_size):
+    # Celery gives every result the same expiry time, so expired ones are
+    # always the oldest in the index. Most runs find none, which the oldest
+    # one on its own tells.
+    oldest = r.zrange(TASK_INDEX_KEY, 0, 0)
+    if not oldest or r.exists(f"{TASK_KEY_PREFIX}{oldest[0].decode()}"):
+        return
+
+    while task_ids := r.zrange(TASK_INDEX_KEY, 0, batch_size - 1):
+        task_ids = [task_id.decode() for task_id in task_ids]
+        pipe = r.pipeline(transaction=False)
+        for task_id in task_ids:
+            pipe.exists(f"{TASK_KEY_PREFIX}{task_id}")
+        expired = [
+            task_id
+            for task_id, exists in zip(task_ids, pipe.execute())
+            if not exists
+        ]
+
+        _delete_tasks(r, expired, trimmed, "expired")
+        if len(expired) < len(task_ids):
+            break
+
+
+def _trim_tasks(r, task_ids, trimmed, reason):
+    """Delete the tasks that were archived, returning how many weren't."""
+    task_ids = [task_id.decode() for task_id in task_ids]
+
+    pipe = r.pipeline(transaction=False)
+    pipe.smismember(TASK_ARCHIVE_KEY, task_ids)
+    for task_id in task_ids:
+        pipe.strlen(f"{TASK_KEY_PREFIX}{task_id}")
+    unarchived, *sizes = pipe.execute()
+
+    archived = [
+        task_id
+        for task_id, waiting in zip(task_ids, unarchived)
+        if not waiting
+    ]
+    trimmed["bytes"] += sum(
+        size for size, waiting in zip(sizes, unarchived) if not waiting
+    )
+    _delete_tasks(r, archived, trimmed, reason)
+
+    return len(task_ids) - len(archived)
+
+
+def _delete_tasks(r, task_ids, trimmed, reason):
+    if not task_ids:
+        return
+
+    unindex = r.register_script(scripts.UNINDEX_TASKS)
+    pipe = r.pipeline(transaction=False)
+    unindex(keys=TASK_INDEX_KEYS, args=task_ids, client=pipe)
+    # UNLINK frees the memory in the background rather than in the command.
+    pipe.unlink(
+        *(f"{TASK_KEY_PREFIX}{task_id}" for task_id in task_ids),
+        *(f"{TASK_CHANGES_PREFIX}{task_id}" for task_id in task_ids),
+    )
+    pipe.srem(TASK_ARCHIVE_FAILED_KEY, *task_ids)
+    pipe.execute()
+
+    trimmed[reason] += len(task_ids)
+    TASKS_TRIMMED.labels(reason).inc(len(task_ids))
+
+
+def publish_task_event(r, event_type, **data):
+    r.publish(
+        TASK_EVENTS_CHANNEL,
+        json.dumps({"type": event_type, **data}, default=str),
+    )
+
+
+def bump_task_set_version(r):
+    r.hincrby(TASK_VERSION_KEY, "version", 1)
+    r.hset(TASK_VERSION_KEY, "modified", time.time())
+
+
+def get_task_set_version(settings):
+    """Return the task set's version and when it last changed, if ever."""
+    version, modified = get_redis().hmget(
+        TASK_VERSION_KEY, "version", "modified"
+    )
+    return _parse_task_set_version(version, modified)
+
+
+async def aget_task_set_version(settings):
+    version, modified = await get_async_redis().hmget(
+        TASK_VERSION_KEY, "version", "modified"
+    )
+    return _parse_task_set_version(version, modified)
+
+
+def _parse_task_set_version(version, modified):
+    if version is None:
+        return 0, None
+
+    return int(version), float(modified)
+
+
 def read_tasks_from_db(
-    settings, sort_by="date_done", sort_order="desc", tasks=None
+    settings,
+    sort_by="date_done",
+    sort_order="desc",
+    tasks=None,
+    page_size=None,
+    cursor=None,
+    chunk_size=None,
+    filters=None,
 ):
+    reverse = sort_order == "desc"
+    # The cursor is the offset of the first task on the page.
+    offset = int(cursor or 0)
+
     if tasks is None:
-        r = redis.from_url(settings.REDIS_URL)
-        task_keys = r.keys("celery-task-meta-*")
-        tasks = []
-        for key in task_keys:
-            task_data = r.get(key)
-            if task_data:
-                tasks.append(json.loads(task_data))
+        # The index is already in order so only the tasks on the requested
+        # page need to be fetched.
+        r = get_redis()
+        members = _page_members(
+            r, sort_by, sort_order, offset, page_size, filters
+        )
+        return _fetch_tasks(
+            r, members, chunk_size or settings.TASKS_FETCH_CHUNK_SIZE
+        )
 
     # Sorting logic
-    reverse = sort_order == "desc"
-
     def sort_key(task):
         value = task.get(sort_by)
 
@@ -52,16 +529,852 @@ def read_tasks_from_db(
         # For other columns, we can return the value as is
         return value
 
-    tasks.sort(key=sort_key, reverse=reverse)
+    if page_size is None:
+        return sorted(tasks, key=sort_key, reverse=reverse)[offset:]
+
+    # Only the tasks up to the end of the page have to be put in order, which
+    # a heap does in O(n log k) rather than sorting the whole list.
+    select = heapq.nlargest if reverse else heapq.nsmallest
+    return select(offset + page_size, tasks, key=sort_key)[offset:]
+
+
+async def aread_tasks_from_db(
+    settings,
+    sort_by="date_done",
+    sort_order="desc",
+    page_size=None,
+    cursor=None,
+    chunk_size=None,
+    filters=None,
+):
+    """Read a page of indexed tasks without blocking the event loop."""
+    offset = int(cursor or 0)
+
+    r = get_async_redis()
+    members = await _page_members(
+        r, sort_by, sort_order, offset, page_size, filters
+    )
+    return await _afetch_tasks(
+        r, members, chunk_size or settings.TASKS_FETCH_CHUNK_SIZE
+    )
+
+
+def _page_members(r, sort_by, sort_order, offset, page_size, filters):
+    if filters:
+        count = -1 if page_size is None else page_size
+        return filter_task_ids(r, filters, sort_by, sort_order, offset, count)
+
+    return r.zrange(
+        SORT_INDEX_KEYS[sort_by],
+        offset,
+        _page_stop(offset, page_size),
+        desc=sort_order == "desc",
+    )
+
+
+def _page_stop(offset, page_size):
+    return -1 if page_size is None else offset + page_size - 1
+
+
+def filter_task_ids(
+    r, filters, sort_by="date_done", sort_order="desc", offset=0, count=-1
+):
+    """
+    Return the ids of the indexed tasks that match filters (see TASK_FILTERS)
+    in order, skipping offset of them and returning up to count, or all of
+    them if it's negative. Tasks are filtered by their completion time like
+    they're sorted by it, which is the time they were indexed at.
+
+    The matches are worked out once per sort field and filters, a chunk at a
+    time so Redis never blocks on it, and kept for TASK_FILTER_TIMEOUT
+    seconds. Tasks indexed since get added to them as they're read, and
+    changes to tasks have them worked out again.
+
+    With an asyncio client this returns an awaitable.
+    """
+    steps = _filter_steps(filters, sort_by, sort_order, offset, count)
+    if isinstance(r, aioredis.Redis):
+        return _arun_steps(r, steps)
+
+    return _run_steps(r, steps)
+
+
+def _run_steps(r, steps):
+    """
+    Send a generator the replies to the commands it yields, pipelined, until
+    it returns.
+    """
+    replies = None
+    while True:
+        try:
+            commands = steps.send(replies)
+        except StopIteration as stop:
+            return stop.value
+
+        pipe = r.pipeline(transaction=False)
+        for command in commands:
+            pipe.execute_command(*command)
+        replies = pipe.execute()
+
+
+async def _arun_steps(r, steps):
+    replies = None
+    while True:
+        try:
+            commands = steps.send(replies)
+        except StopIteration as stop:
+            return stop.value
+
+        pipe = r.pipeline(transaction=False)
+        for command in commands:
+            pipe.execute_command(*command)
+        replies = await pipe.execute()
+
+
+def _filter_steps(filters, sort_by, sort_order, offset, count):
+    if count == 0:
+        return []
+
+    args = {
+        field: filters[field] for field in TASK_FILTERS if field in filters
+    }
+    for field in ("date_from", "date_to"):
+        if field in args:
+            args[field] = args[field].timestamp()
+
+    digest = hashlib.sha1(
+        json.dumps(args, sort_keys=True).encode()
+    ).hexdigest()
+    matches_key = f"{TASK_FILTER_KEY}:{sort_by}:{digest}"
+    built_key = f"{matches_key}:built"
+
+    def page(key):
+        stop = _page_stop(offset, None if count < 0 else count)
+        command = ["ZRANGE", key, offset, stop]
+        if sort_order == "desc":
+            command.append("REV")
+        return command
+
+    generation, built, newest, members = yield [
+        ("HGET", TASK_VERSION_KEY, "filters"),
+        ("GET", built_key),
+        ("ZRANGE", TASK_INDEX_KEY, -1, -1, "WITHSCORES"),
+        page(matches_key),
+    ]
+    # The matches are good for as long as no indexed task changed, and only
+    # miss the tasks indexed since, which are done at or after the newest
+    # one they were built with.
+    built = built.decode().split(":") if built else None
+    generation = int(generation or 0)
+    newest = float(newest[1]) if newest else 0
+    marker = f"{generation}:{newest!r}"
 
-    return tasks
+    scratch = f"{matches_key}:{uuid.uuid4().hex}"
+    if built is None or int(built[0]) != generation:
+        key, size = yield from _match_steps(args, sort_by, scratch)
+        members, *_ = yield [
+            page(key),
+            ("RENAME", key, matches_key) if size else ("DEL", matches_key),
+            # Outlives the marker, so it's never gone while that's there.
+            ("EXPIRE", matches_key, TASK_FILTER_TIMEOUT + 1),
+            ("SET", built_key, marker, "EX", TASK_FILTER_TIMEOUT),
+        ]
+    elif float(built[1]) < newest:
+        since = float(built[1])
+        key, size = yield from _match_steps(args, sort_by, scratch, since)
+        commands = []
+        if size:
+            # Tasks that are in both score the same in both, which adding
+            # them up would double.
+            commands = [
+                (
+                    "ZUNIONSTORE",
+                    matches_key,
+                    2,
+                    matches_key,
+                    key,
+                    "AGGREGATE",
+                    "MAX",
+                ),
+                ("EXPIRE", matches_key, TASK_FILTER_TIMEOUT + 1),
+                ("DEL", key),
+            ]
+        *_, members, _ = yield [
+            *commands,
+            page(matches_key),
+            ("SET", built_key, marker, "KEEPTTL"),
+        ]
+
+    return [member.rpartition(b"\0")[2] for member in members]
+
+
+def _match_steps(filters, sort_by, scratch, since=None):
+    """
+    Store the ids of the indexed tasks that match filters, done at or after
+    since if it's given, in a sorted set that sorts like the sort index.
+    Returns its key, which starts with scratch, and how many there are.
+    """
+    # Every filter that reads a score index gets its matches copied to a key
+    # of its own (statuses have a set of their own to begin with), and all
+    # of them are intersected with the sort index for their scores.
+    keys, commands = [], []
+    if "completed" in filters:
+        score = 2 if filters["completed"] else 1
+        keys.append(f"{scratch}:completed")
+        commands.append(
+            (
+                "ZRANGESTORE",
+                keys[-1],
+                SORT_INDEX_KEYS["completed"],
+                score,
+                score,
+                "BYSCORE",
+            )
+        )
+
+    starts = [
+        start
+        for start in (filters.get("date_from"), since)
+        if start is not None
+    ]
+    if starts or "date_to" in filters:
+        keys.append(f"{scratch}:date")
+        commands.append(
+            (
+                "ZRANGESTORE",
+                keys[-1],
+                TASK_INDEX_KEY,
+                repr(max(starts)) if starts else "-inf",
+                f"({filters['date_to']!r}" if "date_to" in filters else "+inf",
+                "BYSCORE",
+            )
+        )
+    temporary = list(keys)
+
+    if "status" in filters:
+        keys.append(f"{TASK_STATUS_KEY_PREFIX}{filters['status']}")
+
+    # Text is sorted by further down, where the matches are left in order of
+    # their task id until then.
+    sorts_by_text = sort_by in ("status", "result")
+    sort_index = SORT_INDEX_KEYS["task_id" if sorts_by_text else sort_by]
+    prefix = filters.get("prefix")
+
+    size = prefixed = 0
+    if keys:
+        counts = []
+        if prefix is not None:
+            counts.append(
+                (
+                    "ZLEXCOUNT",
+                    SORT_INDEX_KEYS["result"],
+                    *_prefix_range(prefix),
+                )
+            )
+        cleanup = [("DEL", *temporary)] if temporary else []
+
+        replies = yield [
+            *commands,
+            ("ZINTERSTORE", scratch, len(keys) + 1, sort_index, *keys)
+            + ("WEIGHTS", 1, *[0] * len(keys)),
+            ("EXPIRE", scratch, TASK_FILTER_TIMEOUT),
+            *counts,
+            *cleanup,
+        ]
+        size = replies[len(commands)]
+        if counts:
+            prefixed = replies[len(commands) + 2]
+
+    if prefix is not None:
+        # Whichever is fewer, the matches so far or the tasks with a result
+        # that starts with prefix, get gone through.
+        if keys and size <= prefixed:
+            size = yield from _drop_unprefixed_steps(scratch, prefix)
+        else:
+            prefix_key = f"{scratch}:prefix"
+            yield from _prefixed_steps(prefix_key, prefix)
+            size, _, _ = yield [
+                (
+                    "ZINTERSTORE",
+                    scratch,
+                    2,
+                    scratch if keys else sort_index,
+                    prefix_key,
+                    "WEIGHTS",
+                    1,
+                    0,
+                ),
+                ("EXPIRE", scratch, TASK_FILTER_TIMEOUT),
+                ("DEL", prefix_key),
+            ]
+
+    if not sorts_by_text or not size:
+        return scratch, size
+
+    sorted_key = f"{scratch}:sorted"
+    size = yield from _sort_by_text_steps(
+        scratch, sorted_key, 0 if sort_by == "status" else 1
+    )
+    yield [("DEL", scratch)]
+    return sorted_key, size
+
+
+def _prefix_range(prefix):
+    # The range of members of the result index whose text starts with prefix.
+    prefix = prefix.encode()
+    return b"[" + prefix, b"[" + prefix + b"\xff"
+
+
+def _prefixed_steps(key, prefix):
+    """Store the ids of the tasks with a result starting with prefix."""
+    start, end = _prefix_range(prefix)
+    commands = []
+    while True:
+        *_, members = yield [
+            *commands,
+            (
+                "ZRANGE",
+                SORT_INDEX_KEYS["result"],
+                start,
+                end,
+                "BYLEX",
+                "LIMIT",
+                0,
+                TASK_FILTER_CHUNK_SIZE,
+            ),
+        ]
+        if not members:
+            return
+
+        commands = [
+            (
+                "ZADD",
+                key,
+                *_zadd_args(member.rpartition(b"\0")[2] for member in members),
+            ),
+            ("EXPIRE", key, TASK_FILTER_TIMEOUT),
+        ]
+        start = b"(" + members[-1]
+
+
+def _drop_unprefixed_steps(key, prefix):
+    """
+    Remove the tasks without a result starting with prefix from key,
+    returning how many are left.
+    """
+    kept, commands = 0, []
+    while True:
+        *_, task_ids = yield [
+            *commands,
+            ("ZRANGE", key, kept, kept + TASK_FILTER_CHUNK_SIZE - 1),
+        ]
+        if not task_ids:
+            return kept
+
+        (values,) = yield [("HMGET", SORT_VALUES_KEY, *task_ids)]
+        dropped = [
+            task_id
+            for task_id, value in zip(task_ids, values)
+            if value is None or not json.loads(value)[1].startswith(prefix)
+        ]
+        commands = [("ZREM", key, *dropped)] if dropped else []
+        kept += len(task_ids) - len(dropped)
+
+
+def _sort_by_text_steps(key, sorted_key, position):
+    """
+    Copy the tasks in key to sorted_key as members like those of the status
+    (position 0) or result (1) index, returning how many there are.
+    """
+    start, size, commands = 0, 0, []
+    while True:
+        *_, task_ids = yield [
+            *commands,
+            ("ZRANGE", key, start, start + TASK_FILTER_CHUNK_SIZE - 1),
+        ]
+        if not task_ids:
+            return size
+
+        (values,) = yield [("HMGET", SORT_VALUES_KEY, *task_ids)]
+        members = [
+            json.loads(value)[position].encode() + b"\0" + task_id
+            for task_id, value in zip(task_ids, values)
+            if value is not None
+        ]
+        commands = []
+        if members:
+            commands = [
+                ("ZADD", sorted_key, *_zadd_args(members)),
+                ("EXPIRE", sorted_key, TASK_FILTER_TIMEOUT),
+            ]
+        start += len(task_ids)
+        size += len(members)
+
+
+def _zadd_args(members):
+    # Every member scores 0, which leaves them sorted by their text.
+    return [arg for member in members for arg in (0, member)]
+
+
+def read_tasks_from_archive(
+    settings,
+    sort_by="date_done",
+    sort_order="desc",
+    page_size=None,
+    cursor=None,
+    filters=None,
+):
+    """Read a page of archived tasks, sorted and paged by the database."""
+    return [
+        record.as_task()
+        for record in _task_records(
+            sort_by, sort_order, page_size, cursor, filters
+        )
+    ]
+
+
+async def aread_tasks_from_archive(
+    settings,
+    sort_by="date_done",
+    sort_order="desc",
+    page_size=None,
+    cursor=None,
+    filters=None,
+):
+    return [
+        record.as_task()
+        async for record in _task_records(
+            sort_by, sort_order, page_size, cursor, filters
+        )
+    ]
+
+
+async def aiter_tasks_from_archive(
+    settings,
+    chunk_size=None,
+    sort_by="date_done",
+    sort_order="asc",
+    filters=None,
+):
+    records = _task_records(sort_by, sort_order, filters=filters).aiterator(
+        chunk_size=chunk_size or settings.TASKS_FETCH_CHUNK_SIZE
+    )
+    async for record in records:
+        yield record.as_task()
+
+
+def iter_tasks_from_archive(
+    settings,
+    chunk_size=None,
+    sort_by="date_done",
+    sort_order="asc",
+    filters=None,
+):
+    records = _task_records(sort_by, sort_order, filters=filters).iterator(
+        chunk_size=chunk_size or settings.TASKS_FETCH_CHUNK_SIZE
+    )
+    for record in records:
+        yield record.as_task()
+
+
+def _task_records(
+    sort_by, sort_order, page_size=None, cursor=None, filters=None
+):
+    offset = int(cursor or 0)
+
+    # Results sort by their text, the same as in the Redis index.
+    if sort_by == "result":
+        sort_by = "result_text"
+
+    # Tasks without a value go last, like they do in the Redis indexes, and
+    # the task id breaks ties so pages don't overlap.
+    if sort_order == "desc":
+        order = [F(sort_by).desc(nulls_last=True), "-task_id"]
+    else:
+        order = [F(sort_by).asc(nulls_first=True), "task_id"]
+
+    records = TaskRecord.objects.filter(
+        **_record_filters(filters or {})
+    ).order_by(*order)
+    if page_size is None:
+        return records[offset:]
+
+    return records[offset : offset + page_size]
+
+
+def _record_filters(filters):
+    lookups = {
+        "status": "status",
+        "completed": "completed",
+        "date_from": "date_done__gte",
+        "date_to": "date_done__lt",
+        "prefix": "result_text__startswith",
+    }
+    record_filters = {
+        lookups[field]: filters[field]
+        for field in TASK_FILTERS
+        if field in filters
+    }
+
+    # The index only has the start of the text, which narrows things down
+    # before the whole text gets checked.
+    if "prefix" in filters:
+        record_filters["result_prefix__startswith"] = filters["prefix"][
+            :RESULT_PREFIX_LENGTH
+        ]
+
+    return record_filters
+
+
+def iter_tasks_from_db(
+    settings,
+    chunk_size=None,
+    sort_by="date_done",
+    sort_order="asc",
+    filters=None,
+):
+    """Yield every indexed task in order, one chunk at a time."""
+    r = get_redis()
+    chunk_size = chunk_size or settings.TASKS_FETCH_CHUNK_SIZE
+    index_key = SORT_INDEX_KEYS[sort_by]
+    desc = sort_order == "desc"
+
+    if filters:
+        # The matches stay put while they're kept, expired tasks and all.
+        start = 0
+        while task_ids := filter_task_ids(
+            r, filters, sort_by, sort_order, start, chunk_size
+        ):
+            yield from _fetch_tasks(r, task_ids, chunk_size)
+            start += len(task_ids)
+        return
+
+    start = 0
+    while True:
+        members = r.zrange(index_key, start, start + chunk_size - 1, desc=desc)
+        if not members:
+            return
+
+        tasks = _fetch_tasks(r, members, chunk_size)
+        yield from tasks
+
+        # Expired tasks get dropped from the index, which moves everything
+        # after them up by that many places.
+        start += len(tasks)
+
+
+async def aiter_tasks_from_db(
+    settings,
+    chunk_size=None,
+    sort_by="date_done",
+    sort_order="asc",
+    filters=None,
+):
+    """Async version of iter_tasks_from_db."""
+    r = get_async_redis()
+    chunk_size = chunk_size or settings.TASKS_FETCH_CHUNK_SIZE
+    index_key = SORT_INDEX_KEYS[sort_by]
+    desc = sort_order == "desc"
+
+    if filters:
+        start = 0
+        while task_ids := await filter_task_ids(
+            r, filters, sort_by, sort_order, start, chunk_size
+        ):
+            for task in await _afetch_tasks(r, task_ids, chunk_size):
+                yield task
+            start += len(task_ids)
+        return
+
+    start = 0
+    while True:
+        members = await r.zrange(
+            index_key, start, start + chunk_size - 1, desc=desc
+        )
+        if not members:
+            return
+
+        tasks = await _afetch_tasks(r, members, chunk_size)
+        for task in tasks:
+            yield task
+
+        start += len(tasks)
+
+
+def scan_tasks(settings, chunk_size=None):
+    """
+    Yield every stored task, indexed or not and in no particular order,
+    holding one chunk of them at a time. Like SCAN itself, tasks stored or
+    deleted meanwhile may or may not turn up, and a task turns up twice in
+    the rare case that Redis resizes its keyspace meanwhile.
+    """
+    r = get_redis()
+    chunk_size = chunk_size or settings.TASKS_FETCH_CHUNK_SIZE
+
+    task_ids = []
+    for key in r.scan_iter(match=f"{TASK_KEY_PREFIX}*", count=chunk_size):
+        task_ids.append(key.decode().removeprefix(TASK_KEY_PREFIX))
+        if len(task_ids) == chunk_size:
+            results = _mget_tasks(r, task_ids, chunk_size).execute()
+            yield from _decode_tasks(*_split_fetched(task_ids, results))
+            task_ids = []
+
+    if task_ids:
+        results = _mget_tasks(r, task_ids, chunk_size).execute()
+        yield from _decode_tasks(*_split_fetched(task_ids, results))
+
+
+async def ascan_tasks(settings, chunk_size=None):
+    """Async version of scan_tasks."""
+    r = get_async_redis()
+    chunk_size = chunk_size or settings.TASKS_FETCH_CHUNK_SIZE
+
+    task_ids = []
+    async for key in r.scan_iter(
+        match=f"{TASK_KEY_PREFIX}*", count=chunk_size
+    ):
+        task_ids.append(key.decode().removeprefix(TASK_KEY_PREFIX))
+        if len(task_ids) == chunk_size:
+            results = await _mget_tasks(r, task_ids, chunk_size).execute()
+            for task in _decode_tasks(*_split_fetched(task_ids, results)):
+                yield task
+            task_ids = []
+
+    if task_ids:
+        results = await _mget_tasks(r, task_ids, chunk_size).execute()
+        for task in _decode_tasks(*_split_fetched(task_ids, results)):
+            yield task
+
+
+def _fetch_tasks(r, members, chunk_size):
+    task_ids = _member_task_ids(members)
+    cached, generation = get_task_cache(TASK_KEY_PREFIXES).get_many(task_ids)
+    missing = [task_id for task_id in task_ids if task_id not in cached]
+    if not missing:
+        return [cached[task_id] for task_id in task_ids]
+
+    results = _mget_tasks(r, missing, chunk_size).execute()
+    payloads, changes = _split_fetched(missing, results)
+
+    expired_ids = _expired_task_ids(missing, payloads)
+    if expired_ids:
+        # The result expired but its index entry stuck around.
+        unindex = r.register_script(scripts.UNINDEX_TASKS)
+        pipe = r.pipeline(transaction=False)
+        unindex(keys=TASK_INDEX_KEYS, args=expired_ids, client=pipe)
+        bump_task_set_version(pipe)
+        pipe.execute()
+
+    return _merge_tasks(
+        task_ids, cached, missing, payloads, changes, generation
+    )
+
+
+async def _afetch_tasks(r, members, chunk_size):
+    task_ids = _member_task_ids(members)
+    cached, generation = get_task_cache(TASK_KEY_PREFIXES).get_many(task_ids)
+    missing = [task_id for task_id in task_ids if task_id not in cached]
+    if not missing:
+        return [cached[task_id] for task_id in task_ids]
+
+    results = await _mget_tasks(r, missing, chunk_size).execute()
+    payloads, changes = _split_fetched(missing, results)
+
+    expired_ids = _expired_task_ids(missing, payloads)
+    if expired_ids:
+        unindex = r.register_script(scripts.UNINDEX_TASKS)
+        pipe = r.pipeline(transaction=False)
+        await unindex(keys=TASK_INDEX_KEYS, args=expired_ids, client=pipe)
+        bump_task_set_version(pipe)
+        await pipe.execute()
+
+    return _merge_tasks(
+        task_ids, cached, missing, payloads, changes, generation
+    )
+
+
+def _merge_tasks(task_ids, cached, missing, payloads, changes, generation):
+    """Put the cached and fetched tasks back in order, caching the latter."""
+    fetched = dict(
+        zip(
+            [
+                task_id
+                for task_id, payload in zip(missing, payloads)
+                if payload is not None
+            ],
+            _decode_tasks(payloads, changes),
+        )
+    )
+    get_task_cache(TASK_KEY_PREFIXES).set_many(fetched, generation)
+
+    return [
+        cached[task_id] if task_id in cached else fetched[task_id]
+        for task_id in task_ids
+        if task_id in cached or task_id in fetched
+    ]
+
+
+def _member_task_ids(members):
+    # Members of the status and result indexes end with a NUL and the task id.
+    return [member.decode().rpartition("\0")[2] for member in members]
+
+
+def _mget_tasks(r, task_ids, chunk_size):
+    # One MGET per chunk keeps each command small enough not to stall Redis,
+    # and pipelining them and the reads of the tasks' changes means the whole
+    # page is still one round trip.
+    pipe = r.pipeline(transaction=False)
+    for i in range(0, len(task_ids), chunk_size):
+        chunk = task_ids[i : i + chunk_size]
+        pipe.mget([f"{TASK_KEY_PREFIX}{task_id}" for task_id in chunk])
+    for task_id in task_ids:
+        pipe.hgetall(f"{TASK_CHANGES_PREFIX}{task_id}")
+
+    return pipe
+
+
+def _split_fetched(task_ids, results):
+    """Split what _mget_tasks read into each task's payload and changes."""
+    mgets = len(results) - len(task_ids)
+    payloads = [payload for chunk in results[:mgets] for payload in chunk]
+    return payloads, results[mgets:]
+
+
+def _expired_task_ids(task_ids, payloads):
+    return [
+        task_id
+        for task_id, payload in zip(task_ids, payloads)
+        if payload is None
+    ]
+
+
+def _decode_tasks(payloads, changes):
+    found = [
+        (payload, task_changes)
+        for payload, task_changes in zip(payloads, changes)
+        if payload is not None
+    ]
+    payloads = [payload for payload, _ in found]
+    if any(result_format(payload) != "json" for payload in payloads):
+        tasks = [decode_result(payload) for payload in payloads]
+    else:
+        # Decoding the chunk as a single JSON array is a lot cheaper than
+        # calling json.loads once per task.
+        tasks = json.loads(b"[" + b",".join(payloads) + b"]")
+
+    return [
+        _apply_changes(task, task_changes)
+        for task, (_, task_changes) in zip(tasks, found)
+    ]
+
+
+def _apply_changes(task, changes):
+    for field, value in changes.items():
+        task[field.decode()] = json.loads(value)
+
+    return task
 
 
 def update_task_in_db(settings, task_id, data_to_update):
-    r = redis.from_url(settings.REDIS_URL)
-    key = f"celery-task-meta-{task_id}"
-    task_data = r.get(key)
-    if task_data:
-        task = json.loads(task_data)
-        task.update(data_to_update)
-        r.set(key, json.dumps(task))
+    """Merge fields into a stored task, returning False if it doesn't exist."""
+    return update_tasks_in_db(settings, [(task_id, data_to_update)])[0]
+
+
+def update_tasks_in_db(settings, updates):
+    """Apply (task_id, data_to_update) pairs in one transaction."""
+    archived = [False] * len(updates)
+    if settings.TASK_LIST_SOURCE == "postgres":
+        archived = _update_task_records(updates)
+
+    return _patch_tasks(get_redis(), updates, archived)
+
+
+async def aupdate_task_in_db(settings, task_id, data_to_update):
+    updates = [(task_id, data_to_update)]
+    return (await aupdate_tasks_in_db(settings, updates))[0]
+
+
+async def aupdate_tasks_in_db(settings, updates):
+    archived = [False] * len(updates)
+    if settings.TASK_LIST_SOURCE == "postgres":
+        archived = await sync_to_async(_update_task_records)(updates)
+
+    return await _apatch_tasks(get_async_redis(), updates, archived)
+
+
+def _update_task_records(updates):
+    # Archived tasks are changed right away, rather than on the next run of
+    # archive_tasks, so the task list never shows them out of date. This has
+    # to happen before the task set version gets bumped.
+    groups = defaultdict(list)
+    for task_id, data_to_update in updates:
+        fields = {
+            field: value
+            for field, value in data_to_update.items()
+            if field in ARCHIVED_FIELDS
+        }
+        if "result" in fields:
+            fields["result_text"] = result_text(fields["result"])
+            fields["result_prefix"] = fields["result_text"][
+                :RESULT_PREFIX_LENGTH
+            ]
+        groups[json.dumps(fields, sort_keys=True)].append(task_id)
+
+    task_ids = [task_id for task_id, _ in updates]
+    with transaction.atomic():
+        for fields, group in groups.items():
+            if fields := json.loads(fields):
+                TaskRecord.objects.filter(task_id__in=group).update(**fields)
+
+        found = set(
+            TaskRecord.objects.filter(task_id__in=task_ids).values_list(
+                "task_id", flat=True
+            )
+        )
+
+    return [task_id in found for task_id in task_ids]
+
+
+def _patch_tasks(r, updates, archived):
+    """
+    Record changes to stored tasks, returning whether each one exists in
+    Redis or was already changed in the archive. It all happens in a single
+    script call, which leaves the results themselves alone.
+    """
+    if not updates:
+        return []
+
+    update = r.register_script(scripts.UPDATE_TASKS)
+    return [
+        bool(found)
+        for found in update(**_update_tasks_call(updates, archived), client=r)
+    ]
+
+
+async def _apatch_tasks(r, updates, archived):
+    if not updates:
+        return []
+
+    update = r.register_script(scripts.UPDATE_TASKS)
+    found = await update(**_update_tasks_call(updates, archived), client=r)
+    return [bool(task_found) for task_found in found]
+
+
+def _update_tasks_call(updates, archived):
+    keys = [*TASK_INDEX_KEYS, TASK_VERSION_KEY, TASK_ARCHIVE_KEY]
+    args = [TASK_EVENTS_CHANNEL, time.time()]
+    for (task_id, data_to_update), found in zip(updates, archived):
+        keys += [
+            f"{TASK_KEY_PREFIX}{task_id}",
+            f"{TASK_CHANGES_PREFIX}{task_id}",
+        ]
+        args += [
+            task_id,
+            int(found),
+            json.dumps({**data_to_update, "task_id": task_id}, default=str),
+            len(data_to_update),
+        ]
+        for field, value in data_to_update.items():
+            args += [field, json.dumps(value, default=str)]
+
+    return {"keys": keys, "args": args}
@@ -1,11 +1,76 @@
+import asyncio
+import contextlib
+import csv
+import io
 import json
-from unittest.mock import patch
+import random
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from importlib import reload
+from io import StringIO
+from unittest.mock import ANY, AsyncMock, MagicMock, patch
 
 import fakeredis
 from django.conf import settings
-from django.test import RequestFactory, TestCase
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DataError, OperationalError
+from django.test import RequestFactory, TestCase, override_settings
 
-from .tasks import add_name_to_queue, read_tasks_from_db, update_task_in_db
+import pages.tasks
+from config.serializers import encode_result
+from pages.batching import NameBatcher
+from pages.events import RESET, TaskEvents
+from pages.management.commands.benchmark_tasks import seed_tasks
+from pages.models import TaskRecord
+from pages.task_cache import TaskCache
+from pages.tasks import (
+    SORT_INDEX_KEYS,
+    SORT_VALUES_KEY,
+    TASK_ARCHIVE_FAILED_KEY,
+    TASK_ARCHIVE_KEY,
+    TASK_EVENTS_CHANNEL,
+    TASK_FILTER_KEY,
+    TASK_FILTER_TIMEOUT,
+    TASK_INDEX_KEY,
+    TASK_KEY_PREFIXES,
+    TASK_STATUS_KEY_PREFIX,
+    add_name_to_queue,
+    add_names_to_queue,
+    aget_task_set_version,
+    aiter_tasks_from_archive,
+    aiter_tasks_from_db,
+    archive_tasks,
+    aread_tasks_from_archive,
+    aread_tasks_from_db,
+    aupdate_task_in_db,
+    aupdate_tasks_in_db,
+    bump_task_set_version,
+    filter_task_ids,
+    get_task_set_version,
+    index_finished_task,
+    index_task,
+    iter_tasks_from_db,
+    read_tasks_from_archive,
+    read_tasks_from_db,
+    scan_tasks,
+    trim_tasks,
+    unindex_expired_tasks,
+    update_task_in_db,
+    update_tasks_in_db,
+)
+from pages.views import NAME_MAX_LENGTH
+
+LOCMEM_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+}
+
+
+async def _aiter(items):
+    for item in items:
+        yield item
 
 
 class ViewTests(TestCase):
@@ -15,8 +80,8 @@ class ViewTests(TestCase):
             response = self.client.get("/", follow=True)
         self.assertEqual(response.status_code, 200)
 
-    @patch("pages.views.add_name_to_queue.delay")
-    def test_home_page_post(self, mock_delay):
+    @patch("pages.views.name_batcher.add")
+    def test_home_page_post(self, mock_add):
         """Home page should respond with a success 200 when posting a name."""
         with patch.dict("os.environ", {"PYTHON_VERSION": "3.11"}):
             response = self.client.post("/", data={"name": "test"})
@@ -24,10 +89,10 @@ class ViewTests(TestCase):
         self.assertContains(
             response, "Hello test, your name has been added to the queue!"
         )
-        mock_delay.assert_called_once_with("test")
+        mock_add.assert_called_once_with("test")
 
-    @patch("pages.views.add_name_to_queue.delay")
-    def test_home_page_post_no_name(self, mock_delay):
+    @patch("pages.views.name_batcher.add")
+    def test_home_page_post_no_name(self, mock_add):
         """Home page should respond with a success 200 when posting without a name."""
         with patch.dict("os.environ", {"PYTHON_VERSION": "3.11"}):
             response = self.client.post("/")
@@ -35,11 +100,125 @@ class ViewTests(TestCase):
         self.assertContains(
             response, "Hello Anonymous, your name has been added to the queue!"
         )
-        mock_delay.assert_called_once_with("Anonymous")
+        mock_add.assert_called_once_with("Anonymous")
+
+    @patch("pages.views.name_batcher.add")
+    def test_home_page_post_long_name(self, mock_add):
+        with patch.dict("os.environ", {"PYTHON_VERSION": "3.11"}):
+            response = self.client.post(
+                "/", data={"name": "x" * (NAME_MAX_LENGTH + 1)}
+            )
+        self.assertEqual(response.status_code, 400)
+        self.assertContains(
+            response,
+            f"longer than {NAME_MAX_LENGTH} characters",
+            status_code=400,
+        )
+        mock_add.assert_not_called()
+
+
+@patch("pages.batching.add_names_to_queue.delay")
+class NameBatcherTests(TestCase):
+    def test_flush_when_full(self, mock_delay):
+        batcher = NameBatcher(max_size=2, max_delay=60)
+        batcher.add("a")
+        mock_delay.assert_not_called()
+
+        batcher.add("b")
+        mock_delay.assert_called_once_with(["a", "b"])
+
+        batcher.flush()
+        mock_delay.assert_called_once()
+
+    def test_flush_after_delay(self, mock_delay):
+        flushed = threading.Event()
+        mock_delay.side_effect = lambda names: flushed.set()
+
+        batcher = NameBatcher(max_size=100, max_delay=0.01)
+        batcher.add("a")
+        batcher.add("b")
+
+        self.assertTrue(flushed.wait(5))
+        mock_delay.assert_called_once_with(["a", "b"])
 
+    def test_flush_keeps_names_on_failure(self, mock_delay):
+        batcher = NameBatcher(max_size=100, max_delay=60)
+        batcher.add("a")
 
+        mock_delay.side_effect = ConnectionError
+        with self.assertLogs("pages.batching", "WARNING"):
+            self.assertFalse(batcher.flush())
+
+        mock_delay.side_effect = None
+        batcher.add("b")
+        self.assertTrue(batcher.flush())
+        mock_delay.assert_called_with(["a", "b"])
+
+    def test_flush_retried_after_failure(self, mock_delay):
+        flushed = threading.Event()
+
+        def delay(names):
+            if mock_delay.call_count == 1:
+                raise ConnectionError
+            flushed.set()
+
+        mock_delay.side_effect = delay
+        batcher = NameBatcher(max_size=100, max_delay=0.01)
+        with self.assertLogs("pages.batching", "WARNING"):
+            batcher.add("a")
+            self.assertTrue(flushed.wait(5))
+
+        self.assertEqual(mock_delay.call_count, 2)
+        mock_delay.assert_called_with(["a"])
+
+    def test_add_when_full_does_not_raise(self, mock_delay):
+        mock_delay.side_effect = ConnectionError
+        batcher = NameBatcher(max_size=1, max_delay=60)
+
+        with self.assertLogs("pages.batching", "WARNING"):
+            batcher.add("a")
+
+        mock_delay.side_effect = None
+        batcher.flush()
+        mock_delay.assert_called_with(["a"])
+
+    @patch("pages.batching.time.sleep")
+    def test_drain(self, mock_sleep, mock_delay):
+        mock_delay.side_effect = [ConnectionError, None]
+        batcher = NameBatcher(max_size=100, max_delay=60)
+        batcher.add("a")
+
+        with self.assertLogs("pages.batching", "WARNING"):
+            self.assertTrue(batcher.drain(attempts=3, delay=2))
+        self.assertEqual(mock_delay.call_count, 2)
+        mock_sleep.assert_called_once_with(2)
+
+        # Gives up after the last attempt
+        mock_delay.side_effect = ConnectionError
+        batcher.add("b")
+        with self.assertLogs("pages.batching", "ERROR"):
+            self.assertFalse(batcher.drain(attempts=2))
+        self.assertEqual(mock_delay.call_count, 4)
+        self.assertTrue(batcher.drain())
+        self.assertEqual(mock_delay.call_count, 4)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
 class TaskListViewTests(TestCase):
     def setUp(self):
+        cache.clear()
+        # The test client is WSGI, async_client is ASGI.
+        version = patch(
+            "pages.views.get_task_set_version", return_value=(1, None)
+        )
+        self.mock_version = version.start()
+        self.addCleanup(version.stop)
+        aversion = patch(
+            "pages.views.aget_task_set_version", return_value=(1, None)
+        )
+        aversion.start()
+        self.addCleanup(aversion.stop)
+
         self.factory = RequestFactory()
         self.mock_tasks = [
             {
@@ -115,121 +294,2000 @@ class TaskListViewTests(TestCase):
         task_ids = [t["task_id"] for t in response.context["tasks"]]
         self.assertEqual(task_ids, ["2", "3", "1"])
 
+    @patch("pages.views.read_tasks_from_db")
+    def test_task_list_pagination(self, mock_read_tasks):
+        mock_read_tasks.return_value = self.mock_tasks
 
-@patch("pages.views.update_task_in_db")
-class UpdateTaskStatusViewTests(TestCase):
-    def test_update_task_status_success(self, mock_update_task):
-        response = self.client.post(
-            "/tasks/update-status/",
-            data=json.dumps({"task_id": "1", "completed": True}),
-            content_type="application/json",
+        with patch.dict("os.environ", {"PYTHON_VERSION": "3.11"}):
+            response = self.client.get("/tasks/?page_size=2&cursor=2")
+
+        self.assertEqual(response.status_code, 200)
+        mock_read_tasks.assert_called_once_with(
+            settings,
+            sort_by="date_done",
+            sort_order="desc",
+            page_size=3,
+            cursor=2,
+            filters={},
         )
+        self.assertEqual(len(response.context["tasks"]), 2)
+        self.assertEqual(response.context["prev_cursor"], 0)
+        self.assertEqual(response.context["next_cursor"], 4)
+
+    @patch("pages.views.read_tasks_from_db")
+    def test_task_list_filters(self, mock_read_tasks):
+        mock_read_tasks.return_value = self.mock_tasks[:1]
+
+        with patch.dict("os.environ", {"PYTHON_VERSION": "3.11"}):
+            response = self.client.get(
+                "/tasks/?status=SUCCESS&completed=true&prefix=A"
+                "&date_from=2023-01-01&date_to=2023-01-02&cursor=invalid"
+            )
+
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(response.json(), {"success": True})
-        mock_update_task.assert_called_once_with(
-            settings, "1", {"completed": True}
+        mock_read_tasks.assert_called_once_with(
+            settings,
+            sort_by="date_done",
+            sort_order="desc",
+            page_size=settings.TASKS_PAGE_SIZE + 1,
+            cursor=0,
+            filters={
+                "status": "SUCCESS",
+                "prefix": "A",
+                "completed": True,
+                "date_from": datetime(2023, 1, 1, tzinfo=timezone.utc),
+                "date_to": datetime(2023, 1, 3, tzinfo=timezone.utc),
+            },
+        )
+        # Sorting keeps the filters
+        self.assertContains(
+            response,
+            "?sort_by=status&sort_order=asc&page_size=50"
+            "&amp;status=SUCCESS&amp;prefix=A&amp;completed=true"
+            "&amp;date_from=2023-01-01&amp;date_to=2023-01-02",
         )
+        self.assertContains(response, '<option value="SUCCESS" selected>')
 
-    def test_update_task_status_missing_parameters(self, mock_update_task):
-        response = self.client.post(
-            "/tasks/update-status/",
-            data=json.dumps({"task_id": "1"}),
-            content_type="application/json",
+    @patch("pages.views.read_tasks_from_db")
+    def test_task_list_invalid_filters(self, mock_read_tasks):
+        mock_read_tasks.return_value = []
+
+        with patch.dict("os.environ", {"PYTHON_VERSION": "3.11"}):
+            self.client.get("/tasks/?completed=maybe&date_to=yesterday")
+
+        self.assertEqual(mock_read_tasks.call_args.kwargs["filters"], {})
+
+    @patch("pages.views.read_tasks_from_db")
+    def test_task_list_last_page(self, mock_read_tasks):
+        mock_read_tasks.return_value = self.mock_tasks[:1]
+
+        with patch.dict("os.environ", {"PYTHON_VERSION": "3.11"}):
+            response = self.client.get("/tasks/?page_size=invalid")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.context["page_size"], settings.TASKS_PAGE_SIZE
         )
-        self.assertEqual(response.status_code, 400)
+        self.assertIsNone(response.context["prev_cursor"])
+        self.assertIsNone(response.context["next_cursor"])
+
+    @patch("pages.views.read_tasks_from_db")
+    def test_task_list_cached(self, mock_read_tasks):
+        mock_read_tasks.return_value = self.mock_tasks
+
+        with patch.dict("os.environ", {"PYTHON_VERSION": "3.11"}):
+            self.client.get("/tasks/")
+            response = self.client.get("/tasks/")
+
+        mock_read_tasks.assert_called_once()
+        task_ids = [t["task_id"] for t in response.context["tasks"]]
+        self.assertEqual(task_ids, ["1", "2", "3"])
+
+        # Any change to a task bumps the version and misses the cache
+        self.mock_version.return_value = (2, None)
+        with patch.dict("os.environ", {"PYTHON_VERSION": "3.11"}):
+            self.client.get("/tasks/")
+        self.assertEqual(mock_read_tasks.call_count, 2)
+
+    @patch("pages.views.read_tasks_from_db")
+    def test_task_list_cached_per_page(self, mock_read_tasks):
+        mock_read_tasks.return_value = self.mock_tasks
+
+        with patch.dict("os.environ", {"PYTHON_VERSION": "3.11"}):
+            self.client.get("/tasks/")
+            self.client.get("/tasks/?cursor=50")
+            self.client.get("/tasks/?sort_order=asc")
+
+        self.assertEqual(mock_read_tasks.call_count, 3)
+
+    @override_settings(TASK_LIST_SOURCE="postgres")
+    @patch("pages.views.read_tasks_from_db")
+    @patch("pages.views.read_tasks_from_archive")
+    def test_task_list_from_archive(self, mock_read_archive, mock_read_tasks):
+        mock_read_archive.return_value = self.mock_tasks
+
+        with patch.dict("os.environ", {"PYTHON_VERSION": "3.11"}):
+            response = self.client.get("/tasks/?sort_by=status")
+
+        self.assertEqual(len(response.context["tasks"]), 3)
+        mock_read_archive.assert_called_once_with(
+            settings,
+            sort_by="status",
+            sort_order="desc",
+            page_size=settings.TASKS_PAGE_SIZE + 1,
+            cursor=0,
+            filters={},
+        )
+        mock_read_tasks.assert_not_called()
+
+    @patch("pages.views.read_tasks_from_db")
+    @patch("pages.views.aread_tasks_from_db")
+    async def test_task_list_asgi(self, mock_aread_tasks, mock_read_tasks):
+        mock_aread_tasks.return_value = self.mock_tasks
+
+        with patch.dict("os.environ", {"PYTHON_VERSION": "3.11"}):
+            response = await self.async_client.get("/tasks/")
+
+        self.assertEqual(len(response.context["tasks"]), 3)
+        mock_aread_tasks.assert_awaited_once()
+        mock_read_tasks.assert_not_called()
+
+    @patch("pages.views.aiter_tasks_from_db")
+    async def test_task_list_stream(self, mock_iter_tasks):
+        mock_iter_tasks.return_value = _aiter(self.mock_tasks)
+
+        with (
+            patch.dict("os.environ", {"PYTHON_VERSION": "3.11"}),
+            self.settings(TASKS_FETCH_CHUNK_SIZE=2),
+        ):
+            response = await self.async_client.get(
+                "/tasks/?stream=1&sort_order=asc"
+            )
+            chunks = [
+                chunk.decode() async for chunk in response.streaming_content
+            ]
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        mock_iter_tasks.assert_called_once_with(
+            settings, sort_by="date_done", sort_order="asc", filters={}
+        )
+
+        # Head, 2 chunks of rows and the rest of the page
+        self.assertEqual(len(chunks), 4)
+        self.assertIn("<thead>", chunks[0])
+        self.assertEqual(chunks[1].count("<tr "), 2)
+        self.assertEqual(chunks[2].count("<tr "), 1)
+        self.assertIn("</table>", chunks[3])
+        self.assertNotIn("__task_rows__", "".join(chunks))
+
+    @patch("pages.views.aiter_tasks_from_db")
+    async def test_task_list_stream_sorted(self, mock_iter_tasks):
+        mock_iter_tasks.return_value = _aiter(self.mock_tasks)
+
+        with patch.dict("os.environ", {"PYTHON_VERSION": "3.11"}):
+            response = await self.async_client.get(
+                "/tasks/?stream=1&sort_by=status"
+            )
+            content = b"".join(
+                [chunk async for chunk in response.streaming_content]
+            ).decode()
+
+        mock_iter_tasks.assert_called_once_with(
+            settings, sort_by="status", sort_order="desc", filters={}
+        )
+        self.assertEqual(content.count("task-completed-checkbox"), 3)
+
+    @patch("pages.views.aiter_tasks_from_db")
+    @patch("pages.views.iter_tasks_from_db")
+    def test_task_list_stream_wsgi(self, mock_iter_tasks, mock_aiter_tasks):
+        mock_iter_tasks.return_value = iter(self.mock_tasks)
+
+        with (
+            patch.dict("os.environ", {"PYTHON_VERSION": "3.11"}),
+            self.settings(TASKS_FETCH_CHUNK_SIZE=2),
+        ):
+            response = self.client.get("/tasks/?stream=1")
+            # Django would read an async iterator to the end to hand it over.
+            self.assertFalse(response.is_async)
+            chunks = [chunk.decode() for chunk in response.streaming_content]
+
+        mock_iter_tasks.assert_called_once_with(
+            settings, sort_by="date_done", sort_order="desc", filters={}
+        )
+        mock_aiter_tasks.assert_not_called()
+        self.assertEqual(len(chunks), 4)
+        self.assertEqual(chunks[1].count("<tr "), 2)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+@patch("pages.views.get_task_set_version", return_value=(7, 1672574400.0))
+class TaskListJsonViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.mock_tasks = [
+            {"task_id": "1", "status": "SUCCESS", "completed": True},
+            {"task_id": "2", "status": "PENDING", "completed": False},
+        ]
+
+    @patch("pages.views.read_tasks_from_db")
+    def test_task_list_json(self, mock_read_tasks, mock_version):
+        mock_read_tasks.return_value = self.mock_tasks
+
+        response = self.client.get(
+            "/api/tasks/?sort_by=status&sort_order=asc&page_size=1"
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["ETag"], '"tasks-7"')
         self.assertEqual(
-            response.json(), {"success": False, "error": "Missing parameters"}
+            response["Last-Modified"], "Sun, 01 Jan 2023 12:00:00 GMT"
+        )
+        self.assertEqual(
+            response.json(),
+            {
+                "tasks": self.mock_tasks[:1],
+                "sort_by": "status",
+                "sort_order": "asc",
+                "page_size": 1,
+                "next_cursor": 1,
+            },
+        )
+        mock_read_tasks.assert_called_once_with(
+            settings,
+            sort_by="status",
+            sort_order="asc",
+            page_size=2,
+            cursor=0,
+            filters={},
         )
-        mock_update_task.assert_not_called()
 
-    def test_update_task_status_invalid_json(self, mock_update_task):
-        response = self.client.post(
-            "/tasks/update-status/",
-            data="invalid json",
-            content_type="application/json",
+    @patch("pages.views.read_tasks_from_db")
+    def test_task_list_json_not_modified(self, mock_read_tasks, mock_version):
+        response = self.client.get(
+            "/api/tasks/", headers={"If-None-Match": '"tasks-7"'}
         )
-        self.assertEqual(response.status_code, 400)
+
+        self.assertEqual(response.status_code, 304)
+        mock_read_tasks.assert_not_called()
+
+    @patch("pages.views.read_tasks_from_db")
+    def test_task_list_json_modified(self, mock_read_tasks, mock_version):
+        mock_read_tasks.return_value = self.mock_tasks
+
+        response = self.client.get(
+            "/api/tasks/", headers={"If-None-Match": '"tasks-6"'}
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["tasks"]), 2)
+
+
+class TaskEventsViewTests(TestCase):
+    def events(self, queue):
+        @contextlib.asynccontextmanager
+        async def subscribe():
+            yield queue
+
+        return patch("pages.views.subscribe_task_events", subscribe)
+
+    async def read(self, response, count):
+        content = aiter(response.streaming_content)
+        chunks = [await anext(content) for _ in range(count)]
+        await content.aclose()
+        return b"".join(chunks).decode()
+
+    async def test_task_events(self):
+        queue = asyncio.Queue()
+        queue.put_nowait(b'{"type":"finished"}')
+
+        with self.events(queue):
+            response = await self.async_client.get("/tasks/events/")
+            content = await self.read(response, 2)
+
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        self.assertEqual(response["Cache-Control"], "no-cache")
         self.assertEqual(
-            response.json(), {"success": False, "error": "Invalid JSON"}
+            content,
+            f"retry: {settings.TASK_EVENTS_RETRY}\n\n"
+            'data: {"type":"finished"}\n\n',
         )
-        mock_update_task.assert_not_called()
 
-    def test_update_task_status_exception(self, mock_update_task):
-        mock_update_task.side_effect = Exception("Test exception")
-        response = self.client.post(
-            "/tasks/update-status/",
-            data=json.dumps({"task_id": "1", "completed": True}),
-            content_type="application/json",
+    @override_settings(TASK_EVENTS_KEEPALIVE=0.01)
+    async def test_task_events_keepalive(self):
+        with self.events(asyncio.Queue()):
+            response = await self.async_client.get("/tasks/events/")
+            content = await self.read(response, 2)
+
+        self.assertTrue(content.endswith(": keepalive\n\n"))
+
+    @override_settings(WEB_ASGI=False, CACHES=LOCMEM_CACHES)
+    def test_no_task_events_without_asgi(self):
+        from pages import urls
+
+        self.addCleanup(reload, urls)
+        reload(urls)
+        self.assertNotIn(
+            "task_events", [pattern.name for pattern in urls.urlpatterns]
         )
-        self.assertEqual(response.status_code, 500)
+
+        with (
+            patch("pages.views.read_tasks_from_db", return_value=[]),
+            patch("pages.views.get_task_set_version", return_value=(0, None)),
+        ):
+            response = self.client.get("/tasks/")
+        self.assertNotContains(response, "data-events-url")
+
+
+class TaskEventsTests(TestCase):
+    async def test_fan_out(self):
+        server = fakeredis.FakeServer()
+        r = fakeredis.FakeRedis(server=server)
+        events = TaskEvents()
+
+        with patch(
+            "pages.events.connect",
+            lambda: fakeredis.FakeAsyncRedis(server=server),
+        ):
+            async with events.subscribe() as first:
+                async with events.subscribe() as second:
+                    # Both streams share the one subscription
+                    while not r.pubsub_numsub(TASK_EVENTS_CHANNEL)[0][1]:
+                        await asyncio.sleep(0.01)
+                    r.publish(TASK_EVENTS_CHANNEL, "event")
+
+                    for queue in (first, second):
+                        event = await asyncio.wait_for(queue.get(), 1)
+                        self.assertEqual(event, b"event")
+
+                self.assertIsNotNone(events.listener)
+
+        self.assertIsNone(events.listener)
+
+    @override_settings(TASK_EVENTS_KEEPALIVE=0.01)
+    async def test_quiet_subscription_stays_open(self):
+        server = fakeredis.FakeServer()
+        events = TaskEvents()
+
+        with patch(
+            "pages.events.connect",
+            MagicMock(
+                side_effect=lambda: fakeredis.FakeAsyncRedis(server=server)
+            ),
+        ) as mock_connect:
+            async with events.subscribe() as queue:
+                await asyncio.sleep(0.1)
+                self.assertTrue(queue.empty())
+
+        mock_connect.assert_called_once()
+
+    async def test_resubscribes_after_losing_redis(self):
+        server = fakeredis.FakeServer()
+        r = fakeredis.FakeRedis(server=server)
+        events = TaskEvents()
+
+        broken = MagicMock(aclose=AsyncMock())
+        broken.pubsub.return_value = MagicMock(
+            subscribe=AsyncMock(side_effect=ConnectionError("down")),
+            aclose=AsyncMock(),
+        )
+        sleep = asyncio.sleep
+
+        async def no_wait(delay):
+            await sleep(0)
+
+        with (
+            patch(
+                "pages.events.connect",
+                side_effect=[broken, fakeredis.FakeAsyncRedis(server=server)],
+            ),
+            patch("pages.events.asyncio.sleep", no_wait),
+            self.assertLogs("pages.events", "WARNING"),
+        ):
+            async with events.subscribe() as queue:
+                # Events published while it was down are lost, so the page
+                # has to catch up.
+                self.assertEqual(await asyncio.wait_for(queue.get(), 1), RESET)
+
+                r.publish(TASK_EVENTS_CHANNEL, "event")
+                event = await asyncio.wait_for(queue.get(), 1)
+                self.assertEqual(event, b"event")
+
+    @override_settings(TASK_EVENTS_QUEUE_SIZE=2)
+    async def test_slow_subscriber_is_reset(self):
+        events = TaskEvents()
+        queue = asyncio.Queue(maxsize=2)
+
+        for event in (b"1", b"2", b"3"):
+            events._put(queue, event)
+
+        self.assertEqual(queue.get_nowait(), RESET)
+        self.assertTrue(queue.empty())
+
+
+class TaskCacheTests(TestCase):
+    def cache(self, max_size=10):
+        task_cache = TaskCache(max_size, TASK_KEY_PREFIXES)
+        # As if the listener thread had subscribed.
+        task_cache.listener = threading.current_thread()
+        task_cache.listening = True
+        return task_cache
+
+    def test_evicts_least_recently_used(self):
+        task_cache = self.cache(max_size=2)
+
+        _, generation = task_cache.get_many([])
+        task_cache.set_many({"a": {"n": 1}, "b": {"n": 2}}, generation)
+        task_cache.get_many(["a"])
+        task_cache.set_many({"c": {"n": 3}}, generation)
+
+        found, _ = task_cache.get_many(["a", "b", "c"])
+        self.assertEqual(found, {"a": {"n": 1}, "c": {"n": 3}})
+
+    def test_hands_out_copies(self):
+        task_cache = self.cache()
+
+        _, generation = task_cache.get_many([])
+        task_cache.set_many({"a": {"n": 1}}, generation)
+        task_cache.get_many(["a"])[0]["a"]["n"] = 2
+
+        self.assertEqual(task_cache.get_many(["a"])[0], {"a": {"n": 1}})
+
+    def test_not_cached_while_not_listening(self):
+        task_cache = self.cache()
+        task_cache.listening = False
+
+        _, generation = task_cache.get_many([])
+        task_cache.set_many({"a": {}}, generation)
+
+        self.assertEqual(task_cache.stats()["size"], 0)
+
+    def test_not_cached_when_invalidated_while_reading(self):
+        task_cache = self.cache()
+
+        _, generation = task_cache.get_many(["a"])
+        task_cache.invalidate([b"celery-task-meta-b"])
+        task_cache.set_many({"a": {}}, generation)
+
+        self.assertEqual(task_cache.stats()["size"], 0)
+
+    def test_invalidation_messages(self):
+        task_cache = self.cache()
+        _, generation = task_cache.get_many([])
+        task_cache.set_many({"a": {}, "b": {}, "c": {}}, generation)
+
+        task_cache._handle(
+            [b"message", b"__redis__:invalidate", [b"celery-task-meta-a"]]
+        )
+        task_cache._handle([b"pong", b""])
+        self.assertEqual(set(task_cache.tasks), {"b", "c"})
+
+        # So does a change made to a task.
+        task_cache._handle(
+            [b"message", b"__redis__:invalidate", [b"celery-task-changes-b"]]
+        )
+        self.assertEqual(set(task_cache.tasks), {"c"})
+
+        # A flush invalidates everything.
+        task_cache._handle([b"message", b"__redis__:invalidate", None])
+        self.assertEqual(task_cache.stats()["size"], 0)
+
+    def test_hits_and_misses_counted(self):
+        from prometheus_client import REGISTRY
+
+        def sample(result):
+            return REGISTRY.get_sample_value(
+                "task_cache_lookups_total", {"result": result}
+            )
+
+        task_cache = self.cache()
+        _, generation = task_cache.get_many([])
+        task_cache.set_many({"a": {}}, generation)
+        hits, misses = sample("hit"), sample("miss")
+
+        task_cache.get_many(["a", "b", "c"])
+        self.assertEqual(sample("hit"), hits + 1)
+        self.assertEqual(sample("miss"), misses + 2)
+
+    def test_off_in_tests(self):
+        self.assertEqual(settings.TASK_CACHE_SIZE, 0)
+
+    def test_subscribe(self):
+        task_cache = TaskCache(10, TASK_KEY_PREFIXES)
+        client = MagicMock()
+        client.client_id.return_value = 7
+
+        task_cache._subscribe(client)
+
+        client.client_tracking_on.assert_called_once_with(
+            clientid=7,
+            prefix=["celery-task-meta-", "celery-task-changes-"],
+            bcast=True,
+        )
+        client.connection.send_command.assert_called_once_with(
+            "SUBSCRIBE", "__redis__:invalidate"
+        )
+        self.assertTrue(task_cache.listening)
+
+    def test_cleared_when_subscription_lost(self):
+        task_cache = self.cache()
+        _, generation = task_cache.get_many([])
+        task_cache.set_many({"a": {}}, generation)
+
+        with (
+            patch.object(
+                task_cache, "_connect", side_effect=ConnectionError("down")
+            ),
+            patch("time.sleep", side_effect=SystemExit),
+            self.assertLogs("pages.task_cache", "WARNING"),
+            self.assertRaises(SystemExit),
+        ):
+            task_cache._listen()
+
         self.assertEqual(
-            response.json(), {"success": False, "error": "Test exception"}
+            task_cache.stats(),
+            {"size": 0, "max_size": 10, "listening": False},
         )
 
+    def test_read_tasks_cached(self):
+        server = fakeredis.FakeServer()
+        r = fakeredis.FakeRedis(server=server)
+        for i in range(3):
+            r.set(f"celery-task-meta-{i}", json.dumps({"task_id": str(i)}))
+            index_task(r, str(i), i)
 
-class TasksTests(TestCase):
+        task_cache = self.cache()
+        with (
+            patch("pages.tasks.get_redis", return_value=r),
+            patch(
+                "pages.tasks.get_async_redis",
+                lambda: fakeredis.FakeAsyncRedis(server=server),
+            ),
+            patch("pages.tasks.get_task_cache", return_value=task_cache),
+        ):
+            self.assertEqual(len(read_tasks_from_db(settings)), 3)
+
+            # Until Redis says it changed the cached task is used, without
+            # fetching anything but the page from the index.
+            r.set("celery-task-meta-1", json.dumps({"task_id": "changed"}))
+            with patch("pages.tasks._mget_tasks") as mock_mget:
+                tasks = asyncio.run(aread_tasks_from_db(settings))
+            mock_mget.assert_not_called()
+            self.assertEqual([task["task_id"] for task in tasks], list("210"))
+
+            task_cache.invalidate([b"celery-task-meta-1"])
+            tasks = read_tasks_from_db(settings)
+            self.assertEqual(
+                [task["task_id"] for task in tasks], ["2", "changed", "0"]
+            )
+
+
+class ExportTests(TestCase):
     def setUp(self):
-        self.mock_tasks = [
+        server = fakeredis.FakeServer()
+        self.redis = fakeredis.FakeRedis(server=server)
+        for patcher in (
+            patch("pages.tasks.get_redis", return_value=self.redis),
+            patch(
+                "pages.tasks.get_async_redis",
+                lambda: fakeredis.FakeAsyncRedis(server=server),
+            ),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.tasks = [
             {
                 "task_id": "1",
                 "status": "SUCCESS",
-                "result": "A",
+                "result": {"a": [1, 2]},
                 "date_done": "2023-01-01T12:00:00",
                 "completed": True,
+                "traceback": None,
             },
             {
                 "task_id": "2",
-                "status": "PENDING",
-                "result": "B",
-                "date_done": "2023-01-03T12:00:00",
-                "completed": False,
+                "status": "FAILURE",
+                "result": 'say "hi", bye',
+                "date_done": "2023-01-02T12:00:00",
+                "completed": None,
+                "traceback": "Traceback\nError",
             },
             {
                 "task_id": "3",
-                "status": "FAILURE",
-                "result": "C",
-                "date_done": "2023-01-02T12:00:00",
-                "completed": True,
+                "status": "PENDING",
+                "result": None,
+                "date_done": None,
+                "completed": False,
+                "traceback": None,
             },
         ]
+        for task, serializer in zip(self.tasks, ["json", "msgpack", "json"]):
+            self.redis.set(
+                f"celery-task-meta-{task['task_id']}",
+                encode_result(task, serializer),
+            )
+        # Unindexed tasks get exported too.
+        index_task(self.redis, "1", 1)
 
-    def test_add_name_to_queue(self):
-        result = add_name_to_queue("test")
-        self.assertEqual(result, "test")
+    async def export(self, response):
+        self.assertEqual(response.status_code, 200)
+        return b"".join(
+            [chunk async for chunk in response.streaming_content]
+        ).decode()
 
-    @patch("pages.tasks.redis.from_url")
-    def test_read_tasks_from_db(self, mock_from_url):
-        mock_redis = fakeredis.FakeRedis()
-        mock_from_url.return_value = mock_redis
+    def csv_rows(self, content):
+        return sorted(csv.reader(io.StringIO(content)))
 
-        for task in self.mock_tasks:
-            mock_redis.set(
-                f"celery-task-meta-{task['task_id']}", json.dumps(task)
+    @override_settings(TASKS_FETCH_CHUNK_SIZE=2)
+    async def test_csv(self):
+        response = await self.async_client.get("/tasks/export/")
+
+        self.assertEqual(response["Content-Type"], "text/csv; charset=utf-8")
+        self.assertEqual(
+            response["Content-Disposition"],
+            'attachment; filename="tasks.csv"',
+        )
+        content = await self.export(response)
+        self.assertTrue(
+            content.startswith(
+                "task_id,status,result,date_done,completed,traceback\r\n"
             )
-        tasks = read_tasks_from_db(
+        )
+        self.assertEqual(
+            self.csv_rows(content)[:3],
+            [
+                ["1", "SUCCESS", '{"a":[1,2]}', "2023-01-01T12:00:00"]
+                + ["true", ""],
+                ["2", "FAILURE", 'say "hi", bye', "2023-01-02T12:00:00"]
+                + ["", "Traceback\nError"],
+                ["3", "PENDING", "", "", "false", ""],
+            ],
+        )
+
+    async def test_ndjson(self):
+        response = await self.async_client.get("/tasks/export/?format=ndjson")
+
+        self.assertEqual(
+            response["Content-Type"], "application/x-ndjson; charset=utf-8"
+        )
+        tasks = [
+            json.loads(line)
+            for line in (await self.export(response)).splitlines()
+        ]
+        self.assertEqual(
+            sorted(tasks, key=lambda task: task["task_id"]), self.tasks
+        )
+
+    async def test_archive(self):
+        for task in self.tasks[:2]:
+            await TaskRecord.from_task(task).asave()
+
+        response = await self.async_client.get(
+            "/tasks/export/?format=ndjson&source=postgres"
+        )
+
+        tasks = [
+            json.loads(line)
+            for line in (await self.export(response)).splitlines()
+        ]
+        self.assertEqual([task["task_id"] for task in tasks], ["1", "2"])
+
+    def test_wsgi(self):
+        TaskRecord.from_task(self.tasks[0]).save()
+
+        for source in ("redis", "postgres"):
+            with self.subTest(source=source):
+                response = self.client.get(
+                    f"/tasks/export/?format=ndjson&source={source}"
+                )
+
+                self.assertFalse(response.is_async)
+                content = b"".join(response.streaming_content).decode()
+                self.assertEqual(
+                    len(content.splitlines()), 3 if source == "redis" else 1
+                )
+
+    def test_scan_tasks_in_chunks(self):
+        with patch(
+            "pages.tasks._mget_tasks", wraps=pages.tasks._mget_tasks
+        ) as mock_mget:
+            tasks = list(scan_tasks(settings, chunk_size=2))
+
+        self.assertEqual(
+            sorted(task["task_id"] for task in tasks), ["1", "2", "3"]
+        )
+        self.assertLessEqual(
+            max(len(call.args[1]) for call in mock_mget.call_args_list), 2
+        )
+
+    def test_command(self):
+        stdout, stderr = StringIO(), StringIO()
+        call_command("export_tasks", stdout=stdout, stderr=stderr)
+
+        self.assertEqual(len(self.csv_rows(stdout.getvalue())), 4)
+        self.assertEqual(stderr.getvalue(), "Exported 3 task(s)\n")
+
+    def test_command_output(self):
+        TaskRecord.from_task(self.tasks[0]).save()
+
+        with tempfile.NamedTemporaryFile(suffix=".ndjson") as f:
+            call_command(
+                "export_tasks",
+                format="ndjson",
+                source="postgres",
+                output=f.name,
+                stderr=StringIO(),
+            )
+            tasks = [json.loads(line) for line in f.read().splitlines()]
+
+        self.assertEqual(
+            tasks,
+            [
+                {
+                    "task_id": "1",
+                    "status": "SUCCESS",
+                    "result": {"a": [1, 2]},
+                    "date_done": "2023-01-01T12:00:00+00:00",
+                    "completed": True,
+                }
+            ],
+        )
+
+
+@patch("pages.views.update_tasks_in_db")
+class UpdateTaskStatusViewTests(TestCase):
+    def test_update_task_status_success(self, mock_update_task):
+        response = self.client.post(
+            "/tasks/update-status/",
+            data=json.dumps({"task_id": "1", "completed": True}),
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"success": True})
+        mock_update_task.assert_called_once_with(
+            settings, [("1", {"completed": True})]
+        )
+
+    def test_update_task_status_not_found(self, mock_update_task):
+        mock_update_task.return_value = [False]
+        response = self.client.post(
+            "/tasks/update-status/",
+            data=json.dumps({"task_id": "1", "completed": True}),
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(
+            response.json(), {"success": False, "error": "Task not found"}
+        )
+
+    def test_update_task_status_batch(self, mock_update_tasks):
+        mock_update_tasks.return_value = [True, False]
+        response = self.client.post(
+            "/tasks/update-status/",
+            data=json.dumps(
+                {
+                    "updates": [
+                        {"task_id": "1", "completed": True},
+                        {"task_id": "2"},
+                        {"task_id": "3", "completed": False},
+                    ]
+                }
+            ),
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json(),
+            {
+                "success": False,
+                "results": [
+                    {"task_id": "1", "success": True},
+                    {
+                        "task_id": "2",
+                        "success": False,
+                        "error": "Missing parameters",
+                    },
+                    {
+                        "task_id": "3",
+                        "success": False,
+                        "error": "Task not found",
+                    },
+                ],
+            },
+        )
+        mock_update_tasks.assert_called_once_with(
+            settings, [("1", {"completed": True}), ("3", {"completed": False})]
+        )
+
+    @patch("pages.views.aupdate_tasks_in_db", return_value=[True])
+    async def test_update_task_status_asgi(
+        self, mock_aupdate_tasks, mock_update_tasks
+    ):
+        response = await self.async_client.post(
+            "/tasks/update-status/",
+            data=json.dumps({"task_id": "1", "completed": True}),
+            content_type="application/json",
+        )
+        self.assertEqual(response.json(), {"success": True})
+        mock_aupdate_tasks.assert_awaited_once_with(
+            settings, [("1", {"completed": True})]
+        )
+        mock_update_tasks.assert_not_called()
+
+    def test_update_task_status_batch_invalid(self, mock_update_task):
+        response = self.client.post(
+            "/tasks/update-status/",
+            data=json.dumps({"updates": "1"}),
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.json(), {"success": False, "error": "Invalid updates"}
+        )
+
+    def test_update_task_status_missing_parameters(self, mock_update_task):
+        response = self.client.post(
+            "/tasks/update-status/",
+            data=json.dumps({"task_id": "1"}),
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.json(), {"success": False, "error": "Missing parameters"}
+        )
+        mock_update_task.assert_not_called()
+
+    def test_update_task_status_invalid_parameters(self, mock_update_task):
+        for data in (
+            {"task_id": "1", "completed": "false"},
+            {"task_id": 1, "completed": True},
+            ["1", True],
+        ):
+            with self.subTest(data=data):
+                response = self.client.post(
+                    "/tasks/update-status/",
+                    data=json.dumps(data),
+                    content_type="application/json",
+                )
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(
+                    response.json(),
+                    {"success": False, "error": "Invalid parameters"},
+                )
+
+        response = self.client.post(
+            "/tasks/update-status/",
+            data=json.dumps({"updates": [{"task_id": "1", "completed": 0}]}),
+            content_type="application/json",
+        )
+        self.assertEqual(
+            response.json()["results"],
+            [
+                {
+                    "task_id": "1",
+                    "success": False,
+                    "error": "Invalid parameters",
+                }
+            ],
+        )
+        mock_update_task.assert_not_called()
+
+    def test_update_task_status_invalid_json(self, mock_update_task):
+        response = self.client.post(
+            "/tasks/update-status/",
+            data="invalid json",
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.json(), {"success": False, "error": "Invalid JSON"}
+        )
+        mock_update_task.assert_not_called()
+
+    def test_update_task_status_exception(self, mock_update_task):
+        mock_update_task.side_effect = Exception("Test exception")
+        response = self.client.post(
+            "/tasks/update-status/",
+            data=json.dumps({"task_id": "1", "completed": True}),
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(
+            response.json(), {"success": False, "error": "Test exception"}
+        )
+
+
+class TasksTests(TestCase):
+    def setUp(self):
+        self.mock_tasks = [
+            {
+                "task_id": "1",
+                "status": "SUCCESS",
+                "result": "A",
+                "date_done": "2023-01-01T12:00:00",
+                "completed": True,
+            },
+            {
+                "task_id": "2",
+                "status": "PENDING",
+                "result": "B",
+                "date_done": "2023-01-03T12:00:00",
+                "completed": False,
+            },
+            {
+                "task_id": "3",
+                "status": "FAILURE",
+                "result": "C",
+                "date_done": "2023-01-02T12:00:00",
+                "completed": True,
+            },
+        ]
+
+    def test_add_name_to_queue(self):
+        result = add_name_to_queue("test")
+        self.assertEqual(result, "test")
+
+    @patch("pages.tasks.get_redis")
+    def test_add_names_to_queue(self, mock_get_redis):
+        mock_redis = fakeredis.FakeRedis()
+        mock_get_redis.return_value = mock_redis
+
+        task_ids = add_names_to_queue(["alice", "bob"])
+
+        # A task of its own for every name
+        self.assertEqual(len(set(task_ids)), 2)
+        tasks = read_tasks_from_db(settings, sort_by="result")
+        self.assertEqual(
+            [(task["task_id"], task["result"]) for task in tasks],
+            [(task_ids[1], "bob"), (task_ids[0], "alice")],
+        )
+        self.assertEqual(tasks[0]["status"], "SUCCESS")
+        self.assertGreater(
+            mock_redis.ttl(f"celery-task-meta-{task_ids[0]}"), 0
+        )
+        self.assertEqual(
+            filter_task_ids(mock_redis, {"prefix": "ali"}),
+            [task_ids[0].encode()],
+        )
+        self.assertEqual(
+            mock_redis.smembers(TASK_ARCHIVE_KEY),
+            {task_id.encode() for task_id in task_ids},
+        )
+        self.assertEqual(get_task_set_version(settings)[0], 1)
+
+        self.assertEqual(
+            update_tasks_in_db(settings, [(task_ids[0], {"completed": True})]),
+            [True],
+        )
+        tasks = read_tasks_from_db(settings, sort_by="result")
+        self.assertEqual(
+            [task.get("completed") for task in tasks], [None, True]
+        )
+
+    @patch("pages.tasks.get_redis")
+    def test_read_tasks_from_db(self, mock_get_redis):
+        mock_redis = fakeredis.FakeRedis()
+        mock_get_redis.return_value = mock_redis
+
+        for i, task in enumerate(self.mock_tasks):
+            mock_redis.set(
+                f"celery-task-meta-{task['task_id']}", json.dumps(task)
+            )
+            index_task(mock_redis, task["task_id"], i)
+        tasks = read_tasks_from_db(
             settings, sort_by="date_done", sort_order="asc"
         )
         self.assertEqual(len(tasks), 3)
 
-    @patch("pages.tasks.redis.from_url")
-    def test_update_task_in_db(self, mock_from_url):
+    @patch("pages.tasks.get_redis")
+    def test_read_tasks_from_db_skips_unindexed_keys(self, mock_get_redis):
+        mock_redis = fakeredis.FakeRedis()
+        mock_get_redis.return_value = mock_redis
+
+        mock_redis.set("celery-task-meta-1", json.dumps(self.mock_tasks[0]))
+        mock_redis.set("celery-task-meta-2", json.dumps(self.mock_tasks[1]))
+        index_task(mock_redis, "1", 1)
+
+        tasks = read_tasks_from_db(settings)
+        self.assertEqual([t["task_id"] for t in tasks], ["1"])
+
+    @patch("pages.tasks.get_redis")
+    def test_read_tasks_from_db_prunes_expired_index_entries(
+        self, mock_get_redis
+    ):
+        mock_redis = fakeredis.FakeRedis()
+        mock_get_redis.return_value = mock_redis
+
+        mock_redis.set("celery-task-meta-1", json.dumps(self.mock_tasks[0]))
+        index_task(mock_redis, "1", 1)
+        mock_redis.zadd(TASK_INDEX_KEY, {"2": 2})
+
+        tasks = read_tasks_from_db(settings)
+        self.assertEqual([t["task_id"] for t in tasks], ["1"])
+        self.assertEqual(mock_redis.zrange(TASK_INDEX_KEY, 0, -1), [b"1"])
+
+    @patch("pages.tasks.get_redis")
+    def test_iter_tasks_from_db_in_chunks(self, mock_get_redis):
+        mock_redis = fakeredis.FakeRedis()
+        mock_get_redis.return_value = mock_redis
+
+        for i, task in enumerate(self.mock_tasks):
+            mock_redis.set(
+                f"celery-task-meta-{task['task_id']}", json.dumps(task)
+            )
+            index_task(mock_redis, task["task_id"], i)
+        mock_redis.zadd(TASK_INDEX_KEY, {"expired": 0.5})
+
+        tasks = iter_tasks_from_db(settings, chunk_size=2)
+        self.assertEqual(next(tasks)["task_id"], "1")
+        self.assertEqual([t["task_id"] for t in tasks], ["2", "3"])
+
+        tasks = iter_tasks_from_db(settings, chunk_size=2, sort_order="desc")
+        self.assertEqual([t["task_id"] for t in tasks], ["3", "2", "1"])
+
+    @patch("pages.tasks.get_redis")
+    def test_read_tasks_from_db_in_chunks(self, mock_get_redis):
+        mock_redis = fakeredis.FakeRedis()
+        mock_get_redis.return_value = mock_redis
+
+        for i, task in enumerate(self.mock_tasks):
+            mock_redis.set(
+                f"celery-task-meta-{task['task_id']}", json.dumps(task)
+            )
+            index_task(mock_redis, task["task_id"], i)
+
+        for sort_by in ("date_done", "status"):
+            tasks = read_tasks_from_db(
+                settings, sort_by=sort_by, sort_order="asc", chunk_size=1
+            )
+            self.assertEqual(len(tasks), 3)
+
+    @patch("pages.tasks.get_redis")
+    def test_read_tasks_from_db_sort_indexes(self, mock_get_redis):
+        mock_redis = fakeredis.FakeRedis()
+        mock_get_redis.return_value = mock_redis
+
+        mock_tasks = [
+            *self.mock_tasks,
+            {"task_id": "4", "status": "SUCCESS", "result": None},
+            {"task_id": "5", "status": "SUCCESS", "result": {"x": 1}},
+        ]
+        for i, task in enumerate(mock_tasks):
+            mock_redis.set(
+                f"celery-task-meta-{task['task_id']}", json.dumps(task)
+            )
+            index_task(mock_redis, task["task_id"], i)
+
+        expected = {
+            "task_id": ["1", "2", "3", "4", "5"],
+            "status": ["3", "2", "1", "4", "5"],
+            "result": ["4", "1", "2", "3", "5"],
+            "completed": ["4", "5", "2", "1", "3"],
+        }
+        for sort_by, task_ids in expected.items():
+            tasks = read_tasks_from_db(
+                settings, sort_by=sort_by, sort_order="asc"
+            )
+            self.assertEqual([t["task_id"] for t in tasks], task_ids)
+
+            tasks = read_tasks_from_db(
+                settings, sort_by=sort_by, sort_order="desc", page_size=2
+            )
+            self.assertEqual([t["task_id"] for t in tasks], task_ids[::-1][:2])
+
+    @patch("pages.tasks.get_redis")
+    def test_filter_task_ids(self, mock_get_redis):
+        mock_redis = fakeredis.FakeRedis()
+        mock_get_redis.return_value = mock_redis
+
+        for i in range(20):
+            task = {
+                "task_id": f"{i:02d}",
+                "status": "SUCCESS" if i % 10 == 0 else "PENDING",
+                "result": f"name{i:02d}",
+                "completed": i % 2 == 0,
+            }
+            mock_redis.set(f"celery-task-meta-{i:02d}", json.dumps(task))
+            index_task(mock_redis, task["task_id"], i)
+
+        def task_ids(filters, **kwargs):
+            ids = filter_task_ids(mock_redis, filters, **kwargs)
+            return [int(task_id) for task_id in ids]
+
+        def when(timestamp):
+            return datetime.fromtimestamp(timestamp, tz=timezone.utc)
+
+        # Sorting by text and by a score index, and every filter on its own
+        # and along with others.
+        self.assertEqual(task_ids({"status": "SUCCESS"}), [10, 0])
+        self.assertEqual(
+            task_ids({"status": "SUCCESS"}, sort_by="result", count=1),
+            [10],
+        )
+        self.assertEqual(
+            task_ids({"completed": False}, sort_order="asc", count=3),
+            [1, 3, 5],
+        )
+        self.assertEqual(
+            task_ids({"completed": True}, sort_by="task_id", offset=8),
+            [2, 0],
+        )
+        self.assertEqual(
+            task_ids({"prefix": "name1", "completed": True}, sort_by="status"),
+            [10, 18, 16, 14, 12],
+        )
+        self.assertEqual(
+            task_ids({"prefix": "name0", "status": "SUCCESS"}),
+            [0],
+        )
+        self.assertEqual(
+            task_ids({"date_from": when(5), "date_to": when(8)}),
+            [7, 6, 5],
+        )
+        self.assertEqual(task_ids({"status": "FAILURE"}), [])
+
+        tasks = read_tasks_from_db(
+            settings,
+            sort_order="asc",
+            page_size=2,
+            cursor=1,
+            filters={"prefix": "name1"},
+        )
+        self.assertEqual([t["task_id"] for t in tasks], ["11", "12"])
+
+        tasks = iter_tasks_from_db(
+            settings, chunk_size=2, filters={"status": "SUCCESS"}
+        )
+        self.assertEqual([t["task_id"] for t in tasks], ["00", "10"])
+
+    def test_filter_task_ids_kept(self):
+        r = fakeredis.FakeRedis()
+
+        def index(task_id, status, done_at=None):
+            task = {"task_id": task_id, "status": status, "result": None}
+            r.set(f"celery-task-meta-{task_id}", json.dumps(task))
+            index_task(r, task_id, done_at or int(task_id))
+
+        for i in range(5):
+            index(f"{i:02d}", "SUCCESS" if i % 2 else "PENDING")
+        filters = {"status": "SUCCESS"}
+
+        self.assertEqual(filter_task_ids(r, filters), [b"03", b"01"])
+        self.assertEqual(
+            filter_task_ids(r, filters, sort_by="task_id", offset=1),
+            [b"01"],
+        )
+        keys = r.keys(f"{TASK_FILTER_KEY}:date_done:*")
+        # The matches and what they were built with
+        self.assertEqual(len(keys), 2)
+        for key in keys:
+            self.assertLessEqual(r.ttl(key), TASK_FILTER_TIMEOUT + 1)
+
+        # Tasks indexed since are looked for among themselves and added, and
+        # the task set changing doesn't call for anything more.
+        match_steps = pages.tasks._match_steps
+        with patch(
+            "pages.tasks._match_steps", wraps=match_steps
+        ) as mock_match_steps:
+            index("05", "SUCCESS")
+            index("06", "SUCCESS")
+            bump_task_set_version(r)
+            self.assertEqual(
+                filter_task_ids(r, filters), [b"06", b"05", b"03", b"01"]
+            )
+            self.assertEqual(filter_task_ids(r, filters, offset=3), [b"01"])
+            # Tasks done at the same time as the newest one they were built
+            # with are looked for again, so that one's found twice.
+            index("07", "SUCCESS", done_at=6)
+            index("08", "PENDING")
+            self.assertEqual(
+                filter_task_ids(r, filters),
+                [b"07", b"06", b"05", b"03", b"01"],
+            )
+        self.assertEqual(
+            [call.args[3] for call in mock_match_steps.call_args_list],
+            [4.0, 6.0],
+        )
+
+        # Changing a task has them worked out again.
+        with patch("pages.tasks.get_redis", return_value=r):
+            update_task_in_db(settings, "03", {"status": "FAILURE"})
+        self.assertEqual(
+            filter_task_ids(r, filters), [b"07", b"06", b"05", b"01"]
+        )
+
+        self.assertEqual(
+            filter_task_ids(r, {"status": "SUCCESS", "completed": True}), []
+        )
+        self.assertEqual(filter_task_ids(r, filters, count=0), [])
+        # Nothing but the kept matches is left behind, or just what they
+        # were built with if there are none.
+        self.assertEqual(len(r.keys(f"{TASK_FILTER_KEY}:*")), 5)
+
+    @patch("pages.tasks.get_redis")
+    def test_filter_task_ids_chunked(self, mock_get_redis):
+        r = mock_get_redis.return_value = fakeredis.FakeRedis()
+        for i in range(12):
+            task = {
+                "task_id": f"{i:02d}",
+                "status": "PENDING" if i % 3 else "SUCCESS",
+                "result": f"{'a' if i < 6 else 'b'}{i % 4}",
+                "completed": i % 2 == 0,
+            }
+            r.set(f"celery-task-meta-{i:02d}", json.dumps(task))
+            index_task(r, task["task_id"], i)
+
+        def task_ids(filters, **kwargs):
+            return [
+                int(task_id)
+                for task_id in filter_task_ids(r, filters, **kwargs)
+            ]
+
+        # Many more matches than are read or written at a time, whether the
+        # tasks with the prefix or the other matches are gone through.
+        with patch("pages.tasks.TASK_FILTER_CHUNK_SIZE", 2):
+            self.assertEqual(
+                task_ids({"prefix": "a"}, sort_by="result"),
+                [3, 2, 5, 1, 4, 0],
+            )
+            self.assertEqual(
+                task_ids({"prefix": "b", "completed": True}),
+                [10, 8, 6],
+            )
+            self.assertEqual(
+                task_ids({"prefix": "b1", "completed": False}),
+                [9],
+            )
+            self.assertEqual(
+                task_ids(
+                    {"status": "PENDING", "completed": False},
+                    sort_by="status",
+                    sort_order="asc",
+                ),
+                [1, 5, 7, 11],
+            )
+            tasks = iter_tasks_from_db(
+                settings, chunk_size=2, filters={"status": "PENDING"}
+            )
+            self.assertEqual(
+                [int(task["task_id"]) for task in tasks],
+                [1, 2, 4, 5, 7, 8, 10, 11],
+            )
+
+    @patch("pages.tasks.get_redis")
+    def test_update_task_in_db_reindexes(self, mock_get_redis):
+        mock_redis = fakeredis.FakeRedis()
+        mock_get_redis.return_value = mock_redis
+
+        for i, task in enumerate(self.mock_tasks):
+            mock_redis.set(
+                f"celery-task-meta-{task['task_id']}", json.dumps(task)
+            )
+            index_task(mock_redis, task["task_id"], i)
+
+        update_task_in_db(settings, "1", {"completed": False, "status": "X"})
+
+        for sort_by, task_ids in (
+            ("completed", ["1", "2", "3"]),
+            ("status", ["3", "2", "1"]),
+        ):
+            tasks = read_tasks_from_db(
+                settings, sort_by=sort_by, sort_order="asc"
+            )
+            self.assertEqual([t["task_id"] for t in tasks], task_ids)
+        self.assertEqual(mock_redis.zcard("celery-task-index:status"), 3)
+        self.assertEqual(
+            mock_redis.smembers(f"{TASK_STATUS_KEY_PREFIX}X"), {b"1"}
+        )
+        self.assertFalse(mock_redis.exists(f"{TASK_STATUS_KEY_PREFIX}SUCCESS"))
+
+    @patch("pages.tasks.get_redis")
+    def test_expired_tasks_leave_every_index(self, mock_get_redis):
+        mock_redis = fakeredis.FakeRedis()
+        mock_get_redis.return_value = mock_redis
+
+        for i, task in enumerate(self.mock_tasks):
+            mock_redis.set(
+                f"celery-task-meta-{task['task_id']}", json.dumps(task)
+            )
+            index_task(mock_redis, task["task_id"], i)
+        mock_redis.delete("celery-task-meta-2")
+
+        tasks = read_tasks_from_db(settings, sort_by="result")
+        self.assertEqual(len(tasks), 2)
+        for key in SORT_INDEX_KEYS.values():
+            self.assertEqual(mock_redis.zcard(key), 2)
+        self.assertFalse(mock_redis.hexists(SORT_VALUES_KEY, "2"))
+        self.assertFalse(mock_redis.exists(f"{TASK_STATUS_KEY_PREFIX}PENDING"))
+
+    @patch("pages.tasks.get_redis")
+    def test_index_finished_task(self, mock_get_redis):
+        mock_redis = fakeredis.FakeRedis()
+        mock_get_redis.return_value = mock_redis
+
+        pubsub = mock_redis.pubsub()
+        pubsub.subscribe(TASK_EVENTS_CHANNEL)
+        self.assertEqual(pubsub.get_message()["type"], "subscribe")
+
+        mock_redis.set("celery-task-meta-1", json.dumps(self.mock_tasks[0]))
+        index_finished_task(
+            sender=add_name_to_queue, task_id="1", retval="A", state="SUCCESS"
+        )
+        self.assertEqual(mock_redis.zrange(TASK_INDEX_KEY, 0, -1), [b"1"])
+        self.assertEqual(get_task_set_version(settings)[0], 1)
+
+        event = json.loads(pubsub.get_message()["data"])
+        self.assertEqual(event["type"], "finished")
+        self.assertEqual(
+            event["task"],
+            {
+                "task_id": "1",
+                "status": "SUCCESS",
+                "result": "A",
+                "date_done": ANY,
+                "completed": None,
+            },
+        )
+
+        update_tasks_in_db(settings, [("1", {"completed": False})])
+        event = json.loads(pubsub.get_message()["data"])
+        self.assertEqual(
+            event,
+            {
+                "type": "updated",
+                "tasks": [{"task_id": "1", "completed": False}],
+            },
+        )
+
+    @patch("pages.tasks.get_redis")
+    def test_get_task_set_version(self, mock_get_redis):
+        mock_redis = fakeredis.FakeRedis()
+        mock_get_redis.return_value = mock_redis
+
+        self.assertEqual(get_task_set_version(settings), (0, None))
+
+        mock_redis.set("celery-task-meta-1", json.dumps(self.mock_tasks[0]))
+        update_task_in_db(settings, "1", {"completed": False})
+        version, modified = get_task_set_version(settings)
+        self.assertEqual(version, 1)
+        self.assertIsInstance(modified, float)
+
+        # Pruning an expired task changes the task set too
+        mock_redis.zadd(TASK_INDEX_KEY, {"2": 2})
+        read_tasks_from_db(settings)
+        self.assertEqual(get_task_set_version(settings)[0], 2)
+
+    @patch("pages.tasks.get_redis")
+    def test_archive_tasks(self, mock_get_redis):
+        mock_redis = fakeredis.FakeRedis()
+        mock_get_redis.return_value = mock_redis
+
+        for task, serializer in zip(
+            self.mock_tasks, ["json", "msgpack", "msgpack-zlib"]
+        ):
+            mock_redis.set(
+                f"celery-task-meta-{task['task_id']}",
+                encode_result(task, serializer),
+            )
+            index_finished_task(
+                sender=add_name_to_queue, task_id=task["task_id"]
+            )
+        index_finished_task(sender=add_name_to_queue, task_id="expired")
+        version, _ = get_task_set_version(settings)
+
+        self.assertEqual(archive_tasks(batch_size=2), 3)
+        self.assertEqual(mock_redis.scard(TASK_ARCHIVE_KEY), 0)
+        self.assertEqual(get_task_set_version(settings)[0], version + 1)
+        self.assertEqual(
+            [
+                record.as_task()
+                for record in TaskRecord.objects.order_by("task_id")
+            ],
+            [
+                {**task, "date_done": f"{task['date_done']}+00:00"}
+                for task in self.mock_tasks
+            ],
+        )
+
+        # Changed tasks get archived again
+        update_task_in_db(settings, "2", {"completed": True})
+        self.assertEqual(archive_tasks(), 1)
+        self.assertTrue(TaskRecord.objects.get(task_id="2").completed)
+        self.assertEqual(archive_tasks(), 0)
+
+    @patch("pages.tasks.get_redis")
+    def test_archive_tasks_sets_failing_tasks_aside(self, mock_get_redis):
+        mock_redis = mock_get_redis.return_value = fakeredis.FakeRedis()
+        for task in self.mock_tasks:
+            mock_redis.set(
+                f"celery-task-meta-{task['task_id']}", json.dumps(task)
+            )
+            mock_redis.sadd(TASK_ARCHIVE_KEY, task["task_id"])
+            index_task(mock_redis, task["task_id"], int(task["task_id"]))
+        mock_redis.set("celery-task-meta-4", b"{not json")
+        mock_redis.sadd(TASK_ARCHIVE_KEY, "4")
+
+        bulk_create = TaskRecord.objects.bulk_create
+
+        def fail_on_2(records, **kwargs):
+            if any(record.task_id == "2" for record in records):
+                raise DataError("value too long")
+            return bulk_create(records, **kwargs)
+
+        with (
+            patch.object(
+                TaskRecord.objects, "bulk_create", side_effect=fail_on_2
+            ),
+            self.assertLogs("pages.tasks", "ERROR"),
+        ):
+            self.assertEqual(archive_tasks(), 2)
+
+        self.assertEqual(
+            sorted(TaskRecord.objects.values_list("task_id", flat=True)),
+            ["1", "3"],
+        )
+        self.assertEqual(mock_redis.scard(TASK_ARCHIVE_KEY), 0)
+        self.assertEqual(
+            mock_redis.smembers(TASK_ARCHIVE_FAILED_KEY), {b"2", b"4"}
+        )
+
+        # Trimmed like archived tasks
+        self.assertEqual(trim_tasks(max_count=1)["max_count"], 2)
+        self.assertEqual(mock_redis.smembers(TASK_ARCHIVE_FAILED_KEY), {b"4"})
+
+    @patch("pages.tasks._database_is_up", return_value=False)
+    @patch("pages.tasks.get_redis")
+    def test_archive_tasks_database_down(self, mock_get_redis, _):
+        mock_redis = mock_get_redis.return_value = fakeredis.FakeRedis()
+        mock_redis.set("celery-task-meta-1", json.dumps(self.mock_tasks[0]))
+        mock_redis.sadd(TASK_ARCHIVE_KEY, "1")
+
+        with (
+            patch.object(
+                TaskRecord.objects,
+                "bulk_create",
+                side_effect=OperationalError("connection refused"),
+            ),
+            self.assertRaises(OperationalError),
+        ):
+            archive_tasks()
+
+        self.assertEqual(mock_redis.smembers(TASK_ARCHIVE_KEY), {b"1"})
+        self.assertEqual(mock_redis.scard(TASK_ARCHIVE_FAILED_KEY), 0)
+
+    @patch("pages.tasks.get_redis")
+    def test_trim_tasks(self, mock_get_redis):
+        mock_redis = mock_get_redis.return_value = fakeredis.FakeRedis()
+        day = 60 * 60 * 24
+        now = time.time()
+
+        payloads = {}
+        for i, done_at in enumerate(
+            [now - 3 * day, now - 2 * day, now - 2 * day, now, now]
+        ):
+            payloads[str(i)] = json.dumps({"task_id": str(i)})
+            mock_redis.set(f"celery-task-meta-{i}", payloads[str(i)])
+            index_task(mock_redis, str(i), done_at)
+        mock_redis.delete("celery-task-meta-0")
+        mock_redis.sadd(TASK_ARCHIVE_KEY, "3")
+        for task_id in ("1", "3"):
+            mock_redis.hset(f"celery-task-changes-{task_id}", "completed", 1)
+        version, _ = get_task_set_version(settings)
+
+        trimmed = trim_tasks(max_age=day, max_count=1, batch_size=1)
+
+        self.assertEqual(
+            trimmed,
+            {
+                "expired": 1,
+                "max_age": 2,
+                "max_count": 1,
+                "bytes": sum(len(payloads[i]) for i in ("1", "2", "4")),
+            },
+        )
+        # 3 hasn't been archived yet, so the newer 4 goes for max_count
+        self.assertEqual(mock_redis.zrange(TASK_INDEX_KEY, 0, -1), [b"3"])
+        self.assertEqual(mock_redis.hkeys(SORT_VALUES_KEY), [b"3"])
+        self.assertEqual(
+            mock_redis.keys("celery-task-meta-*"), [b"celery-task-meta-3"]
+        )
+        self.assertEqual(
+            mock_redis.keys("celery-task-changes-*"),
+            [b"celery-task-changes-3"],
+        )
+        self.assertEqual(get_task_set_version(settings)[0], version + 1)
+
+        # Nothing to trim leaves the task set alone
+        version, _ = get_task_set_version(settings)
+        self.assertEqual(
+            trim_tasks(max_age=day, max_count=1),
+            {"expired": 0, "max_age": 0, "max_count": 0, "bytes": 0},
+        )
+        self.assertEqual(get_task_set_version(settings)[0], version)
+
+    @patch("pages.tasks.get_redis")
+    def test_unindex_expired_tasks(self, mock_get_redis):
+        mock_redis = mock_get_redis.return_value = fakeredis.FakeRedis()
+        for i in range(3):
+            mock_redis.set(f"celery-task-meta-{i}", json.dumps({}))
+            index_task(mock_redis, str(i), i)
+        version, _ = get_task_set_version(settings)
+
+        self.assertEqual(unindex_expired_tasks(), 0)
+        self.assertEqual(get_task_set_version(settings)[0], version)
+
+        mock_redis.delete("celery-task-meta-0", "celery-task-meta-1")
+        self.assertEqual(unindex_expired_tasks(batch_size=1), 2)
+        self.assertEqual(mock_redis.zrange(TASK_INDEX_KEY, 0, -1), [b"2"])
+        self.assertEqual(get_task_set_version(settings)[0], version + 1)
+
+    @patch("pages.tasks.get_redis")
+    def test_trim_tasks_max_count_skips_unarchived(self, mock_get_redis):
+        mock_redis = mock_get_redis.return_value = fakeredis.FakeRedis()
+        for i in range(10):
+            mock_redis.set(f"celery-task-meta-{i}", json.dumps({}))
+            index_task(mock_redis, str(i), i)
+        mock_redis.sadd(TASK_ARCHIVE_KEY, "0", "1", "2")
+
+        self.assertEqual(trim_tasks(max_count=5, batch_size=2)["max_count"], 5)
+        self.assertEqual(
+            mock_redis.zrange(TASK_INDEX_KEY, 0, -1),
+            [b"0", b"1", b"2", b"8", b"9"],
+        )
+
+    def test_read_tasks_from_archive(self):
+        for task in [*self.mock_tasks, {"task_id": "4"}]:
+            TaskRecord.from_task(task).save()
+
+        tasks = read_tasks_from_archive(settings)
+        self.assertEqual([t["task_id"] for t in tasks], ["2", "3", "1", "4"])
+
+        tasks = read_tasks_from_archive(
+            settings, sort_by="date_done", sort_order="asc", page_size=2
+        )
+        self.assertEqual([t["task_id"] for t in tasks], ["4", "1"])
+
+        tasks = read_tasks_from_archive(
+            settings, sort_by="completed", page_size=2, cursor=1
+        )
+        self.assertEqual([t["task_id"] for t in tasks], ["1", "2"])
+
+    def test_read_tasks_from_archive_filters(self):
+        for task in [*self.mock_tasks, {"task_id": "4", "result": {"x": 1}}]:
+            TaskRecord.from_task(task).save()
+
+        def task_ids(**filters):
+            tasks = read_tasks_from_archive(settings, filters=filters)
+            return [t["task_id"] for t in tasks]
+
+        self.assertEqual(task_ids(completed=True), ["3", "1"])
+        self.assertEqual(task_ids(status="PENDING"), ["2"])
+        self.assertEqual(task_ids(prefix="{"), ["4"])
+
+        # Only the start of a result is indexed
+        TaskRecord.from_task({"task_id": "5", "result": "a" * 300}).save()
+        TaskRecord.from_task({"task_id": "6", "result": "a" * 250}).save()
+        self.assertEqual(task_ids(prefix="a" * 260), ["5"])
+        self.assertEqual(
+            len(TaskRecord.objects.get(task_id="5").result_prefix), 200
+        )
+        self.assertEqual(
+            task_ids(
+                date_from=datetime(2023, 1, 2, tzinfo=timezone.utc),
+                date_to=datetime(2023, 1, 3, 12, tzinfo=timezone.utc),
+            ),
+            ["3"],
+        )
+
+    async def test_aread_tasks_from_archive(self):
+        for task in self.mock_tasks:
+            await TaskRecord.from_task(task).asave()
+
+        tasks = await aread_tasks_from_archive(
+            settings, sort_by="status", sort_order="asc", page_size=2
+        )
+        self.assertEqual([t["task_id"] for t in tasks], ["3", "2"])
+
+        tasks = [
+            task
+            async for task in aiter_tasks_from_archive(
+                settings, chunk_size=2, sort_by="result"
+            )
+        ]
+        self.assertEqual([t["task_id"] for t in tasks], ["1", "2", "3"])
+
+    @override_settings(TASK_LIST_SOURCE="postgres")
+    @patch("pages.tasks.get_redis")
+    def test_update_tasks_in_db_archived(self, mock_get_redis):
+        mock_redis = fakeredis.FakeRedis()
+        mock_get_redis.return_value = mock_redis
+        TaskRecord.from_task(self.mock_tasks[0]).save()
+        mock_redis.set("celery-task-meta-2", json.dumps(self.mock_tasks[1]))
+
+        # The first task's result already expired from Redis
+        updated = update_tasks_in_db(
+            settings,
+            [
+                ("1", {"completed": False}),
+                ("2", {"completed": True}),
+                ("3", {"completed": True}),
+            ],
+        )
+
+        self.assertEqual(updated, [True, True, False])
+        self.assertFalse(TaskRecord.objects.get(task_id="1").completed)
+        # Only the task still in Redis has anything to copy to the archive.
+        self.assertEqual(mock_redis.smembers(TASK_ARCHIVE_KEY), {b"2"})
+        self.assertEqual(get_task_set_version(settings)[0], 1)
+
+    @patch("pages.tasks.get_redis")
+    def test_update_tasks_in_db_missing(self, mock_get_redis):
+        mock_redis = fakeredis.FakeRedis()
+        mock_get_redis.return_value = mock_redis
+        pubsub = mock_redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(TASK_EVENTS_CHANNEL)
+
+        updated = update_tasks_in_db(settings, [("1", {"completed": True})])
+
+        self.assertEqual(updated, [False])
+        self.assertEqual(mock_redis.scard(TASK_ARCHIVE_KEY), 0)
+        self.assertEqual(get_task_set_version(settings)[0], 0)
+        self.assertIsNone(pubsub.get_message(timeout=0.01))
+
+    @patch("pages.management.commands.index_tasks.get_redis")
+    def test_index_tasks_command(self, mock_get_redis):
+        mock_redis = fakeredis.FakeRedis()
+        mock_get_redis.return_value = mock_redis
+
+        for task in self.mock_tasks:
+            mock_redis.set(
+                f"celery-task-meta-{task['task_id']}", json.dumps(task)
+            )
+        call_command("index_tasks", stdout=StringIO())
+
+        self.assertEqual(
+            mock_redis.zrange(TASK_INDEX_KEY, 0, -1), [b"1", b"3", b"2"]
+        )
+
+    def test_benchmark_seed_matches_index_task(self):
+        seeded = fakeredis.FakeRedis()
+        task_ids = seed_tasks(seeded, 30, random.Random(0), batch_size=7)
+        self.assertEqual(len(task_ids), 30)
+
+        # Indexing the same results with the script ends up the same.
+        indexed = fakeredis.FakeRedis()
+        for task_id in task_ids:
+            key = f"celery-task-meta-{task_id}"
+            indexed.set(key, seeded.get(key))
+            index_task(
+                indexed, task_id, seeded.zscore(TASK_INDEX_KEY, task_id)
+            )
+
+        for key in SORT_INDEX_KEYS.values():
+            self.assertEqual(
+                seeded.zrange(key, 0, -1, withscores=True),
+                indexed.zrange(key, 0, -1, withscores=True),
+            )
+        for status in ("SUCCESS", "FAILURE", "PENDING"):
+            key = f"{TASK_STATUS_KEY_PREFIX}{status}"
+            self.assertEqual(seeded.smembers(key), indexed.smembers(key))
+        self.assertEqual(
+            {
+                task_id: json.loads(values)
+                for task_id, values in seeded.hgetall(SORT_VALUES_KEY).items()
+            },
+            {
+                task_id: json.loads(values)
+                for task_id, values in indexed.hgetall(SORT_VALUES_KEY).items()
+            },
+        )
+
+    @override_settings(TASK_CACHE_SIZE=10)
+    @patch("pages.task_cache.task_cache", None)
+    @patch("pages.task_cache.TaskCache._start")
+    def test_benchmark_tasks_command(self, mock_start):
+        stdout = StringIO()
+        call_command(
+            "benchmark_tasks",
+            sizes="20,40",
+            repeat=2,
+            updates=5,
+            stdout=stdout,
+            stderr=StringIO(),
+        )
+
+        # Every read went to Redis, even with the cache turned on.
+        mock_start.assert_not_called()
+
+        report = json.loads(stdout.getvalue())
+        self.assertEqual([r["tasks"] for r in report["results"]], [20, 40])
+        result = report["results"][0]
+        self.assertEqual(
+            set(result["read_tasks_from_db"]), set(SORT_INDEX_KEYS)
+        )
+        self.assertIn("peak_memory_bytes", result["task_list"]["status"])
+        self.assertEqual(result["update_task_in_db"]["updates"], 5)
+
+    @patch("pages.tasks.get_redis")
+    def test_update_task_in_db(self, mock_get_redis):
         mock_redis = fakeredis.FakeRedis()
-        mock_from_url.return_value = mock_redis
+        mock_get_redis.return_value = mock_redis
 
         task_id = self.mock_tasks[0]["task_id"]
         mock_redis.set(
-            f"celery-task-meta-{task_id}", json.dumps(self.mock_tasks[0])
+            f"celery-task-meta-{task_id}",
+            json.dumps({**self.mock_tasks[0], "children": []}),
+            ex=3600,
         )
         data_to_update = {"completed": not self.mock_tasks[0]["completed"]}
-        update_task_in_db(settings, task_id, data_to_update)
+        self.assertTrue(update_task_in_db(settings, task_id, data_to_update))
 
         updated_task = self.mock_tasks[0].copy()
         updated_task.update(data_to_update)
+        updated_task["children"] = []
+
+        self.assertEqual(self.stored_task(mock_redis, task_id), updated_task)
+        # The change expires along with the result.
+        self.assertGreater(
+            mock_redis.ttl(f"celery-task-changes-{task_id}"), 3590
+        )
+
+    def stored_task(self, r, task_id):
+        with patch("pages.tasks.get_redis", return_value=r):
+            tasks = {task["task_id"]: task for task in scan_tasks(settings)}
+        return tasks[task_id]
+
+    @patch("pages.tasks.get_redis")
+    def test_update_task_in_db_keeps_values(self, mock_get_redis):
+        mock_redis = fakeredis.FakeRedis()
+        mock_get_redis.return_value = mock_redis
+
+        task = {
+            "task_id": "1",
+            "status": "SUCCESS",
+            "result": {
+                "big": 2**60 + 1,
+                "float": 0.1 + 0.2,
+                "nested": {"empty": [], "object": {}},
+                "text": "__empty_list__",
+            },
+            "children": [],
+        }
+        payload = json.dumps(task)
+        mock_redis.set("celery-task-meta-1", payload)
+
+        self.assertEqual(
+            update_tasks_in_db(
+                settings,
+                [("1", {"completed": True}), ("1", {"status": "RETRY"})],
+            ),
+            [True, True],
+        )
+        self.assertEqual(
+            self.stored_task(mock_redis, "1"),
+            {**task, "completed": True, "status": "RETRY"},
+        )
+        # The result itself is left as it was.
+        self.assertEqual(
+            mock_redis.get("celery-task-meta-1"), payload.encode()
+        )
+
+    @patch("pages.tasks.get_redis")
+    def test_update_tasks_in_db(self, mock_get_redis):
+        mock_redis = fakeredis.FakeRedis()
+        mock_get_redis.return_value = mock_redis
+
+        for task in self.mock_tasks[:2]:
+            mock_redis.set(
+                f"celery-task-meta-{task['task_id']}", json.dumps(task)
+            )
+        updated = update_tasks_in_db(
+            settings,
+            [
+                ("1", {"completed": False}),
+                ("2", {"completed": True}),
+                ("missing", {"completed": True}),
+            ],
+        )
+
+        self.assertEqual(updated, [True, True, False])
+        for task_id, completed in (("1", False), ("2", True)):
+            task = self.stored_task(mock_redis, task_id)
+            self.assertEqual(task["completed"], completed)
+        self.assertFalse(mock_redis.exists("celery-task-changes-missing"))
+
+    def store_tasks(self, r, serializers):
+        for i, (task, serializer) in enumerate(
+            zip(self.mock_tasks, serializers)
+        ):
+            r.set(
+                f"celery-task-meta-{task['task_id']}",
+                encode_result(task, serializer),
+            )
+            index_task(r, task["task_id"], i, task)
+
+    @patch("pages.tasks.get_redis")
+    def test_read_tasks_from_db_any_serializer(self, mock_get_redis):
+        mock_redis = fakeredis.FakeRedis()
+        mock_get_redis.return_value = mock_redis
+        self.store_tasks(mock_redis, ["json", "msgpack", "msgpack-zlib"])
+
+        tasks = read_tasks_from_db(settings, sort_by="result")
+        self.assertEqual(tasks, self.mock_tasks[::-1])
+
+    @patch("pages.tasks.get_redis")
+    def test_index_finished_task_skips_housekeeping(self, mock_get_redis):
+        mock_redis = fakeredis.FakeRedis()
+        mock_get_redis.return_value = mock_redis
+
+        for task in (add_names_to_queue, archive_tasks, trim_tasks):
+            mock_redis.set(f"celery-task-meta-{task.name}", json.dumps({}))
+            index_finished_task(sender=task, task_id=task.name)
+            self.assertTrue(task.ignore_result)
+
+        self.assertEqual(mock_redis.zcard(TASK_INDEX_KEY), 0)
+        self.assertEqual(mock_redis.scard(TASK_ARCHIVE_KEY), 0)
+        self.assertEqual(get_task_set_version(settings)[0], 0)
+
+    @patch("pages.tasks.get_redis")
+    def test_index_finished_task_msgpack(self, mock_get_redis):
+        mock_redis = fakeredis.FakeRedis()
+        mock_get_redis.return_value = mock_redis
+        mock_redis.set(
+            "celery-task-meta-2",
+            encode_result(self.mock_tasks[1], "msgpack-zlib"),
+        )
+
+        index_finished_task(sender=add_name_to_queue, task_id="2")
+        self.assertIsNotNone(mock_redis.zscore(TASK_INDEX_KEY, "2"))
+        self.assertEqual(
+            mock_redis.zrange(SORT_INDEX_KEYS["status"], 0, -1),
+            [b"PENDING\x002"],
+        )
+
+    @patch("pages.tasks.get_redis")
+    def test_update_tasks_in_db_msgpack(self, mock_get_redis):
+        mock_redis = fakeredis.FakeRedis()
+        mock_get_redis.return_value = mock_redis
+        self.store_tasks(mock_redis, ["json", "msgpack", "msgpack-zlib"])
+        mock_redis.expire("celery-task-meta-3", 100)
+
+        updated = update_tasks_in_db(
+            settings,
+            [
+                ("1", {"completed": False}),
+                ("3", {"completed": False}),
+                ("missing", {"completed": True}),
+            ],
+        )
+        self.assertEqual(updated, [True, True, False])
+
+        self.assertFalse(self.stored_task(mock_redis, "3")["completed"])
+        self.assertEqual(mock_redis.ttl("celery-task-changes-3"), 100)
+        self.assertEqual(
+            mock_redis.zrange(SORT_INDEX_KEYS["completed"], 0, -1),
+            [b"1", b"2", b"3"],
+        )
+
+    @patch("pages.tasks.get_async_redis")
+    async def test_aupdate_tasks_in_db_msgpack(self, mock_get_async_redis):
+        server = fakeredis.FakeServer()
+        mock_redis = fakeredis.FakeRedis(server=server)
+        mock_get_async_redis.return_value = fakeredis.FakeAsyncRedis(
+            server=server
+        )
+        self.store_tasks(mock_redis, ["msgpack", "json"])
+
+        updated = await aupdate_tasks_in_db(
+            settings,
+            [("1", {"completed": False}), ("2", {"completed": True})],
+        )
+        self.assertEqual(updated, [True, True])
+
+        self.assertFalse(self.stored_task(mock_redis, "1")["completed"])
+        self.assertEqual(
+            mock_redis.zscore(SORT_INDEX_KEYS["completed"], "1"), 1
+        )
+
+    @patch("pages.tasks.get_async_redis")
+    async def test_aread_tasks_from_db(self, mock_get_async_redis):
+        server = fakeredis.FakeServer()
+        mock_redis = fakeredis.FakeRedis(server=server)
+        mock_get_async_redis.return_value = fakeredis.FakeAsyncRedis(
+            server=server
+        )
+
+        for i, task in enumerate(self.mock_tasks):
+            mock_redis.set(
+                f"celery-task-meta-{task['task_id']}", json.dumps(task)
+            )
+            index_task(mock_redis, task["task_id"], i)
+        mock_redis.zadd(TASK_INDEX_KEY, {"expired": 5})
+
+        tasks = await aread_tasks_from_db(settings, page_size=2)
+        self.assertEqual([t["task_id"] for t in tasks], ["3"])
+        self.assertEqual(mock_redis.zcard(TASK_INDEX_KEY), 3)
+        self.assertEqual(await aget_task_set_version(settings), (1, ANY))
+
+        tasks = [
+            task
+            async for task in aiter_tasks_from_db(
+                settings, chunk_size=2, sort_by="status"
+            )
+        ]
+        self.assertEqual([t["task_id"] for t in tasks], ["3", "2", "1"])
+
+        tasks = [
+            task
+            async for task in aiter_tasks_from_db(
+                settings,
+                chunk_size=1,
+                sort_by="result",
+                filters={"completed": True, "prefix": "C"},
+            )
+        ]
+        self.assertEqual([t["task_id"] for t in tasks], ["3"])
+
+    @patch("pages.tasks.get_async_redis")
+    async def test_aupdate_tasks_in_db(self, mock_get_async_redis):
+        server = fakeredis.FakeServer()
+        mock_redis = fakeredis.FakeRedis(server=server)
+        mock_get_async_redis.return_value = fakeredis.FakeAsyncRedis(
+            server=server
+        )
+
+        mock_redis.set("celery-task-meta-1", json.dumps(self.mock_tasks[0]))
+        index_task(mock_redis, "1", 1)
 
-        from_redis_task = json.loads(
-            mock_redis.get(f"celery-task-meta-{task_id}")
+        updated = await aupdate_tasks_in_db(
+            settings,
+            [("1", {"completed": False}), ("missing", {"completed": True})],
+        )
+        self.assertEqual(updated, [True, False])
+        self.assertFalse(await aupdate_task_in_db(settings, "2", {}))
+
+        self.assertFalse(self.stored_task(mock_redis, "1")["completed"])
+        self.assertEqual(
+            mock_redis.zscore(SORT_INDEX_KEYS["completed"], "1"), 1
+        )
+
+    @patch("pages.tasks.get_redis")
+    def test_update_task_in_db_missing_task(self, mock_get_redis):
+        mock_redis = fakeredis.FakeRedis()
+        mock_get_redis.return_value = mock_redis
+
+        self.assertFalse(
+            update_task_in_db(settings, "missing", {"completed": True})
+        )
+        self.assertFalse(mock_redis.exists("celery-task-meta-missing"))
+
+    @patch("pages.tasks.get_redis")
+    def test_read_tasks_from_db_page_by_date_done(self, mock_get_redis):
+        mock_redis = fakeredis.FakeRedis()
+        mock_get_redis.return_value = mock_redis
+
+        for i, task in enumerate(self.mock_tasks):
+            mock_redis.set(
+                f"celery-task-meta-{task['task_id']}", json.dumps(task)
+            )
+            index_task(mock_redis, task["task_id"], i)
+
+        tasks = read_tasks_from_db(
+            settings, sort_order="desc", page_size=2, cursor=1
+        )
+        self.assertEqual([t["task_id"] for t in tasks], ["2", "1"])
+
+    def test_read_tasks_from_db_page_top_k(self):
+        tasks = read_tasks_from_db(
+            settings,
+            sort_by="result",
+            sort_order="desc",
+            tasks=self.mock_tasks,
+            page_size=1,
+            cursor=1,
         )
-        self.assertEqual(from_redis_task, updated_task)
+        self.assertEqual([t["task_id"] for t in tasks], ["2"])
 
     def test_read_tasks_from_db_sorting_with_none(self):
         mock_tasks = [
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path
 
 from pages import views
@@ -5,9 +6,16 @@ from pages import views
 urlpatterns = [
     path("", views.home, name="home"),
     path("tasks/", views.task_list, name="tasks"),
+    path("tasks/export/", views.task_export, name="task_export"),
+    path("api/tasks/", views.task_list_json, name="task_list_json"),
     path(
         "tasks/update-status/",
         views.update_task_status,
         name="update_task_status",
     ),
 ]
+
+if settings.WEB_ASGI:
+    urlpatterns.append(
+        path("tasks/events/", views.task_events, name="task_events")
+    )
@@ -1,39 +1,159 @@
+import asyncio
 import json
 import os
+from datetime import date, datetime, time, timedelta, timezone
+from urllib.parse import urlencode
 
+import orjson
+from asgiref.sync import sync_to_async
+from celery import states
 from django import get_version
 from django.conf import settings
-from django.http import JsonResponse
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
-from django.views.decorators.http import require_POST
+from django.template.loader import get_template, render_to_string
+from django.views.decorators.http import condition, require_POST
 
-from .tasks import add_name_to_queue, read_tasks_from_db, update_task_in_db
+from .batching import name_batcher
+from .events import subscribe_task_events
+from .export import EXPORT_FORMATS, aexport_tasks, export_tasks
+from .tasks import (
+    aget_task_set_version,
+    aiter_tasks_from_archive,
+    aiter_tasks_from_db,
+    aread_tasks_from_archive,
+    aread_tasks_from_db,
+    ascan_tasks,
+    aupdate_tasks_in_db,
+    get_task_set_version,
+    iter_tasks_from_archive,
+    iter_tasks_from_db,
+    read_tasks_from_archive,
+    read_tasks_from_db,
+    scan_tasks,
+    update_tasks_in_db,
+)
+
+# Names end up as task results, which are sorted and looked up by their
+# text, so they're kept to a sensible length.
+NAME_MAX_LENGTH = 200
 
 
 def home(request):
+    context = {
+        "debug": settings.DEBUG,
+        "django_ver": get_version(),
+        "python_ver": os.environ["PYTHON_VERSION"],
+        "name_max_length": NAME_MAX_LENGTH,
+    }
+
     if request.method == "POST":
         name: str = request.POST.get("name")
         if not name:
             name = "Anonymous"
-        add_name_to_queue.delay(name)
-        context = {
-            "message": f"Hello {name}, your name has been added to the queue!",
-            "debug": settings.DEBUG,
-            "django_ver": get_version(),
-            "python_ver": os.environ["PYTHON_VERSION"],
-        }
-        return render(request, "pages/home.html", context)
+
+        if len(name) > NAME_MAX_LENGTH:
+            context["error"] = (
+                f"Names can't be longer than {NAME_MAX_LENGTH} characters."
+            )
+            return render(request, "pages/home.html", context, status=400)
+
+        name_batcher.add(name)
+        context["message"] = (
+            f"Hello {name}, your name has been added to the queue!"
+        )
+
+    return render(request, "pages/home.html", context)
+
+
+# The views that talk to Redis on every request are async so a worker can
+# serve other requests while it waits on a slow Redis.
+async def task_list(request):
+    sort_by, sort_order = _get_sort(request)
+    filters, filter_query = _get_filters(request)
+
+    if request.GET.get("stream"):
+        return _stream_task_list(
+            request, sort_by, sort_order, filters, filter_query
+        )
+
+    read_task_page = (
+        _aread_task_page
+        if _serves_async(request)
+        else sync_to_async(_read_task_page)
+    )
+    tasks, page_size, cursor, has_next = await read_task_page(
+        request, sort_by, sort_order, filters, filter_query
+    )
 
     context = {
-        "debug": settings.DEBUG,
-        "django_ver": get_version(),
-        "python_ver": os.environ["PYTHON_VERSION"],
+        "tasks": tasks,
+        "sort_by": sort_by,
+        "sort_order": sort_order,
+        "page_size": page_size,
+        "filters": filter_query,
+        "statuses": sorted(states.ALL_STATES),
+        "live": settings.WEB_ASGI,
+        "keep_query": urlencode({"page_size": page_size, **filter_query}),
+        "prev_cursor": max(cursor - page_size, 0) if cursor else None,
+        "next_cursor": cursor + page_size if has_next else None,
     }
 
-    return render(request, "pages/home.html", context)
+    return render(request, "pages/tasks.html", context)
+
+
+def _task_set_version(request):
+    # Both validators come from a single read of the version.
+    if not hasattr(request, "task_set_version"):
+        request.task_set_version = get_task_set_version(settings)
+
+    return request.task_set_version
+
+
+async def _atask_set_version(request):
+    if not hasattr(request, "task_set_version"):
+        request.task_set_version = await aget_task_set_version(settings)
 
+    return request.task_set_version
 
-def task_list(request):
+
+def _task_set_etag(request):
+    version, _ = _task_set_version(request)
+    return f"tasks-{version}"
+
+
+def _task_set_last_modified(request):
+    _, modified = _task_set_version(request)
+    if modified is not None:
+        return datetime.fromtimestamp(modified, tz=timezone.utc)
+
+
+# Clients that send back the validators they got get a 304 as long as no task
+# has changed, without a single task being read.
+@condition(
+    etag_func=_task_set_etag, last_modified_func=_task_set_last_modified
+)
+def task_list_json(request):
+    sort_by, sort_order = _get_sort(request)
+    filters, filter_query = _get_filters(request)
+    tasks, page_size, cursor, has_next = _read_task_page(
+        request, sort_by, sort_order, filters, filter_query
+    )
+
+    data = {
+        "tasks": tasks,
+        "sort_by": sort_by,
+        "sort_order": sort_order,
+        "page_size": page_size,
+        "next_cursor": cursor + page_size if has_next else None,
+    }
+
+    return HttpResponse(orjson.dumps(data), content_type="application/json")
+
+
+def _get_sort(request):
     sort_by = request.GET.get("sort_by", "date_done")
     sort_order = request.GET.get("sort_order", "desc")
 
@@ -48,33 +168,305 @@ def task_list(request):
     if sort_by not in valid_sort_fields:
         sort_by = "date_done"  # Default to a safe value
 
-    tasks = read_tasks_from_db(
-        settings, sort_by=sort_by, sort_order=sort_order
+    return sort_by, sort_order
+
+
+def _get_filters(request):
+    """
+    Return the task filters in the query string (see pages.tasks.TASK_FILTERS)
+    along with the query parameters they came from. Invalid values are
+    ignored, like invalid sort fields.
+    """
+    query = {}
+    filters = {}
+
+    for name in ("status", "prefix"):
+        if value := request.GET.get(name):
+            query[name] = filters[name] = value
+
+    completed = request.GET.get("completed")
+    if completed in ("true", "false"):
+        query["completed"] = completed
+        filters["completed"] = completed == "true"
+
+    for name in ("date_from", "date_to"):
+        value = request.GET.get(name)
+        if when := _parse_date(value, until=name == "date_to"):
+            query[name] = value
+            filters[name] = when
+
+    return filters, query
+
+
+def _parse_date(value, until=False):
+    """
+    Parse an ISO 8601 date or datetime, in UTC unless it says otherwise. A
+    plain date means the start of that day, or the end of it with until.
+    """
+    if not value:
+        return None
+
+    try:
+        day = date.fromisoformat(value)
+    except ValueError:
+        pass
+    else:
+        if until:
+            day += timedelta(days=1)
+        return datetime.combine(day, time(), tzinfo=timezone.utc)
+
+    try:
+        when = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+    return when if when.tzinfo else when.replace(tzinfo=timezone.utc)
+
+
+def _get_page(request):
+    page_size = _get_int(request, "page_size", settings.TASKS_PAGE_SIZE)
+    page_size = min(max(page_size, 1), settings.TASKS_MAX_PAGE_SIZE)
+    cursor = max(_get_int(request, "cursor", 0), 0)
+
+    return page_size, cursor
+
+
+def _task_page_cache_key(
+    version, sort_by, sort_order, page_size, cursor, filter_query
+):
+    # Pages are cached under the current task set version, which changes
+    # whenever a task does, so a cached page can never be out of date.
+    return (
+        f"tasks:{settings.TASK_LIST_SOURCE}:{version}:"
+        f"{sort_by}:{sort_order}:{page_size}:{cursor}:"
+        f"{urlencode(sorted(filter_query.items()))}"
+    )
+
+
+def _archived():
+    return settings.TASK_LIST_SOURCE == "postgres"
+
+
+def _read_task_page(request, sort_by, sort_order, filters, filter_query):
+    page_size, cursor = _get_page(request)
+    version, _ = _task_set_version(request)
+    cache_key = _task_page_cache_key(
+        version, sort_by, sort_order, page_size, cursor, filter_query
+    )
+
+    tasks = cache.get(cache_key)
+    if tasks is None:
+        read_tasks = (
+            read_tasks_from_archive if _archived() else read_tasks_from_db
+        )
+        # Ask for one extra task so we know whether there's a next page.
+        tasks = read_tasks(
+            settings,
+            sort_by=sort_by,
+            sort_order=sort_order,
+            page_size=page_size + 1,
+            cursor=cursor,
+            filters=filters,
+        )
+        cache.set(cache_key, tasks, settings.TASKS_CACHE_TIMEOUT)
+
+    return tasks[:page_size], page_size, cursor, len(tasks) > page_size
+
+
+async def _aread_task_page(
+    request, sort_by, sort_order, filters, filter_query
+):
+    page_size, cursor = _get_page(request)
+    version, _ = await _atask_set_version(request)
+    cache_key = _task_page_cache_key(
+        version, sort_by, sort_order, page_size, cursor, filter_query
+    )
+
+    tasks = await cache.aget(cache_key)
+    if tasks is None:
+        aread_tasks = (
+            aread_tasks_from_archive if _archived() else aread_tasks_from_db
+        )
+        tasks = await aread_tasks(
+            settings,
+            sort_by=sort_by,
+            sort_order=sort_order,
+            page_size=page_size + 1,
+            cursor=cursor,
+            filters=filters,
+        )
+        await cache.aset(cache_key, tasks, settings.TASKS_CACHE_TIMEOUT)
+
+    return tasks[:page_size], page_size, cursor, len(tasks) > page_size
+
+
+# Stands in for the table rows while rendering the rest of the page so it can
+# be split into the parts that go before and after them.
+ROWS_MARKER = "__task_rows__"
+
+
+def _serves_async(request):
+    # A WSGI server can only iterate a response synchronously and Django
+    # reads the whole of an async one into memory first to hand it over, so
+    # streams stay sync unless an ASGI worker serves them. Under WSGI, every
+    # async view also runs in an event loop of its own, which would open an
+    # asyncio Redis pool of its own and never close it, so those views read
+    # through the sync pool from a thread instead.
+    return isinstance(request, ASGIRequest)
+
+
+def _stream_task_list(request, sort_by, sort_order, filters, filter_query):
+    if _serves_async(request):
+        iter_tasks = (
+            aiter_tasks_from_archive if _archived() else aiter_tasks_from_db
+        )
+    else:
+        iter_tasks = (
+            iter_tasks_from_archive if _archived() else iter_tasks_from_db
+        )
+    tasks = iter_tasks(
+        settings, sort_by=sort_by, sort_order=sort_order, filters=filters
     )
 
     context = {
-        "tasks": tasks,
         "sort_by": sort_by,
         "sort_order": sort_order,
+        "stream": True,
+        "filters": filter_query,
+        "statuses": sorted(states.ALL_STATES),
+        "live": settings.WEB_ASGI,
+        "keep_query": urlencode({"stream": 1, **filter_query}),
+        "rows_marker": ROWS_MARKER,
     }
+    page = render_to_string("pages/tasks.html", context, request)
+    head, tail = page.split(ROWS_MARKER)
+    rows_template = get_template("pages/task_rows.html")
 
-    return render(request, "pages/tasks.html", context)
+    chunk_size = settings.TASKS_FETCH_CHUNK_SIZE
+
+    def render_page():
+        # The head and table header go out before any task is fetched, then
+        # rows follow one chunk at a time as they're read from Redis.
+        yield head
+        chunk = []
+        for task in tasks:
+            chunk.append(task)
+            if len(chunk) == chunk_size:
+                yield rows_template.render({"tasks": chunk})
+                chunk = []
+        if chunk:
+            yield rows_template.render({"tasks": chunk})
+        yield tail
+
+    async def arender_page():
+        yield head
+        chunk = []
+        async for task in tasks:
+            chunk.append(task)
+            if len(chunk) == chunk_size:
+                yield rows_template.render({"tasks": chunk})
+                chunk = []
+        if chunk:
+            yield rows_template.render({"tasks": chunk})
+        yield tail
+
+    if _serves_async(request):
+        return StreamingHttpResponse(arender_page())
+    return StreamingHttpResponse(render_page())
+
+
+async def task_export(request):
+    """
+    Stream every task as CSV or NDJSON (?format=), from Redis or from the
+    archive (?source=, TASK_LIST_SOURCE by default). Tasks are read and
+    written out one chunk at a time so memory stays the same however many
+    there are.
+    """
+    export_format = request.GET.get("format")
+    if export_format not in EXPORT_FORMATS:
+        export_format = "csv"
+
+    chunk_size = settings.TASKS_FETCH_CHUNK_SIZE
+    archived = (
+        request.GET.get("source", settings.TASK_LIST_SOURCE) == "postgres"
+    )
+    if _serves_async(request):
+        aread = aiter_tasks_from_archive if archived else ascan_tasks
+        content = aexport_tasks(
+            aread(settings, chunk_size=chunk_size), export_format, chunk_size
+        )
+    else:
+        read = iter_tasks_from_archive if archived else scan_tasks
+        content = export_tasks(
+            read(settings, chunk_size=chunk_size), export_format, chunk_size
+        )
+
+    response = StreamingHttpResponse(
+        content,
+        content_type=f"{EXPORT_FORMATS[export_format]}; charset=utf-8",
+    )
+    response["Content-Disposition"] = (
+        f'attachment; filename="tasks.{export_format}"'
+    )
+    return response
+
+
+async def task_events(request):
+    """
+    Stream task completions and changes as Server-Sent Events. Each open
+    stream only waits on a queue, so it ties up neither a worker nor a Redis
+    connection of its own (this needs the ASGI worker, see WEB_ASGI).
+    """
+
+    async def stream():
+        # Browsers reconnect by themselves if the stream breaks.
+        yield f"retry: {settings.TASK_EVENTS_RETRY}\n\n"
+        async with subscribe_task_events() as queue:
+            while True:
+                try:
+                    event = await asyncio.wait_for(
+                        queue.get(), settings.TASK_EVENTS_KEEPALIVE
+                    )
+                except TimeoutError:
+                    # Comments keep proxies from closing an idle stream.
+                    yield ": keepalive\n\n"
+                    continue
+
+                yield f"data: {event.decode()}\n\n"
+
+    response = StreamingHttpResponse(
+        stream(), content_type="text/event-stream"
+    )
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+def _get_int(request, name, default):
+    try:
+        return int(request.GET.get(name, default))
+    except ValueError:
+        return default
 
 
 @require_POST
-def update_task_status(request):
+async def update_task_status(request):
     try:
         data = json.loads(request.body)
-        task_id = data.get("task_id")
-        completed = data.get("completed")
+        if isinstance(data, dict) and "updates" in data:
+            return await _update_task_statuses(request, data["updates"])
+
+        if error := _update_error(data):
+            return JsonResponse({"success": False, "error": error}, status=400)
 
-        if task_id is None or completed is None:
+        updated = await _update_tasks(
+            request, [(data["task_id"], {"completed": data["completed"]})]
+        )
+        if not updated[0]:
             return JsonResponse(
-                {"success": False, "error": "Missing parameters"}, status=400
+                {"success": False, "error": "Task not found"}, status=404
             )
 
-        update_task_in_db(settings, task_id, {"completed": completed})
-
         return JsonResponse({"success": True})
     except json.JSONDecodeError:
         return JsonResponse(
@@ -82,3 +474,67 @@ def update_task_status(request):
         )
     except Exception as e:
         return JsonResponse({"success": False, "error": str(e)}, status=500)
+
+
+def _update_error(update):
+    """Say what's wrong with an update, if anything."""
+    if not isinstance(update, dict):
+        return "Invalid parameters"
+    if update.get("task_id") is None or update.get("completed") is None:
+        return "Missing parameters"
+    # Anything else would be stored as is, or fail to match the archive.
+    if not isinstance(update["task_id"], str) or not isinstance(
+        update["completed"], bool
+    ):
+        return "Invalid parameters"
+    return None
+
+
+async def _update_task_statuses(request, updates):
+    # A page never has more checkboxes on it than the max page size.
+    if (
+        not isinstance(updates, list)
+        or len(updates) > settings.TASKS_MAX_PAGE_SIZE
+    ):
+        return JsonResponse(
+            {"success": False, "error": "Invalid updates"}, status=400
+        )
+
+    results = []
+    pending = []
+    for update in updates:
+        if not isinstance(update, dict):
+            update = {}
+        result = {"task_id": update.get("task_id"), "success": True}
+        results.append(result)
+
+        if error := _update_error(update):
+            result.update(success=False, error=error)
+        else:
+            pending.append((result, update))
+
+    if pending:
+        updated = await _update_tasks(
+            request,
+            [
+                (update["task_id"], {"completed": update["completed"]})
+                for _, update in pending
+            ],
+        )
+        for (result, _), found in zip(pending, updated):
+            if not found:
+                result.update(success=False, error="Task not found")
+
+    return JsonResponse(
+        {
+            "success": all(result["success"] for result in results),
+            "results": results,
+        }
+    )
+
+
+async def _update_tasks(request, updates):
+    if _serves_async(request):
+        return await aupdate_tasks_in_db(settings, updates)
+
+    return await sync_to_async(update_tasks_in_db)(settings, updates)
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class UpConfig(AppConfig):
     name = "up"
+
+    def ready(self):
+        # Hooks the metrics up to Redis, the database and Celery.
+        import config.metrics  # noqa: F401
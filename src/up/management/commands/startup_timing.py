@@ -0,0 +1,90 @@
+import json
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        "Start the app in a fresh interpreter and report how long importing "
+        "it, setting up each app and warming up took"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--json", action="store_true")
+        parser.add_argument(
+            "--top",
+            type=int,
+            default=10,
+            help="How many of the slowest imports to list",
+        )
+
+    def handle(self, *args, **options):
+        process = subprocess.run(
+            [sys.executable, "-X", "importtime", "-m", "config.startup"],
+            cwd=settings.BASE_DIR,
+            capture_output=True,
+            text=True,
+        )
+        if process.returncode:
+            raise CommandError(f"Starting the app failed:\n{process.stderr}")
+
+        report = json.loads(process.stdout)
+        imports = parse_importtime(process.stderr)
+        report["imports"] = sum(seconds for _, seconds in imports)
+        report["slowest_imports"] = sorted(
+            imports, key=lambda item: item[1], reverse=True
+        )[: options["top"]]
+
+        if options["json"]:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.write_report(report)
+
+    def write_report(self, report):
+        def ms(seconds):
+            return f"{seconds * 1000:.1f} ms"
+
+        write = self.stdout.write
+        write(f"Imports: {ms(report['imports'])}")
+        write(f"Settings: {ms(report['settings'])}")
+        write(f"django.setup(): {ms(report['setup'])}")
+        for label, timing in report["apps"].items():
+            write(
+                f"  {label:<16} import {ms(timing['import'])}, "
+                f"models {ms(timing['import_models'])}, "
+                f"ready {ms(timing['ready'])}"
+            )
+        write(f"Middleware: {ms(report['middleware'])}")
+        write(f"URLs: {ms(report['urls'])}")
+        write(
+            "Warm-up: "
+            + ", ".join(
+                f"{step} {ms(seconds)}"
+                for step, seconds in report["warm_up"].items()
+            )
+        )
+        write("Slowest imports:")
+        for module, seconds in report["slowest_imports"]:
+            write(f"  {ms(seconds):>10}  {module}")
+
+
+def parse_importtime(output):
+    """
+    Return (module, seconds) for every module imported at the top level in
+    the output of python -X importtime, including what each imported.
+    """
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+
+        _, cumulative, module = line.removeprefix("import time:").split("|")
+        # Modules imported by others are indented under them.
+        if module.startswith("  ") or not cumulative.strip().isdigit():
+            continue
+        imports.append((module.strip(), int(cumulative) / 1_000_000))
+
+    return imports
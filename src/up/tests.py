@@ -1,42 +1,164 @@
-from unittest.mock import patch
+import asyncio
+import json
+from io import StringIO
+from unittest.mock import AsyncMock, patch
 
 from django.apps import apps
+from django.core.management import call_command
 from django.db import OperationalError
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from redis.exceptions import ConnectionError
 
+from up import views
 from up.apps import UpConfig
+from up.management.commands.startup_timing import parse_importtime
 
 
 class ViewTests(TestCase):
+    def setUp(self):
+        views._last_check = None
+        self.addCleanup(setattr, views, "_last_check", None)
+
+        # The test client is WSGI, which pings Redis through the sync pool,
+        # and async_client is ASGI.
+        redis = patch("up.views.get_redis")
+        self.mock_get_redis = redis.start()
+        self.addCleanup(redis.stop)
+
+        aredis = patch("up.views.get_async_redis")
+        self.mock_get_async_redis = aredis.start()
+        self.mock_get_async_redis.return_value.ping = AsyncMock(
+            return_value=True
+        )
+        self.addCleanup(aredis.stop)
+
     def test_up(self):
         """Up should respond with a success 200."""
         response = self.client.get("/up/", follow=True)
         self.assertEqual(response.status_code, 200)
 
-    @patch("up.views.redis")
-    def test_up_databases(self, mock_redis):
+    def test_up_metrics(self):
+        """Metrics should include the Celery queue length."""
+        with patch("config.metrics.get_redis") as mock_get_redis:
+            mock_get_redis.return_value.llen.return_value = 3
+            response = self.client.get("/up/metrics")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('celery_queue_length{queue="celery"} 3.0', response.text)
+        self.assertIn("django_view_duration_seconds", response.text)
+
+    def test_up_databases(self):
         """Up databases should respond with a success 200."""
-        mock_redis.ping.return_value = True
         response = self.client.get("/up/databases", follow=True)
         self.assertEqual(response.status_code, 200)
 
-    @patch("up.views.redis.ping", side_effect=ConnectionError)
-    def test_up_databases_redis_error(self, mock_redis_ping):
-        """Up databases should respond with a 500 if redis is down."""
-        with self.assertRaises(ConnectionError):
-            self.client.get("/up/databases", follow=True)
+        data = response.json()
+        self.assertEqual(data.keys(), {"redis", "postgres"})
+        for result in data.values():
+            self.assertTrue(result["healthy"])
+            self.assertGreaterEqual(result["latency_ms"], 0)
+        self.mock_get_redis.return_value.ping.assert_called_once_with()
+
+    async def test_up_databases_asgi(self):
+        response = await self.async_client.get("/up/databases")
+        self.assertEqual(response.status_code, 200)
+        self.mock_get_async_redis.return_value.ping.assert_awaited_once()
+        self.mock_get_redis.assert_not_called()
+
+    def test_up_databases_redis_error(self):
+        """Up databases should respond with a 503 if redis is down."""
+        self.mock_get_redis.return_value.ping.side_effect = ConnectionError
+        response = self.client.get("/up/databases", follow=True)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()["redis"]["error"], "ConnectionError")
+        self.assertTrue(response.json()["postgres"]["healthy"])
 
     @patch(
-        "django.db.connection.ensure_connection", side_effect=OperationalError
+        "django.db.backends.base.base.BaseDatabaseWrapper.ensure_connection",
+        side_effect=OperationalError,
     )
     def test_up_databases_db_error(self, mock_db_connection):
-        """Up databases should respond with a 500 if the db is down."""
-        with self.assertRaises(OperationalError):
-            self.client.get("/up/databases", follow=True)
+        """Up databases should respond with a 503 if the db is down."""
+        response = self.client.get("/up/databases", follow=True)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(
+            response.json()["postgres"],
+            {
+                "healthy": False,
+                "error": "OperationalError",
+                "latency_ms": response.json()["postgres"]["latency_ms"],
+            },
+        )
+
+    def test_up_databases_closes_its_connection(self):
+        """The Postgres probe connects on its own and closes after."""
+        with patch("up.views.connections.create_connection") as mock_create:
+            response = self.client.get("/up/databases", follow=True)
+
+        self.assertTrue(response.json()["postgres"]["healthy"])
+        mock_create.assert_called_once_with("default")
+        probe = mock_create.return_value
+        probe.ensure_connection.assert_called_once_with()
+        probe.close.assert_called_once_with()
+
+    @override_settings(UP_REDIS_TIMEOUT=0.01)
+    async def test_up_databases_timeout(self):
+        """A dependency that hangs is reported down once it times out."""
+
+        async def hang():
+            await asyncio.sleep(1)
+
+        self.mock_get_async_redis.return_value.ping.side_effect = hang
+        response = await self.async_client.get("/up/databases", follow=True)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()["redis"]["error"], "Timed out")
+        self.assertLess(response.json()["redis"]["latency_ms"], 1000)
+
+    def test_up_databases_cached(self):
+        """Results are reused until UP_CACHE_TIMEOUT runs out."""
+        ping = self.mock_get_redis.return_value.ping
+        self.client.get("/up/databases", follow=True)
+        self.client.get("/up/databases", follow=True)
+        self.assertEqual(ping.call_count, 1)
+
+    @override_settings(UP_CACHE_TIMEOUT=0)
+    def test_up_databases_not_cached(self):
+        ping = self.mock_get_redis.return_value.ping
+        self.client.get("/up/databases", follow=True)
+        self.client.get("/up/databases", follow=True)
+        self.assertEqual(ping.call_count, 2)
 
 
 class UpConfigTests(TestCase):
     def test_apps(self):
         self.assertEqual(UpConfig.name, "up")
         self.assertEqual(apps.get_app_config("up").name, "up")
+
+
+class StartupTimingTests(TestCase):
+    def test_parse_importtime(self):
+        output = "\n".join(
+            [
+                "import time: self [us] | cumulative | imported package",
+                "import time:       100 |        100 |   _io",
+                "import time:       200 |       1500 | django",
+                "Warming up redis failed",
+                "import time:        50 |        250 | config",
+            ]
+        )
+        self.assertEqual(
+            parse_importtime(output), [("django", 0.0015), ("config", 0.00025)]
+        )
+
+    def test_startup_timing(self):
+        stdout = StringIO()
+        call_command("startup_timing", "--json", top=3, stdout=stdout)
+
+        report = json.loads(stdout.getvalue())
+        self.assertIn("pages", report["apps"])
+        self.assertEqual(
+            set(report["apps"]["pages"]), {"import", "import_models", "ready"}
+        )
+        self.assertEqual(len(report["slowest_imports"]), 3)
+        self.assertGreater(report["imports"], 0)
+        self.assertIn("templates", report["warm_up"])
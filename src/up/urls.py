@@ -5,4 +5,5 @@ from up import views
 urlpatterns = [
     path("", views.index, name="index"),
     path("databases", views.databases, name="databases"),
+    path("metrics", views.metrics, name="metrics"),
 ]
@@ -1,17 +1,99 @@
+import asyncio
+import time
+
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from django.db import connection
-from django.http import HttpResponse
-from redis import Redis
+from django.core.handlers.asgi import ASGIRequest
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.http import HttpResponse, JsonResponse
+from prometheus_client import CONTENT_TYPE_LATEST
 
-redis = Redis.from_url(settings.REDIS_URL)
+from config.metrics import render_metrics
+from config.redis import get_async_redis, get_redis
 
 
 def index(request):
     return HttpResponse("")
 
 
-def databases(request):
-    redis.ping()
-    connection.ensure_connection()
+def metrics(request):
+    return HttpResponse(render_metrics(), content_type=CONTENT_TYPE_LATEST)
 
-    return HttpResponse("")
+
+async def databases(request):
+    results = await _check_dependencies(isinstance(request, ASGIRequest))
+    healthy = all(result["healthy"] for result in results.values())
+
+    return JsonResponse(results, status=200 if healthy else 503)
+
+
+async def _ping_redis(asgi):
+    if asgi:
+        await get_async_redis().ping()
+    else:
+        # Under WSGI every request runs in an event loop of its own, which
+        # would get an asyncio pool of its own that's never closed.
+        await sync_to_async(get_redis().ping, thread_sensitive=False)()
+
+
+async def _ping_postgres(asgi):
+    # Off the thread the ORM shares with sync views, so a database that's
+    # slow to answer holds up nothing but the probe.
+    await sync_to_async(_connect_postgres, thread_sensitive=False)()
+
+
+def _connect_postgres():
+    # A connection of its own, as the ORM would keep one open for good in
+    # every thread of the executor that runs this.
+    probe = connections.create_connection(DEFAULT_DB_ALIAS)
+    try:
+        probe.ensure_connection()
+    finally:
+        probe.close()
+
+
+# Each dependency gets its own deadline so a stuck one can't use up the time
+# of the others. Names map to (probe, name of the timeout setting), and each
+# probe is told whether it's running under an ASGI worker.
+PROBES = {
+    "redis": (_ping_redis, "UP_REDIS_TIMEOUT"),
+    "postgres": (_ping_postgres, "UP_POSTGRES_TIMEOUT"),
+}
+
+# The last results and the time.monotonic() they're good until. It's kept
+# per process, which is plenty to absorb a burst of health checks.
+_last_check = None
+
+
+async def _check_dependencies(asgi):
+    global _last_check
+
+    if _last_check is not None and time.monotonic() < _last_check[0]:
+        return _last_check[1]
+
+    results = await asyncio.gather(
+        *(
+            _probe(probe(asgi), getattr(settings, timeout))
+            for probe, timeout in PROBES.values()
+        )
+    )
+    results = dict(zip(PROBES, results))
+
+    _last_check = (time.monotonic() + settings.UP_CACHE_TIMEOUT, results)
+    return results
+
+
+async def _probe(probe, timeout):
+    started = time.perf_counter()
+    result = {"healthy": True}
+
+    try:
+        await asyncio.wait_for(probe, timeout)
+    except TimeoutError:
+        result.update(healthy=False, error="Timed out")
+    except Exception as e:
+        # Only the kind of error, the message could give away hostnames.
+        result.update(healthy=False, error=type(e).__name__)
+
+    result["latency_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    return result